@@ -0,0 +1,157 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Local stand-in for the bedrock-runtime InvokeModel API, answering with payloads shaped like the real
+# responses of each provider after a configurable latency. Point a client at it with the endpoint url,
+# for example AWS_ENDPOINT_URL_BEDROCK_RUNTIME=http://127.0.0.1:<port>.
+#
+# Usage: python benchmarks/fake_bedrock_runtime.py --port 0 --latency 0.05
+# The bound port is printed on the first line of stdout.
+import json
+import time
+import uuid
+import base64
+import random
+import argparse
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COMPLETION_WORDS = 300
+SDXL_IMAGE_BYTES = 400*1024
+
+WORDS = ( 'the revenue growth of the quarter was driven by strong demand in cloud services while operating income '
+          'improved as fulfillment costs declined and the company invested in new regions and generative models' ).split()
+
+
+def make_completion(word_count=COMPLETION_WORDS):
+    return ' '.join(random.choice(WORDS) for i in range(word_count))
+
+def make_ai21_tokens(text):
+    # AI21 returns every generated token with its log probabilities, which makes its responses large
+    tokens = []
+    offset = 0
+    for word in text.split():
+        tokens.append({ 'generatedToken': { 'token': '▁' + word, 'logprob': -random.random(), 'raw_logprob': -random.random() },
+                        'topTokens': None, 'textRange': { 'start': offset, 'end': offset + len(word) + 1 } })
+        offset += len(word) + 1
+    return tokens
+
+def make_response(model_id, request):
+    completion = make_completion()
+    input_tokens = random.randint(200, 2000)
+    output_tokens = len(completion.split())*4//3
+
+    if 'claude-3' in model_id:
+        body = { 'id': 'msg_' + uuid.uuid4().hex, 'type': 'message', 'role': 'assistant', 'model': model_id,
+                 'content': [ { 'type': 'text', 'text': completion } ], 'stop_reason': 'end_turn', 'stop_sequence': None,
+                 'usage': { 'input_tokens': input_tokens, 'output_tokens': output_tokens } }
+    elif 'anthropic' in model_id:
+        body = { 'completion': ' ' + completion, 'stop_reason': 'stop_sequence', 'stop': '\n\nHuman:' }
+    elif 'titan' in model_id:
+        body = { 'inputTextTokenCount': input_tokens,
+                 'results': [ { 'tokenCount': output_tokens, 'outputText': completion, 'completionReason': 'FINISH' } ] }
+    elif 'ai21' in model_id:
+        body = { 'id': random.randint(1000, 9999), 'prompt': { 'text': request.get('prompt', ''), 'tokens': make_ai21_tokens(request.get('prompt', '')) },
+                 'completions': [ { 'data': { 'text': completion, 'tokens': make_ai21_tokens(completion) }, 'finishReason': { 'reason': 'endoftext' } } ] }
+    elif 'llama' in model_id:
+        body = { 'generation': completion, 'prompt_token_count': input_tokens, 'generation_token_count': output_tokens, 'stop_reason': 'stop' }
+    elif 'mistral' in model_id or 'mixtral' in model_id:
+        body = { 'outputs': [ { 'text': completion, 'stop_reason': 'stop' } ] }
+    elif 'cohere' in model_id:
+        body = { 'id': str(uuid.uuid4()), 'prompt': request.get('prompt', ''),
+                 'generations': [ { 'id': str(uuid.uuid4()), 'text': completion, 'finish_reason': 'COMPLETE' } ] }
+    elif 'stable-diffusion' in model_id:
+        body = { 'result': 'success', 'artifacts': [ { 'seed': request.get('seed', 0), 'finishReason': 'SUCCESS',
+                 'base64': base64.b64encode(random.randbytes(SDXL_IMAGE_BYTES)).decode('ascii') } ] }
+        output_tokens = 0
+    else:
+        return None, 0, 0
+    return body, input_tokens, output_tokens
+
+
+class FakeBedrockRuntimeHandler(BaseHTTPRequestHandler):
+
+    latency = 0.0
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes, without this delayed acks add 40ms to each call
+    disable_nagle_algorithm = True
+
+    def send_json(self, status, body, headers={}):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('x-amzn-RequestId', str(uuid.uuid4()))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_error_code(self, status, error_code, message):
+        self.send_json(status, { 'message': message }, { 'x-amzn-ErrorType': error_code })
+
+    def do_POST(self):
+        request_body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        path_parts = self.path.split('/')
+        if len(path_parts) != 4 or path_parts[1] != 'model' or path_parts[3] != 'invoke':
+            self.send_error_code(404, 'UnknownOperationException', 'Only InvokeModel is supported')
+            return
+
+        # Bodies that are not valid JSON are rejected like Bedrock does
+        try:
+            request = json.loads(request_body)
+        except ValueError as e1:
+            self.send_error_code(400, 'ValidationException', 'Malformed input request: {}'.format(e1))
+            return
+
+        model_id = urllib.parse.unquote(path_parts[2])
+        body, input_tokens, output_tokens = make_response(model_id, request)
+        if body is None:
+            self.send_error_code(400, 'ValidationException', 'The provided model identifier is invalid.')
+            return
+
+        time.sleep(self.latency)
+        self.send_json(200, body, { 'x-amzn-bedrock-input-token-count': str(input_tokens),
+                                    'x-amzn-bedrock-output-token-count': str(output_tokens),
+                                    'x-amzn-bedrock-invocation-latency': str(int(self.latency*1000)) })
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeBedrockRuntimeServer(ThreadingHTTPServer):
+
+    # Room for 64 concurrent callers connecting at once
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the bedrock-runtime InvokeModel API')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds before each response')
+    args = parser.parse_args()
+
+    FakeBedrockRuntimeHandler.latency = args.latency
+    server = FakeBedrockRuntimeServer(('127.0.0.1', args.port), FakeBedrockRuntimeHandler)
+    print(server.server_address[1], flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Benchmark of the model invocation layer of gen_ai_selector, per provider path, against the local
+# bedrock-runtime stand-in in benchmarks/fake_bedrock_runtime.py running in its own process. The real
+# botocore client is used, so the numbers include request signing, body building, logging, response
+# parsing and cost bookkeeping, but not the network or the model.
+#
+# Reports per call: CPU time of this process, peak traced allocations, and throughput and latency
+# with 1, 8 and 64 concurrent callers. Save the results with --output and gate a CI run with --baseline,
+# the run fails when the CPU per call of a provider grows by more than --max-regression.
+#
+# Usage, from the repo root: python benchmarks/invocation_layer.py --calls 50 --latency 0.05
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import statistics
+import subprocess
+import tracemalloc
+import concurrent.futures
+from unittest import mock
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONCURRENCY_LEVELS = [ 1, 8, 64 ]
+
+# Provider path name and the gen_ai_selector function invoking it
+PROVIDER_FUNCTIONS = [
+    ('titan', 'call_bedrock_titan_text_express_model'),
+    ('claude', 'call_bedrock_claude_model_v2'),
+    ('claude-3', 'call_bedrock_claude_model_v3'),
+    ('ai21', 'call_bedrock_j2_ultra_model'),
+    ('llama2', 'call_bedrock_llama_2_13b'),
+    ('mistral', 'call_bedrock_mistral_7b'),
+    ('cohere', 'call_bedrock_cohere_text_v14'),
+    ('sdxl', 'call_bedrock_sdxl_model')
+]
+
+PROMPT_TEXT = ' '.join([ 'Summarize the key points of this quarterly report for an investor audience.' ]*40)
+
+
+def start_fake_runtime(latency):
+    process = subprocess.Popen([ sys.executable, os.path.join(REPO_ROOT, 'benchmarks', 'fake_bedrock_runtime.py'), '--latency', str(latency) ],
+                               stdout=subprocess.PIPE, text=True)
+    port = int(process.stdout.readline())
+    return process, 'http://127.0.0.1:{}'.format(port)
+
+def import_gen_ai_selector(endpoint_url, log_level):
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('IAM_ROLE', 'arn:aws:iam::123456789012:role/benchmark')
+    os.environ['AWS_ENDPOINT_URL_BEDROCK_RUNTIME'] = endpoint_url
+    # Measure the invocation path itself, not the queueing for the account quotas
+    os.environ['RATE_LIMIT_ENABLED'] = 'false'
+    os.chdir(REPO_ROOT)
+    sys.path.insert(0, REPO_ROOT)
+
+    # Static credentials instead of the assumed role, the stand-in does not check signatures
+    import boto3
+    mock.patch('pages.imports.sts_assume_role.run_autorefresh_session',
+               side_effect=lambda: boto3.session.Session(region_name=os.environ['AWS_DEFAULT_REGION'])).start()
+    import streamlit.logger
+    streamlit.logger.set_log_level('error')
+
+    from utils import gen_ai_selector
+    # Log records are still formatted at the given level, but written to /dev/null
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.StreamHandler):
+            handler.setStream(open(os.devnull, 'w'))
+    logging.getLogger().setLevel(log_level)
+    return gen_ai_selector
+
+def check_response(provider, response):
+    ok = isinstance(response, dict) if provider == 'sdxl' else isinstance(response, str) and not response.startswith('Error')
+    if not ok:
+        raise RuntimeError('Provider {} returned: {}'.format(provider, str(response)[:200]))
+
+def measure_cpu(func, provider, calls):
+    # Sequential calls, the stand-in runs in another process so the CPU time is all client side
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for i in range(calls):
+        check_response(provider, func(PROMPT_TEXT))
+    return { 'cpu_us_per_call': int((time.process_time() - cpu_start)*1e6/calls),
+             'wall_ms_per_call': round((time.perf_counter() - wall_start)*1000/calls, 2) }
+
+def measure_allocations(func, provider, calls):
+    peaks = []
+    tracemalloc.start()
+    try:
+        for i in range(calls):
+            tracemalloc.reset_peak()
+            current_before = tracemalloc.get_traced_memory()[0]
+            check_response(provider, func(PROMPT_TEXT))
+            peaks.append(tracemalloc.get_traced_memory()[1] - current_before)
+    finally:
+        tracemalloc.stop()
+    return { 'peak_alloc_kb_per_call': int(statistics.median(peaks)/1024) }
+
+def measure_throughput(func, provider, concurrency, calls):
+    latencies = []
+
+    def timed_call():
+        start_time = time.perf_counter()
+        check_response(provider, func(PROMPT_TEXT))
+        latencies.append(time.perf_counter() - start_time)
+
+    total_calls = max(calls, concurrency*4)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        for future in [ executor.submit(timed_call) for i in range(total_calls) ]:
+            future.result()
+        elapsed = time.perf_counter() - wall_start
+        cpu_elapsed = time.process_time() - cpu_start
+
+    latencies.sort()
+    return { 'calls_per_second': round(total_calls/elapsed, 1),
+             'cpu_us_per_call': int(cpu_elapsed*1e6/total_calls),
+             'p50_ms': round(latencies[len(latencies)//2]*1000, 1),
+             'p95_ms': round(latencies[int(len(latencies)*0.95) - 1]*1000, 1) }
+
+def run_benchmarks(gen_ai_selector, providers, calls):
+    results = {}
+    for provider, function_name in PROVIDER_FUNCTIONS:
+        if providers and provider not in providers:
+            continue
+        func = getattr(gen_ai_selector, function_name)
+        # Warm up the connection pool and the lazy imports of the path, a broken path is reported and skipped
+        try:
+            for i in range(3):
+                check_response(provider, func(PROMPT_TEXT))
+        except Exception as e1:
+            results[provider] = { 'error': repr(e1) }
+            print('{:9s} failed: {!r}'.format(provider, e1), flush=True)
+            continue
+
+        result = measure_cpu(func, provider, calls)
+        result.update(measure_allocations(func, provider, max(calls//5, 5)))
+        result['concurrency'] = { str(concurrency): measure_throughput(func, provider, concurrency, calls) for concurrency in CONCURRENCY_LEVELS }
+        results[provider] = result
+        print('{:9s} cpu {:6d}us/call, peak alloc {:6d}KB/call, '.format(provider, result['cpu_us_per_call'], result['peak_alloc_kb_per_call']) +
+              ', '.join('{}x {:7.1f}/s p95 {:6.1f}ms'.format(concurrency, stats['calls_per_second'], stats['p95_ms'])
+                        for concurrency, stats in result['concurrency'].items()), flush=True)
+    return results
+
+def find_regressions(results, baseline, max_regression):
+    regressions = []
+    for provider, result in results.items():
+        if 'error' in result:
+            regressions.append('{}: {}'.format(provider, result['error']))
+            continue
+        baseline_cpu = baseline.get(provider, {}).get('cpu_us_per_call')
+        if baseline_cpu and result['cpu_us_per_call'] > baseline_cpu*(1 + max_regression):
+            regressions.append('{}: {}us/call vs baseline {}us/call'.format(provider, result['cpu_us_per_call'], baseline_cpu))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='CPU, allocations and throughput per provider path of gen_ai_selector')
+    parser.add_argument('--calls', type=int, default=50, help='Calls per measurement')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds the stand-in waits before each response')
+    parser.add_argument('--providers', nargs='*', default=[], help='Subset of: ' + ', '.join(provider for provider, name in PROVIDER_FUNCTIONS))
+    parser.add_argument('--log-level', default='INFO', help='Level of the gen-ai-invoker logs, INFO as deployed')
+    parser.add_argument('--output', help='Write the results as json to this file')
+    parser.add_argument('--baseline', help='Results json of a previous run to compare with')
+    parser.add_argument('--max-regression', type=float, default=0.25, help='Allowed growth of the CPU per call over the baseline')
+    args = parser.parse_args()
+
+    process, endpoint_url = start_fake_runtime(args.latency)
+    try:
+        gen_ai_selector = import_gen_ai_selector(endpoint_url, args.log_level)
+        results = run_benchmarks(gen_ai_selector, args.providers, args.calls)
+    finally:
+        process.terminate()
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file), args.max_regression)
+        if regressions:
+            print('CPU regressions over {:.0%}:\n  '.format(args.max_regression) + '\n  '.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Startup benchmark for the model catalog: time from a fresh process to the model list a page renders.
+# Compares inline discovery (previous import-time behavior) with the lazy snapshot, using fake AWS
+# clients that sleep to stand in for the Bedrock and SageMaker control plane latency.
+#
+# Usage, from the repo root: python benchmarks/model_catalog_startup.py --runs 5 --latency 0.8
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child process, prints the timings as json on the last line
+CHILD_SCRIPT = '''
+import os, sys, time, json, threading
+start_time = time.time()
+from unittest import mock
+import boto3
+
+latency = float(os.environ['BENCHMARK_CONTROL_PLANE_LATENCY'])
+# Only calls on the main thread block the page, the background refresh runs on its own thread
+calls = []
+
+def record_call(name):
+    if threading.current_thread() is threading.main_thread():
+        calls.append(name)
+
+class FakeClient:
+    def list_foundation_models(self):
+        record_call('list_foundation_models')
+        time.sleep(latency)
+        with open('./utils/model_catalog_snapshot.json') as snapshot_file:
+            return { 'modelSummaries': json.load(snapshot_file)['model_summaries'] }
+
+    def describe_endpoint(self, EndpointName):
+        record_call('describe_endpoint')
+        time.sleep(latency)
+        return { 'EndpointStatus': 'InService' }
+
+class FakeSession:
+    def client(self, *args, **kwargs):
+        return FakeClient()
+
+mock.patch('pages.imports.sts_assume_role.run_autorefresh_session', return_value=FakeSession()).start()
+mock.patch.object(boto3.session.Session, 'client', lambda self, *args, **kwargs: FakeClient()).start()
+
+from utils import gen_ai_selector
+import_time = time.time()
+models = gen_ai_selector.genai_models
+default_index = gen_ai_selector.default_genai_model_index
+first_render_time = time.time()
+
+print(json.dumps({ 'import': import_time - start_time, 'first_render': first_render_time - start_time,
+                    'models': len(models), 'blocking_calls': len(calls) }))
+'''
+
+
+def run_child(mode, latency, snapshot_path):
+    env = dict(os.environ)
+    env.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    env.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    env.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    env.setdefault('IAM_ROLE', 'arn:aws:iam::123456789012:role/benchmark')
+    env['JUMPSTART_MODEL_ENDPOINT'] = 'benchmark-endpoint'
+    env['PREFERRED_JUMPSTART_MODEL_TYPE'] = 'llama-2-13b-chat'
+    env['BENCHMARK_CONTROL_PLANE_LATENCY'] = str(latency)
+    env['MODEL_CATALOG_SNAPSHOT'] = snapshot_path
+    env['MODEL_CATALOG_SYNC_DISCOVERY'] = 'true' if mode == 'eager' else 'false'
+    if os.path.exists(snapshot_path):
+        os.remove(snapshot_path)
+
+    output = subprocess.run([sys.executable, '-c', CHILD_SCRIPT], cwd=REPO_ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='Time to first render of the model list, eager vs lazy model catalog')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.8, help='Seconds per fake control plane call')
+    args = parser.parse_args()
+
+    snapshot_path = os.path.join(tempfile.mkdtemp(), 'gen-ai-model-catalog.json')
+    for mode in [ 'eager', 'lazy' ]:
+        results = [ run_child(mode, args.latency, snapshot_path) for i in range(args.runs) ]
+        first_render = [ result['first_render'] for result in results ]
+        print('{:6s} first render: median {:.3f}s, max {:.3f}s, import {:.3f}s, blocking calls {}, models {}'.format(
+                mode, statistics.median(first_render), max(first_render),
+                statistics.median([ result['import'] for result in results ]),
+                results[0]['blocking_calls'], results[0]['models']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Microbenchmark of the request encoding and response decoding of utils/model_codec against the string
+# concatenation the Titan and AI21 paths used before, for prompts of 20k to 50k characters. Runs without
+# AWS access, the responses are shaped like the ones of benchmarks/fake_bedrock_runtime.py.
+#
+# Usage, from the repo root: python benchmarks/model_codec.py --repeat 200
+import io
+import os
+import sys
+import json
+import timeit
+import argparse
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, 'benchmarks'))
+
+from utils import model_codec
+import fake_bedrock_runtime
+
+PROMPT_SIZES = [ 20000, 35000, 50000 ]
+PROMPT_LINE = 'Revenue for the quarter grew 12% to $4.2B, driven by cloud services.\n'
+
+
+def legacy_titan_request(prompt_text, max_tokens=4096, temperature=0.5, top_p=0.9, stop_sequences=[]):
+    prompt_text = prompt_text.replace('\n', ' ')
+    body_string = "{\"inputText\":\"" + f"{prompt_text}" +\
+                    "\",\"textGenerationConfig\":{" +\
+                    "\"maxTokenCount\":" + f"{max_tokens}" +\
+                    ",\"topP\":" + f"{top_p}" +\
+                    ",\"stopSequences\":" + f"{stop_sequences}" +\
+                    ",\"temperature\":" + f"{temperature}" +\
+                    "}}"
+    return bytes(body_string, 'utf-8')
+
+def legacy_ai21_request(prompt_text, max_tokens=500, temperature=1, top_p=1, stop_sequences=[], countPenalty=0, presencePenalty=0, frequencyPenalty=0):
+    prompt_text = prompt_text.replace('\n', ' ').replace('\t', ' ')
+    body_string = "{\"prompt\":\"" + f"{prompt_text}" + "\"" +\
+                    ",\"maxTokens\":" + f"{max_tokens}" +\
+                    ",\"temperature\":"  + f"{temperature}" +\
+                    ",\"topP\":" + f"{top_p}" +\
+                    ",\"stopSequences\": " + f"{stop_sequences}" +\
+                    ",\"countPenalty\":{\"scale\": " + f"{countPenalty}" + "}" +\
+                    ",\"presencePenalty\":{\"scale\": " + f"{presencePenalty}" + "}" +\
+                    ",\"frequencyPenalty\":{\"scale\": " + f"{frequencyPenalty}" + "}" +\
+                    "}"
+    return bytes(body_string, 'utf-8')
+
+def legacy_titan_response(response_bytes):
+    json_str = io.BytesIO(response_bytes).read().decode('utf-8')
+    return json.loads(json_str)['results'][0]['outputText'].strip('\"')
+
+def legacy_ai21_response(response_bytes):
+    response_lines = io.BytesIO(response_bytes).readlines()
+    json_str = response_lines[0].decode('utf-8')
+    return json.loads(json_str)['completions'][0]['data']['text']
+
+def codec_titan_request(prompt_text):
+    return model_codec.dumps(model_codec.titan_text_request(prompt_text, 4096, 0.5, 0.9, []))
+
+def codec_ai21_request(prompt_text):
+    return model_codec.dumps(model_codec.ai21_request(prompt_text, 500, 1, 1, [], 0, 0, 0))
+
+def codec_titan_response(response_bytes):
+    return model_codec.read_json(io.BytesIO(response_bytes))['results'][0]['outputText']
+
+def codec_ai21_response(response_bytes):
+    return model_codec.read_json(io.BytesIO(response_bytes))['completions'][0]['data']['text']
+
+def make_response_bytes(model_id, prompt_text):
+    body, input_tokens, output_tokens = fake_bedrock_runtime.make_response(model_id, { 'prompt': prompt_text })
+    return json.dumps(body).encode('utf-8')
+
+def time_per_call(func, arg, repeat):
+    return min(timeit.repeat(lambda: func(arg), number=repeat, repeat=3))/repeat*1e6
+
+def main():
+    parser = argparse.ArgumentParser(description='Request encoding and response decoding per call, legacy string building vs model_codec')
+    parser.add_argument('--repeat', type=int, default=200, help='Calls per measurement')
+    args = parser.parse_args()
+
+    print('json library: {}'.format('orjson' if model_codec.orjson is not None else 'json (stdlib)'))
+    cases = [
+        ('titan', 'amazon.titan-text-express-v1', legacy_titan_request, codec_titan_request, legacy_titan_response, codec_titan_response),
+        ('ai21', 'ai21.j2-ultra-v1', legacy_ai21_request, codec_ai21_request, legacy_ai21_response, codec_ai21_response)
+    ]
+    for prompt_size in PROMPT_SIZES:
+        prompt_text = (PROMPT_LINE*(prompt_size//len(PROMPT_LINE) + 1))[:prompt_size]
+        for name, model_id, legacy_request, codec_request, legacy_response, codec_response in cases:
+            # The codec body must decode to the prompt as given, newlines and quotes included
+            request = model_codec.loads(codec_request(prompt_text))
+            assert request.get('inputText', request.get('prompt')) == prompt_text
+
+            response_bytes = make_response_bytes(model_id, prompt_text)
+            encode_legacy = time_per_call(legacy_request, prompt_text, args.repeat)
+            encode_codec = time_per_call(codec_request, prompt_text, args.repeat)
+            decode_legacy = time_per_call(legacy_response, response_bytes, args.repeat)
+            decode_codec = time_per_call(codec_response, response_bytes, args.repeat)
+            print('{:6s} {:6d} chars: encode {:7.1f}us -> {:7.1f}us, decode {:5d}KB {:8.1f}us -> {:8.1f}us, saved {:8.1f}us/call'.format(
+                name, prompt_size, encode_legacy, encode_codec, len(response_bytes)//1024, decode_legacy, decode_codec,
+                encode_legacy + decode_legacy - encode_codec - decode_codec))
+
+
+if __name__ == '__main__':
+    main()
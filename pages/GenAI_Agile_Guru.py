@@ -22,13 +22,11 @@ import streamlit as st
 import os
 from utils import gen_ai_selector
 from utils import cognito_helper
+from utils import aws_session_helper
 
-import pages.imports.sts_assume_role as boto3_session
 
-
-autorefresh_session = boto3_session.run_autorefresh_session()
-s3 = autorefresh_session.client('s3')
-comprehend = autorefresh_session.client('comprehend')
+s3 = aws_session_helper.get_client('s3')
+comprehend = aws_session_helper.get_client('comprehend')
 
 
 if 'user_stories' not in st.session_state:
@@ -81,10 +79,9 @@ models = gen_ai_selector.genai_model_functions
 
 
 
-def GetAnswers(query):
+def GetAnswers(query, container):
     us_answer = None
-    func = models[model]['func']
-    generated_text = func('Create 5 agile scrum user stories and acceptance criteria for each user story in '+language+' for '+ query.strip("query:"))
+    generated_text = gen_ai_selector.write_stream(models[model], 'Create 5 agile scrum user stories and acceptance criteria for each user story in '+language+' for '+ query.strip("query:"), container)
     if generated_text != '' and generated_text != None and 'Error' not in generated_text:
         generated_text = generated_text.replace("$","\$")
         us_answer = str(generated_text)
@@ -120,15 +117,18 @@ bd_answer = ''
 func = models[model]['func']
 
 if input_text != '':
-    us_answer = GetAnswers(input_text)
     tab1, tab2, tab3, tab4 = st.tabs(["User Stories", "Data Model", "API Specs", "BDD Secenarios"])
     #c1, c2 = st.columns(2)
     with tab1:
+        st.write("**User stories for your epic**")
+        stream_placeholder = st.empty()
+        us_answer = GetAnswers(input_text, stream_placeholder)
         if us_answer:
-            st.write("**User stories for your epic**")
-            st.write(us_answer)
+            stream_placeholder.write(us_answer)
     with tab2:
-        dm_generated_text = func('Create a data model in '+language+' for each of the user stories in '+str(us_answer))
+        st.write("**Data model for your user stories**")
+        stream_placeholder = st.empty()
+        dm_generated_text = gen_ai_selector.write_stream(models[model], 'Create a data model in '+language+' for each of the user stories in '+str(us_answer), stream_placeholder)
         if dm_generated_text != '' and dm_generated_text != None and 'Error' not in dm_generated_text:
             #print('DM!!', dm_generated_text)
             dm_generated_text = dm_generated_text.replace("$","\$")
@@ -137,10 +137,11 @@ if input_text != '':
         else:
             dm_answer = 'Sorry!! did not find an answer to your question, please try again' 
         if dm_answer:
-            st.write("**Data model for your user stories**")    
-            st.write(dm_answer)
+            stream_placeholder.write(dm_answer)
     with tab3:
-        as_generated_text = func('Create microservices API specifications in '+language+' for each of the data models in '+ str(dm_answer))
+        st.write("**API Specs for your user stories**")
+        stream_placeholder = st.empty()
+        as_generated_text = gen_ai_selector.write_stream(models[model], 'Create microservices API specifications in '+language+' for each of the data models in '+ str(dm_answer), stream_placeholder)
         if as_generated_text != '' and as_generated_text != None and 'Error' not in as_generated_text:
             #print('AS!!', as_generated_text)
             as_generated_text = as_generated_text.replace("$","\$")
@@ -149,10 +150,11 @@ if input_text != '':
         else:
             as_answer = 'Sorry!! did not find an answer to your question, please try again'
         if as_answer:        
-            st.write("**API Specs for your user stories**")  
-            st.write(as_answer)
+            stream_placeholder.write(as_answer)
     with tab4:
-        bd_generated_text = func('Create behavior driven development scenarios using cucumber in '+language+' for each of the user stories in '+ str(us_answer))
+        st.write("**BDD Scenarios for your user stories**")
+        stream_placeholder = st.empty()
+        bd_generated_text = gen_ai_selector.write_stream(models[model], 'Create behavior driven development scenarios using cucumber in '+language+' for each of the user stories in '+ str(us_answer), stream_placeholder)
         if bd_generated_text != '' and bd_generated_text != None and 'Error' not in bd_generated_text:
             #print('BD!!', bd_generated_text)
             bd_generated_text = bd_generated_text.replace("$","\$")
@@ -160,8 +162,11 @@ if input_text != '':
         else:
             bd_answer = 'Sorry!! did not find an answer to your question, please try again'
         if bd_answer:
-            st.write("**BDD Scenarios for your user stories**")
-            st.write(bd_answer)
+            stream_placeholder.write(bd_answer)
     
 st.sidebar.markdown('### :red[Cost of Bedrock Invocations] \n' 
                 + gen_ai_selector.report_cost()) 
+
+performance_report = gen_ai_selector.report_performance()
+if performance_report:
+    st.sidebar.markdown('### :blue[Performance of recent calls] \n' + performance_report)
@@ -26,13 +26,12 @@ from boto3.dynamodb.conditions import Key
 import os
 from utils import gen_ai_selector
 from utils import cognito_helper
+from utils import aws_session_helper
+from utils import model_comparison
+from utils import model_router
 
-import pages.imports.sts_assume_role as boto3_session
 
-
-autorefresh_session = boto3_session.run_autorefresh_session()
-comprehend = autorefresh_session.client('comprehend')
-bedrock = autorefresh_session.client('bedrock')
+comprehend = aws_session_helper.get_client('comprehend')
 
 # Get environment variables
 stack_id = os.environ.get('STACK_ID')
@@ -93,6 +92,12 @@ model = st.sidebar.selectbox('Select a FM', genai_models, index=default_model)
 
 models = gen_ai_selector.genai_model_functions
 
+compare_mode = st.sidebar.checkbox('Compare models side by side')
+compared_models = []
+if compare_mode:
+    compared_models = st.sidebar.multiselect('Models to compare, the first one continues the chat', [ name for name in genai_models if name in models ],
+                                             default=[ model ] if model in models else [], max_selections=model_comparison.COMPARISON_MAX_MODELS)
+
 if 'Jumpstart' in model:
     st.markdown("# Chat with "+ model + ': ' + pref_jumpstart_model )
 else:
@@ -127,9 +132,16 @@ def GetAnswers(query):
     #elif query_type == "BEING":
     #    answer = 'Kindly rephrase your question keeping it impersonal and try again.'
             
+    elif len(compared_models) > 1:
+        # Same query to every compared model at once, shown side by side
+        results = model_comparison.render_comparison(compared_models, query)
+        answer = results[0]['text']
     else:
-        func = models[model]['func']
-        answer = str(func(query))   
+        # Show tokens as they arrive, the placeholder is replaced by the chat message once complete.
+        # Repeated questions are answered from the response caches
+        stream_placeholder = st.empty()
+        answer = str(gen_ai_selector.write_stream(models[model], query, stream_placeholder, use_cache=True))
+        stream_placeholder.empty()
     return answer          
 
 
@@ -166,7 +178,7 @@ if input_text != '':
 
         st.session_state.count = int(st.session_state.count) + 1
         store_chat(st.session_state.sessionID, st.session_state.count, input_text, result)
-        p_text = func('Generate three prompts to query the text: '+ result)
+        p_text = model_router.get_func(model_router.PROMPT_SUGGESTIONS, model)('Generate three prompts to query the text: '+ result)
         p_text1 = []
         p_text2 = ''
         if p_text is not None and p_text != '' and 'Error' not in p_text:
@@ -184,3 +196,7 @@ if input_text != '':
     
 st.sidebar.markdown('### :red[Cost of Bedrock Invocations] \n' 
                 + gen_ai_selector.report_cost())
+
+performance_report = gen_ai_selector.report_performance()
+if performance_report:
+    st.sidebar.markdown('### :blue[Performance of recent calls] \n' + performance_report)
@@ -26,16 +26,12 @@ import os
 import time
 from utils import gen_ai_selector
 from utils import cognito_helper
-
-import pages.imports.sts_assume_role as boto3_session
-
-key = os.environ['AWS_ACCESS_KEY_ID']
-secret = os.environ['AWS_SECRET_ACCESS_KEY']
-region = os.environ['AWS_DEFAULT_REGION']
-
-autorefresh_session = boto3_session.run_autorefresh_session()
-comprehend = autorefresh_session.client('comprehend')
-bedrock = autorefresh_session.client('bedrock')
+from utils import aws_session_helper
+from utils import token_counter
+from utils import summarizer
+from utils import model_router
+from utils import sample_catalog
+from utils import object_store
 
 st.set_page_config(page_title="GenAI Call Analyzer", page_icon="headphones")
 
@@ -70,9 +66,9 @@ if 'model_summary' not in st.session_state:
     st.session_state['model_summary'] = None
 
 
-s3 = boto3.client('s3',region_name=region,aws_access_key_id=key,aws_secret_access_key=secret)
-comprehend = boto3.client('comprehend',region_name=region,aws_access_key_id=key,aws_secret_access_key=secret)
-transcribe = boto3.client("transcribe",region_name=region,aws_access_key_id=key,aws_secret_access_key=secret)
+s3 = aws_session_helper.get_client('s3', assume_role=False)
+comprehend = aws_session_helper.get_client('comprehend', assume_role=False)
+transcribe = aws_session_helper.get_client('transcribe', assume_role=False)
 
 # Get environment variables
 iam_role = os.environ['IAM_ROLE']
@@ -85,17 +81,11 @@ turn_df = pd.DataFrame(columns=icols)
 ocols = ['job', 'non-talk-instances', 'non-talk-time', 'interruption_count', 'interruption_tot_duration', 'total_conv_duration']
 call_df = pd.DataFrame(columns=ocols)
 
-paginator = s3.get_paginator('list_objects_v2')
-call_content_entries = paginator.paginate(Bucket=bucket)
-media_files = ['Select...']
+call_analyzer_samples_folder = 'call-analyzer-samples/'
 
-for call_content_entry_page in call_content_entries:
-    for call_content_entry in call_content_entry_page['Contents']:
-        entry = call_content_entry['Key']
-        if "call-analyzer" in entry.lower():
-            mf = entry.split('/')[1]
-            if mf != '' and ( entry.endswith('.wav') or entry.endswith('.mp3') or entry.endswith('.mp4')):
-                media_files.append(mf)
+# Listing of the samples folder shared by all sessions, see utils/sample_catalog.py
+media_files = ['Select...'] + [ sample.name for sample in sample_catalog.list_samples(bucket, call_analyzer_samples_folder)
+                                if sample.name.endswith(('.wav', '.mp3', '.mp4')) ]
 
 
 st.markdown("# Call Analytics and Insights")
@@ -115,9 +105,17 @@ model = st.sidebar.selectbox('Select a FM', genai_models, index=default_model)
 models = gen_ai_selector.genai_model_functions
 
 
-def call_models(full_transcript, command, query):
-    func = models[model]['func']
-    generated_text = func(full_transcript+'. '+command+query.lower())
+def call_models(full_transcript, command, query, container=None):
+    # The transcript is trimmed to the context window of the selected model
+    prompt_text = ''.join(token_counter.fit_to_budget([full_transcript, '. '+command+query.lower()], models[model]))
+    if container is None:
+        func = models[model]['func']
+        generated_text = func(prompt_text)
+    else:
+        generated_text = gen_ai_selector.write_stream(models[model], prompt_text, container)
+    return format_answer(generated_text)
+
+def format_answer(generated_text):
     answer = None
     
     if generated_text != '':
@@ -127,8 +125,8 @@ def call_models(full_transcript, command, query):
         answer = 'Sorry!! did not find an answer to your question, please try again'
     return answer
     
-def GetAnswers(full_transcript,query):
-    model_response = call_models(full_transcript, 'Answer neutrally without bias from this text:',query)             
+def GetAnswers(full_transcript,query, container=None):
+    model_response = call_models(full_transcript, 'Answer neutrally without bias from this text:',query, container)             
     return model_response
 
 
@@ -260,7 +258,7 @@ if chosen_audio_select != "Select...":
     if st.button("Submit"):
         with st.spinner('Uploading audio file and starting Amazon Transcribe call analytics...'):
             print('Chose audio? : ', chosen_audio_select)
-            job_name_list = start_transcript('call-analyzer-samples/'+chosen_audio_select)
+            job_name_list = start_transcript(call_analyzer_samples_folder+chosen_audio_select)
 
 
 if len(job_name_list) > 0:
@@ -286,11 +284,6 @@ if len(job_name_list) > 0:
                 finish = True
                 break
                 
-    # First we need an output directory
-    dir = os.getcwd()+'/transcript_output'
-    if not os.path.exists(dir):
-        os.makedirs(dir)            
-
     # Get Call Analytics output
     i = -1
     for job in job_name_list:
@@ -298,13 +291,13 @@ if len(job_name_list) > 0:
         json_file = response['CallAnalyticsJob']['Transcript']['TranscriptFileUri']
         a = json_file.split('/')
         tca_prefix = '/'.join(a[4:])
-        s3.download_file(bucket,tca_prefix,dir+'/'+job)
-        with open(dir+'/'+job) as f:
-            data = json.load(f)
+        # Read into memory, the transcripts are not written to the working directory
+        data = json.loads(object_store.read_object(s3, bucket, tca_prefix))
         i += 1
         full_transcript = upload_segments(str(job), i, data)
     st.session_state['full_transcript'] = full_transcript   
-    model_summary = call_models(full_transcript, 'Summarize this text to 100 words in '+language+':',query='')
+    # Long calls are summarized section by section before the final summary in the output language
+    model_summary = format_answer(summarizer.summarize(full_transcript, models[model], 'Summarize this text to 100 words in '+language+': '))
     model_summary = model_summary.replace("$","\$")
     lang = comprehend.detect_dominant_language(Text=model_summary)
     lang_code = str(lang['Languages'][0]['LanguageCode']).split('-')[0]
@@ -344,7 +337,7 @@ if st.session_state.model_summary:
     st.write(st.session_state['model_summary'])
     #if model == 'anthropic claude':  
     func = models[model]['func']
-    p_text = func('Generate three prompts to query the summary: '+ st.session_state.model_summary)
+    p_text = model_router.get_func(model_router.PROMPT_SUGGESTIONS, model)('Generate three prompts to query the summary: '+ st.session_state.model_summary)
     p_text1 = []
     p_text2 = ''
     if p_text is not None and p_text != '':
@@ -372,9 +365,10 @@ pii_value = ''
 if st.session_state.full_transcript:
     input_text = st.text_input('**What conversation insights would you like?**', key='text_ca')
     if input_text != '':
-        result = GetAnswers(st.session_state.full_transcript,input_text)
+        stream_placeholder = st.empty()
+        result = GetAnswers(st.session_state.full_transcript,input_text, stream_placeholder)
         result = result.replace("$","\$")
-        st.write(result)
+        stream_placeholder.write(result)
         #resp_pii = comprehend.detect_pii_entities(Text=result, LanguageCode='en')
         #immut_result = result
         #for pii in resp_pii['Entities']:
@@ -385,3 +379,7 @@ if st.session_state.full_transcript:
 
 st.sidebar.markdown('### :red[Cost of Bedrock Invocations] \n' 
                 + gen_ai_selector.report_cost())
+
+performance_report = gen_ai_selector.report_performance()
+if performance_report:
+    st.sidebar.markdown('### :blue[Performance of recent calls] \n' + performance_report)
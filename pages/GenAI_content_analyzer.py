@@ -18,22 +18,19 @@ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 import boto3
 import streamlit as st
-import textract
-from pypdf import PdfReader
 import os
 from utils import gen_ai_selector
 from utils import cognito_helper
-
-
-import pages.imports.sts_assume_role as boto3_session
-
-key = os.environ['AWS_ACCESS_KEY_ID']
-secret = os.environ['AWS_SECRET_ACCESS_KEY']
-region = os.environ['AWS_DEFAULT_REGION']
-
-autorefresh_session = boto3_session.run_autorefresh_session()
-comprehend = autorefresh_session.client('comprehend')
-bedrock = autorefresh_session.client('bedrock')
+from utils import aws_session_helper
+from utils import token_counter
+from utils import summarizer
+from utils import model_comparison
+from utils import model_router
+from utils import retrieval_index
+from utils import document_cache
+from utils import image_analyzer
+from utils import sample_catalog
+from utils import object_store
 
 # Get environment variables
 
@@ -51,24 +48,17 @@ if 'label_text' not in st.session_state:
     st.session_state['label_text'] = None
     
 
-s3 = boto3.client('s3',region_name=region,aws_access_key_id=key,aws_secret_access_key=secret)
-comprehend = boto3.client('comprehend',region_name=region,aws_access_key_id=key,aws_secret_access_key=secret)
-rekognition = boto3.client('rekognition',region_name=region,aws_access_key_id=key,aws_secret_access_key=secret)
+s3 = aws_session_helper.get_client('s3', assume_role=False)
+comprehend = aws_session_helper.get_client('comprehend', assume_role=False)
 
 content_analyzer_samples_folder = 'content-analyzer-samples/'
+# 'document' summarizes the whole document section by section, 'head' only the leading pages that fit the
+# context window of the model, extraction of long documents stops there and the rest is read for the first question
+summary_scope = os.getenv('CONTENT_ANALYZER_SUMMARY_SCOPE', 'document')
 
 
-paginator = s3.get_paginator('list_objects_v2')
-content_entries = paginator.paginate(Bucket=bucket)
-sample_contents = ['Select...']
-
-for content_entry_page in content_entries:
-    for content_entry in content_entry_page['Contents']:
-        entry = content_entry['Key']
-        if "content-analyzer" in entry.lower():
-            #if not ( entry.endswith('/') or entry.endswith('.wav') or entry.endswith('.mp3') or entry.endswith('.mp4')):
-            if entry.split('/')[1] != '':
-                sample_contents.append(entry.split('/')[1])
+# Listing of the samples folder shared by all sessions, see utils/sample_catalog.py
+sample_contents = ['Select...'] + [ sample.name for sample in sample_catalog.list_samples(bucket, content_analyzer_samples_folder) ]
 
 
 p_summary = ''
@@ -114,22 +104,47 @@ model = st.sidebar.selectbox('Select a FM', genai_models, index=default_model)
 
 models = gen_ai_selector.genai_model_functions
 
-func = models[model]['func']
-chunk = models[model]['char_limits']
+compare_mode = st.sidebar.checkbox('Compare models side by side')
+compared_models = []
+if compare_mode:
+    compared_models = st.sidebar.multiselect('Models to compare on your questions', [ name for name in genai_models if name in models ],
+                                             default=[ model ] if model in models else [], max_selections=model_comparison.COMPARISON_MAX_MODELS)
 
+func = models[model]['func']
 
-def readpdf(filename):
-    # creating a pdf reader object
-    reader = PdfReader(filename)
-    # getting a specific page from the pdf file
-    raw_text = []
-    for page in reader.pages:
-        raw_text.append(page.extract_text())
-    return '\n'.join(raw_text)
-
-def GetAnswers(original_text, query):
+def fit_prompt(*prompt_parts):
+    # Packs the most content into the context window of the selected model, the longest part is trimmed
+    return ''.join(token_counter.fit_to_budget(prompt_parts, models[model]))
+
+def get_answer_prompt(original_text, query, model_entry):
+    # Long documents are cut down to the chunks relevant to the question
+    query = query.strip("query:")
+    instruction = '. Answer from this text with no hallucinations, false claims or illogical statements: '+ query
+    context = retrieval_index.get_relevant_context(original_text, query, model_entry, instruction)
+    return ''.join(token_counter.fit_to_budget([ context, instruction ], model_entry))
+
+
+def escape_contents(file_type, contents):
+    if file_type in document_cache.TEXT_FILE_TYPES:
+        return contents
+    return contents.replace('$','\$')
+
+def read_contents(file_type, s3_file_name):
+    # Extracted once per version of the object, follow-up questions read the text from the document cache
+    contents, page_offsets = document_cache.get_document_text(s3, s3_bucket, s3_file_name, file_type)
+    return escape_contents(file_type, contents)
+
+def read_summary_contents(file_type, s3_file_name):
+    if summary_scope != 'head':
+        return read_contents(file_type, s3_file_name)
+    # Pages are extracted until the prompt budget of the model is filled
+    contents = document_cache.get_document_head(s3, s3_bucket, s3_file_name, file_type,
+                                                token_counter.get_prompt_budget(models[model]), models[model]['model_id'])
+    return escape_contents(file_type, contents)
+
+def GetAnswers(original_text, query, container=None):
     generated_text = ''
-    generated_text = func(original_text[:chunk] +'. Answer from this text with no hallucinations, false claims or illogical statements: '+ query.strip("query:"))
+    generated_text = gen_ai_selector.write_stream(models[model], get_answer_prompt(original_text, query, models[model]), container)
     
     if generated_text is None or generated_text == '':
         answer = 'Sorry!! did not find an answer to your question, please try again'   
@@ -144,27 +159,8 @@ def GetAnswers(original_text, query):
 
 def upload_image_detect_labels(chosen_content_key):
     summary = ''
-    label_text = ''
-    response = rekognition.detect_labels(
-        Image={'S3Object': { 'Bucket': bucket, 'Name': chosen_content_key }},
-        Features=['GENERAL_LABELS']
-    )
-    text_res = rekognition.detect_text(
-        Image={'S3Object': { 'Bucket': bucket, 'Name': chosen_content_key }}
-    )
-
-    celeb_res = rekognition.recognize_celebrities(
-        Image={'S3Object': { 'Bucket': bucket, 'Name': chosen_content_key }}
-    )
-
-    for celeb in celeb_res['CelebrityFaces']:
-        label_text += celeb['Name'] + ' ' 
-
-    for text in text_res['TextDetections']:
-        label_text += text['DetectedText'] + ' '
-
-    for label in response['Labels']:
-        label_text += label['Name'] + ' '
+    # Rekognition detections run concurrently, a detection that fails or times out is left out of the labels
+    label_text = image_analyzer.get_label_text(image_analyzer.analyze_image(bucket, chosen_content_key))
 
     st.session_state.label_text = label_text
     
@@ -181,24 +177,17 @@ def upload_image_detect_labels(chosen_content_key):
 
 def upload_csv_get_summary(file_type, s3_file_name):
     summary = ''
-    file_path_tokens = s3_file_name.split('/')
-    local_file = file_path_tokens[len(file_path_tokens) - 1]
-    print ('local_file: {}, s3 path: {}'.format(local_file, s3_file_name))
-    s3.download_file(s3_bucket, s3_file_name, local_file)
+    new_contents = read_summary_contents(file_type, s3_file_name)
     
-    if file_type not in ['py','java','ipynb','pdf']:
-        contents = textract.process(local_file).decode('utf-8')
-        new_contents = contents[:chunk].replace('$','\$')
-    elif file_type == 'pdf':
-        contents = readpdf(local_file)
-        new_contents = contents[:chunk].replace("$","\$")
-    else:
-        with open(local_file, 'rb') as f:
-            contents = f.read()
-        new_contents = contents[:chunk].decode('utf-8')
+    # Show the summary as it is generated, the placeholder is cleared as the page renders it from session state.
+    # Long documents are summarized section by section first, the section summaries do not depend on the language
+    stream_placeholder = st.empty()
+    generated_text = summarizer.summarize(new_contents, models[model], 'Create a 300 words summary of this document in ' +language+ ': ', stream_placeholder)
+    stream_placeholder.empty()
     
-    func = models[model]['func']
-    generated_text = func('Create a 300 words summary of this document in ' +language+ ': '+ new_contents)
+    # Index the document for the questions to come, with the head scope the first question reads and indexes it
+    if summary_scope != 'head':
+        retrieval_index.get_document_index(new_contents)
     if generated_text != '':
         if '$' in generated_text:
             summary = str(generated_text).replace("$","\$")
@@ -273,12 +262,11 @@ if target_content is not None:
 
     if st.session_state.img_summary:
         if len(st.session_state.img_summary) > 5:
-            with open(target_content, 'wb') as f:
-                s3.download_fileobj(bucket, content_analyzer_samples_folder+target_content, f)
-            st.image(target_content)
+            # Downscaled copy cached per version of the image, nothing is written to the working directory
+            st.image(object_store.get_thumbnail(s3, bucket, content_analyzer_samples_folder+target_content))
             st.markdown('**Image summary**: \n')
             st.write(str(st.session_state['img_summary']))
-            p_text = func('Generate '+str(p_count)+' prompts to query the summary: '+ st.session_state.img_summary)
+            p_text = model_router.get_func(model_router.PROMPT_SUGGESTIONS, model)('Generate '+str(p_count)+' prompts to query the summary: '+ st.session_state.img_summary)
             p_text1 = []
             p_text2 = ''
             if p_text != '':
@@ -296,7 +284,7 @@ if target_content is not None:
             if st.button("Halluci-Negator"):
                 tab1, tab2 = st.tabs(["Hallucination Analysis", "Rewritten Summary"])
                 with tab1:
-                    h_results = func(hallucinegator+" "+st.session_state.img_summary[:chunk]+" based on the original data provided in "+st.session_state.label_text)
+                    h_results = model_router.get_func(model_router.HALLUCINATION_CHECK, model)(fit_prompt(hallucinegator+" ", st.session_state.img_summary, " based on the original data provided in "+st.session_state.label_text))
                     h_results = h_results.replace("$", "\$")
                     st.write(h_results)
                 with tab2:
@@ -307,7 +295,7 @@ if target_content is not None:
         if len(st.session_state.csv_summary) > 5:
             st.markdown('**Summary**: \n')
             st.write(str(st.session_state.csv_summary).replace("$","\$"))
-            p_text = func('Generate '+str(p_count)+' prompts to query the text: '+ st.session_state.csv_summary[:chunk])
+            p_text = model_router.get_func(model_router.PROMPT_SUGGESTIONS, model)(fit_prompt('Generate '+str(p_count)+' prompts to query the text: ', st.session_state.csv_summary))
             p_text1 = []
             p_text2 = ''
             if p_text != '':
@@ -326,21 +314,24 @@ if target_content is not None:
             if st.button("Halluci-Negator"):
                 tab1, tab2 = st.tabs(["Hallucination Analysis", "Rewritten Summary"])
                 with tab1:
-                    h_results = func(hallucinegator+" "+st.session_state.csv_summary[:5000]+" based on original data provided in "+st.session_state.new_contents[:5000])
+                    h_results = model_router.get_func(model_router.HALLUCINATION_CHECK, model)(fit_prompt(hallucinegator+" "+st.session_state.csv_summary+" based on original data provided in ", st.session_state.new_contents))
                     h_results = h_results.replace("$", "\$")
                     st.write(h_results)
                 with tab2:
-                    m_summary = func('Rewrite a 300 words summary in '+language+' from '+st.session_state.new_contents[:8000]+' without hallucinations, false claims or illogical statements sticking only to available factual data')
+                    m_summary = func(fit_prompt('Rewrite a 300 words summary in '+language+' from ', st.session_state.new_contents, ' without hallucinations, false claims or illogical statements sticking only to available factual data'))
                     st.write(m_summary)
 
 input_text = st.text_input('**What insights would you like?**', key='text')
 if input_text != '':
     file_type = str(target_content).split('.')[1]
-    if st.session_state.img_summary:
-        result = GetAnswers(st.session_state.img_summary,input_text)
+    if st.session_state.img_summary and len(compared_models) > 1:
+        model_comparison.render_comparison(compared_models, lambda model_entry: get_answer_prompt(st.session_state.img_summary, input_text, model_entry))
+    elif st.session_state.img_summary:
+        stream_placeholder = st.empty()
+        result = GetAnswers(st.session_state.img_summary,input_text, stream_placeholder)
         if (result is not None):
             result = result.replace("$","\$")
-            st.write(result)
+            stream_placeholder.write(result)
     elif st.session_state.csv_summary:
         
         print('Chosen content: ', chosen_content)
@@ -348,23 +339,10 @@ if input_text != '':
         print('Target content: ', target_content)
         if chosen_content != 'Select...':
             target_content = content_analyzer_samples_folder+target_content
-            file_path_tokens = target_content.split('/')
-            local_file = file_path_tokens[len(file_path_tokens) - 1]
-            s3.download_file(s3_bucket, target_content, local_file)
         #else:
-        #    local_file = uploaded_img.name
         #    s3.download_file(s3_bucket, s3_prefix+'/'+uploaded_img.name, uploaded_img.name)
             
-        if file_type not in ['py','java','ipynb','pdf']:
-            contents = textract.process(local_file).decode('utf-8')
-            new_contents = contents[:chunk].replace('$','\$')
-        elif file_type == 'pdf':
-            contents = readpdf(local_file)
-            new_contents = contents[:chunk].replace("$","\$")
-        else:
-            with open(local_file, 'rb') as f:
-                contents = f.read()
-            new_contents = contents[:chunk].decode('utf-8')
+        new_contents = read_contents(file_type, target_content)
 
 
         #print('New uploaded contents from session: ', new_contents)
@@ -379,9 +357,18 @@ if input_text != '':
         #             pii_value = immut_summary[pii['BeginOffset']:pii['EndOffset']]
         #             new_contents = new_contents.replace(pii_value, str('PII - '+pii['Type']))
 
-        result = GetAnswers(new_contents,input_text)
-        result = result.replace("$","\$")
-        st.write(result)              
+        if len(compared_models) > 1:
+            # Each model gets the document fitted to its own context window
+            model_comparison.render_comparison(compared_models, lambda model_entry: get_answer_prompt(new_contents, input_text, model_entry))
+        else:
+            stream_placeholder = st.empty()
+            result = GetAnswers(new_contents,input_text, stream_placeholder)
+            result = result.replace("$","\$")
+            stream_placeholder.write(result)              
 
 st.sidebar.markdown('### :red[Cost of Bedrock Invocations] \n' 
                 + gen_ai_selector.report_cost())
+
+performance_report = gen_ai_selector.report_performance()
+if performance_report:
+    st.sidebar.markdown('### :blue[Performance of recent calls] \n' + performance_report)
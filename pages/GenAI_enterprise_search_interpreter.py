@@ -33,14 +33,12 @@ import os
 
 from utils import gen_ai_selector
 from utils import cognito_helper
+from utils import aws_session_helper
+from utils import model_router
 
-import pages.imports.sts_assume_role as boto3_session
 
-
-autorefresh_session = boto3_session.run_autorefresh_session()
-comprehend = autorefresh_session.client('comprehend')
-bedrock = autorefresh_session.client('bedrock')
-kendra = autorefresh_session.client('kendra')
+comprehend = aws_session_helper.get_client('comprehend')
+kendra = aws_session_helper.get_client('kendra')
 
 # Get environment variables
 fsi_index_id = os.getenv('fsi_index_id', '')
@@ -187,7 +185,7 @@ def call_Kendra(query_string, index_id):
     return result_set
 
 
-def GetAnswers(query):
+def GetAnswers(query, container=None):
     answer = None
     sources = ''
     if industry.lower() == 'financial services':
@@ -209,7 +207,7 @@ def GetAnswers(query):
     # Based on model selected
     
     if len(results) == 0: 
-        generated_text = func(query.strip("query:"))
+        generated_text = gen_ai_selector.write_stream(models[model], query.strip("query:"), container, use_cache=True)
 
         if generated_text is None or generated_text == '':
             answer = 'Sorry, did not find an answer to your question, please try again or with different input' 
@@ -239,7 +237,7 @@ def GetAnswers(query):
         #    st.write('    Source ', entry['src'])
         
         
-        generated_text = func(formatted_snippet+'. Answer from this text:'+query.strip("query:"))
+        generated_text = gen_ai_selector.write_stream(models[model], formatted_snippet+'. Answer from this text:'+query.strip("query:"), container, use_cache=True)
         
         #print('generated result text: ', generated_text)
 
@@ -259,10 +257,11 @@ st.write("**Instructions:** \n - Type your query \n - You will get the top answe
 input_text = st.text_input('**What are you searching for?**', key='text')
 result = ''
 if input_text != '':
-    result = GetAnswers(input_text)
-    result = result.replace("$","\$")
     st.write('\nAnswers from Model')
-    st.write(result)
+    stream_placeholder = st.empty()
+    result = GetAnswers(input_text, stream_placeholder)
+    result = result.replace("$","\$")
+    stream_placeholder.write(result)
     
     if 'Jumpstart' in model:
         st.write("Source: "+ model + ': ' + pref_jumpstart_model )
@@ -273,7 +272,7 @@ func = models[model]['func']
 
 if result != '':
     #if model == 'anthropic claude':  
-    p_text = func('Generate three prompts to query the text: '+ result)
+    p_text = model_router.get_func(model_router.PROMPT_SUGGESTIONS, model)('Generate three prompts to query the text: '+ result)
     p_text1 = []
     p_text2 = ''
     if p_text != '':
@@ -291,3 +290,7 @@ if result != '':
     
 st.sidebar.markdown('### :red[Cost of Bedrock Invocations] \n' 
                 + gen_ai_selector.report_cost())
+
+performance_report = gen_ai_selector.report_performance()
+if performance_report:
+    st.sidebar.markdown('### :blue[Performance of recent calls] \n' + performance_report)
@@ -36,16 +36,13 @@ import base64
 import random
 from utils import gen_ai_selector
 from utils import cognito_helper
+from utils import aws_session_helper
 
-import pages.imports.sts_assume_role as boto3_session
-
-autorefresh_session = boto3_session.run_autorefresh_session()
-
-s3 = autorefresh_session.client('s3')
-comprehend = autorefresh_session.client('comprehend')
-rekognition = autorefresh_session.client('rekognition')
-kendra = autorefresh_session.client("kendra")
-textract = autorefresh_session.client("textract")
+s3 = aws_session_helper.get_client('s3')
+comprehend = aws_session_helper.get_client('comprehend')
+rekognition = aws_session_helper.get_client('rekognition')
+kendra = aws_session_helper.get_client("kendra")
+textract = aws_session_helper.get_client("textract")
 
 iam_role = os.environ['IAM_ROLE']
 
@@ -263,25 +260,20 @@ if input_text != '':
     with tab2:
         st.write("**Internal memo for your product idea**")
         prompt_text = 'Generate an internal memo announcing the launch decision in '+language+' for '+ input_text.strip("query:")
-        func = models[model]['func']
-        answer = func(prompt_text)
-        answer = answer.replace("$","\$") 
-        st.write(answer)
+        answer = gen_ai_selector.write_stream(models[model], prompt_text)
     with tab3:
         st.write("**Press release for your product idea**")
         prompt_text = 'Generate a press release and some FAQs to help understand the product better in '+language+' for '+ input_text.strip("query:")
-        func = models[model]['func']
-        answer = func(prompt_text)
-        answer = answer.replace("$","\$") 
-        st.write(answer)
+        answer = gen_ai_selector.write_stream(models[model], prompt_text)
     with tab4:
         st.write("**Social Media Ad for your product idea**")
         prompt_text = 'Generate a catchy trendy social media ad in '+language+' for '+ input_text.strip("query:")
-        func = models[model]['func']
-        answer = func(prompt_text)
-        answer = answer.replace("$","\$") 
-        st.write(answer)
+        answer = gen_ai_selector.write_stream(models[model], prompt_text)
         st.balloons()
     
 st.sidebar.markdown('### :red[Cost of Bedrock Invocations] \n' 
                 + gen_ai_selector.report_cost())
+
+performance_report = gen_ai_selector.report_performance()
+if performance_report:
+    st.sidebar.markdown('### :blue[Performance of recent calls] \n' + performance_report)
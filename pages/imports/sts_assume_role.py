@@ -54,8 +54,8 @@ def refresh_external_credentials():
 
 def run_autorefresh_session():
 
-    credentials = botocore.credentials.RefreshableCredentials.create_from_metadata(
-        metadata=refresh_external_credentials(),
+    # Defer the AssumeRole call until the credentials are first used by a request
+    credentials = botocore.credentials.DeferredRefreshableCredentials(
         refresh_using=refresh_external_credentials,
         method="sts-assume-role",
     )
@@ -0,0 +1,29 @@
+# The utils modules create their AWS clients on import, the tests run them against mocks without credentials
+import os
+import json
+from unittest import mock
+import boto3
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+os.environ.setdefault('IAM_ROLE', 'arn:aws:iam::000000000000:role/testing')
+os.environ.setdefault('bucket', 'testing')
+os.environ.setdefault('RESPONSE_CACHE_DB', '/tmp/gen-ai-response-cache-tests.db')
+os.environ.setdefault('MODEL_CATALOG_SNAPSHOT', '/tmp/gen-ai-model-catalog-tests.json')
+
+with open(os.path.join(os.path.dirname(__file__), '..', 'utils', 'model_catalog_snapshot.json')) as snapshot_file:
+    snapshot = json.load(snapshot_file)
+
+aws_client = mock.MagicMock()
+aws_client.list_foundation_models.return_value = { 'modelSummaries': snapshot['model_summaries'] }
+
+
+class MockSession:
+
+    def client(self, *args, **kwargs):
+        return aws_client
+
+
+mock.patch('pages.imports.sts_assume_role.run_autorefresh_session', return_value=MockSession()).start()
+mock.patch.object(boto3.session.Session, 'client', lambda self, *args, **kwargs: aws_client).start()
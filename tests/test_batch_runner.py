@@ -0,0 +1,161 @@
+import json
+import time
+import pytest
+from utils import batch_runner
+
+CLAUDE_MODEL_ID = 'anthropic.claude-v2'
+LLAMA_MODEL_ID = 'meta.llama2-13b-chat-v1'
+
+
+def write_lines(path, lines):
+    with open(path, 'w') as lines_file:
+        for line in lines:
+            lines_file.write((line if isinstance(line, str) else json.dumps(line)) + '\n')
+
+def read_results(path):
+    # Skips a last line cut short, like read_completed_ids does
+    results = []
+    with open(path) as results_file:
+        for line in results_file:
+            try:
+                results.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return results
+
+def wait_for_job(get_job, timeout=10):
+    deadline = time.time() + timeout
+    while get_job()['status'] not in batch_runner.BATCH_JOB_FINAL_STATES:
+        assert time.time() < deadline
+        time.sleep(0.05)
+
+@pytest.fixture
+def invocations(monkeypatch):
+    # Records of the fake model calls made by the local batch jobs
+    calls = []
+    fake_invoke = batch_runner.fake_invoke
+
+    def counting_invoke(model_id, model_input):
+        calls.append((model_id, model_input))
+        return fake_invoke(model_id, model_input)
+
+    monkeypatch.setattr(batch_runner, 'fake_invoke', counting_invoke)
+    return calls
+
+@pytest.fixture
+def batch_files(tmp_path):
+    input_path = str(tmp_path / 'prompts.jsonl')
+    write_lines(input_path, [
+        { 'id': 'r1', 'model': CLAUDE_MODEL_ID, 'prompt': 'What is Amazon Bedrock?' },
+        { 'id': 'r2', 'model': CLAUDE_MODEL_ID, 'prompt': 'What is Amazon S3?', 'params': { 'max_tokens': 100 } },
+        { 'id': 'r3', 'model': LLAMA_MODEL_ID, 'prompt': 'What is AWS Lambda?' },
+    ])
+    return input_path, str(tmp_path / 'results.jsonl')
+
+def test_fake_invoke_is_deterministic():
+    model_input = batch_runner.build_model_input(LLAMA_MODEL_ID, 'Hello', {})
+    model_output = batch_runner.fake_invoke(LLAMA_MODEL_ID, model_input)
+    assert model_output == batch_runner.fake_invoke(LLAMA_MODEL_ID, model_input)
+    text, token_counts = batch_runner.parse_model_output(model_output)
+    assert text and token_counts[0] > 0 and token_counts[1] > 0
+
+def test_local_batch_answers_every_record(batch_files, invocations):
+    input_path, output_path = batch_files
+    stats = batch_runner.run_batch(input_path, output_path, backend='local-batch')
+
+    results = { result['id']: result for result in read_results(output_path) }
+    assert sorted(results) == [ 'r1', 'r2', 'r3' ]
+    assert all(result.get('error') is None and result['backend'] == 'bedrock-batch' for result in results.values())
+    assert stats['succeeded'] == 3
+    assert len(invocations) == 3
+    llama_input = batch_runner.build_model_input(LLAMA_MODEL_ID, 'What is AWS Lambda?', {})
+    assert results['r3']['response'] == batch_runner.fake_invoke(LLAMA_MODEL_ID, llama_input)['generation']
+
+def test_resume_skips_completed_and_retries_errors(batch_files, invocations):
+    input_path, output_path = batch_files
+    write_lines(output_path, [
+        { 'id': 'r1', 'model': CLAUDE_MODEL_ID, 'backend': 'local', 'response': 'earlier answer' },
+        { 'id': 'r2', 'model': CLAUDE_MODEL_ID, 'backend': 'local', 'error': 'Error!! Request Throttled!!' },
+        '{"id": "r3", "model": "cut short by a cra',
+    ])
+    batch_runner.run_batch(input_path, output_path, backend='local-batch')
+
+    new_results = read_results(output_path)[2:]
+    assert sorted(result['id'] for result in new_results) == [ 'r2', 'r3' ]
+    assert all(result.get('error') is None for result in new_results)
+    assert sorted(model_input.get('prompt', '') for model_id, model_input in invocations) == \
+        sorted([ batch_runner.build_model_input(CLAUDE_MODEL_ID, 'What is Amazon S3?', { 'max_tokens': 100 })['prompt'],
+                 'What is AWS Lambda?' ])
+    assert batch_runner.read_completed_ids(output_path) == { 'r1', 'r2', 'r3' }
+
+    # Nothing is left to run
+    invocations.clear()
+    batch_runner.run_batch(input_path, output_path, backend='local-batch')
+    assert invocations == []
+
+def test_rerun_collects_the_jobs_of_the_checkpoint(batch_files, invocations, monkeypatch):
+    input_path, output_path = batch_files
+    checkpoint_path = output_path + '.jobs.json'
+
+    def stopped_collect(self, job, records, writer, report):
+        raise KeyboardInterrupt()
+
+    # The first run submits the jobs and stops before writing any result
+    with monkeypatch.context() as stopped_run:
+        stopped_run.setattr(batch_runner.BedrockBatchBackend, 'collect_job', stopped_collect)
+        with pytest.raises(KeyboardInterrupt):
+            batch_runner.run_batch(input_path, output_path, backend='local-batch')
+    with open(checkpoint_path) as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+    assert sorted(checkpoint) == [ CLAUDE_MODEL_ID, LLAMA_MODEL_ID ]
+    # The jobs keep running on their threads, a stopped process would leave them to be restarted by the rerun
+    store = batch_runner.LocalStore(output_path + '.store')
+    job_uris = [ batch_runner.LocalBatchJobClient(store).get_job_uri(job_arn) for job_arn in checkpoint.values() ]
+    for job_uri in job_uris:
+        wait_for_job(lambda: json.loads(store.get_text(job_uri)))
+
+    created_jobs = []
+    create_job = batch_runner.LocalBatchJobClient.create_model_invocation_job
+    monkeypatch.setattr(batch_runner.LocalBatchJobClient, 'create_model_invocation_job',
+                        lambda self, **kwargs: created_jobs.append(kwargs) or create_job(self, **kwargs))
+    batch_runner.run_batch(input_path, output_path, backend='local-batch')
+
+    assert created_jobs == []
+    assert sorted(result['id'] for result in read_results(output_path)) == [ 'r1', 'r2', 'r3' ]
+    assert len(invocations) == 3
+    with open(checkpoint_path) as checkpoint_file:
+        assert json.load(checkpoint_file) == {}
+
+def test_unfinished_job_of_an_earlier_run_is_restarted(tmp_path, invocations):
+    store = batch_runner.LocalStore(str(tmp_path / 'store'))
+    input_uri = 's3://local-batch/input/job.jsonl'
+    model_input = batch_runner.build_model_input(LLAMA_MODEL_ID, 'What is AWS Lambda?', {})
+    store.put_text(input_uri, json.dumps({ 'recordId': 'r3', 'modelInput': model_input }) + '\n')
+    job = { 'jobArn': 'arn:aws:bedrock:local:000000000000:model-invocation-job/stopped', 'jobName': 'job', 'modelId': LLAMA_MODEL_ID,
+            'status': 'InProgress', 'inputDataConfig': { 's3InputDataConfig': { 's3Uri': input_uri } },
+            'outputDataConfig': { 's3OutputDataConfig': { 's3Uri': 's3://local-batch/output/' } } }
+    client = batch_runner.LocalBatchJobClient(store)
+    store.put_text(client.get_job_uri(job['jobArn']), json.dumps(job))
+
+    wait_for_job(lambda: client.get_model_invocation_job(jobIdentifier=job['jobArn']))
+    output_record = json.loads(store.get_text(batch_runner.get_job_output_uri(job)))
+    assert output_record['recordId'] == 'r3' and 'modelOutput' in output_record
+    assert len(invocations) == 1
+
+def test_dry_run_estimates_pending_valid_records(batch_files, invocations, capsys):
+    input_path, output_path = batch_files
+    with open(input_path, 'a') as input_file:
+        input_file.write('{"id": "r4", "prompt": "no model"}\n')
+    write_lines(output_path, [ { 'id': 'r1', 'model': CLAUDE_MODEL_ID, 'backend': 'local', 'response': 'earlier answer' } ])
+
+    batch_runner.main([ input_path, output_path, '--dry-run' ])
+    estimates = json.loads(capsys.readouterr().out)
+
+    assert sorted(estimates) == [ CLAUDE_MODEL_ID, LLAMA_MODEL_ID ]
+    assert estimates[CLAUDE_MODEL_ID]['records'] == 1
+    assert estimates[CLAUDE_MODEL_ID]['max_output_tokens'] == 100
+    assert estimates[LLAMA_MODEL_ID]['records'] == 1
+    assert estimates[CLAUDE_MODEL_ID]['input_tokens'] > 0
+    assert estimates[CLAUDE_MODEL_ID]['max_cost'] >= estimates[CLAUDE_MODEL_ID]['input_cost'] > 0
+    assert invocations == []
+    assert len(read_results(output_path)) == 1
@@ -0,0 +1,37 @@
+import threading
+import pytest
+
+# page_extractor needs textract from requirements.txt
+pytest.importorskip('textract')
+from utils import document_cache
+
+
+@pytest.fixture
+def cache_db(monkeypatch, tmp_path):
+    monkeypatch.setattr(document_cache, 'DOCUMENT_CACHE_DB', str(tmp_path / 'documents.db'))
+    monkeypatch.setattr(document_cache, 'db_local', threading.local())
+    monkeypatch.setattr(document_cache, 'db_initialized', False)
+    return document_cache.get_db()
+
+def get_size(conn, key):
+    return conn.execute('SELECT size FROM documents WHERE key = ?', (key,)).fetchone()[0]
+
+def test_pages_stored_twice_are_counted_once(cache_db):
+    key = document_cache.make_document_key('bucket', 'report.pdf', 'etag-1')
+    pages = [ 'first page', 'second page', 'third page' ]
+    document_cache.disk_put_pages(key, 'bucket', 'report.pdf', 'etag-1', 0, pages[:2])
+    document_cache.disk_put_pages(key, 'bucket', 'report.pdf', 'etag-1', 0, pages[:2])
+    assert get_size(cache_db, key) == len('first page') + len('second page')
+
+    # An overlapping range only adds its new page
+    document_cache.disk_put_pages(key, 'bucket', 'report.pdf', 'etag-1', 1, pages[1:], page_count=3)
+    assert get_size(cache_db, key) == sum(len(page) for page in pages)
+    assert document_cache.disk_get(key) is not None
+
+def test_new_version_replaces_the_old_one(cache_db):
+    old_key = document_cache.make_document_key('bucket', 'report.pdf', 'etag-1')
+    new_key = document_cache.make_document_key('bucket', 'report.pdf', 'etag-2')
+    document_cache.disk_put_pages(old_key, 'bucket', 'report.pdf', 'etag-1', 0, [ 'old page' ], page_count=1)
+    document_cache.disk_put_pages(new_key, 'bucket', 'report.pdf', 'etag-2', 0, [ 'new page' ], page_count=1)
+    assert cache_db.execute('SELECT key FROM documents').fetchall() == [ (new_key,) ]
+    assert cache_db.execute('SELECT COUNT(*) FROM pages WHERE key = ?', (old_key,)).fetchone()[0] == 0
@@ -0,0 +1,39 @@
+import time
+import pytest
+from utils import model_catalog
+
+
+@pytest.fixture
+def stale_snapshot(monkeypatch, tmp_path):
+    monkeypatch.setattr(model_catalog, 'MODEL_CATALOG_SNAPSHOT', str(tmp_path / 'catalog.json'))
+    monkeypatch.setattr(model_catalog, 'snapshot', { 'created': 0, 'has_bedrock': True, 'has_jumpstart': False, 'model_summaries': [ 'model' ] })
+    monkeypatch.setattr(model_catalog, 'last_refresh_attempt', 0)
+    monkeypatch.setattr(model_catalog, 'refresh_thread', None)
+    return model_catalog.snapshot
+
+def wait_for_refresh():
+    if model_catalog.refresh_thread is not None:
+        model_catalog.refresh_thread.join(timeout=10)
+
+def test_failed_refresh_keeps_the_snapshot_and_backs_off(stale_snapshot):
+    calls = []
+
+    def failing_discover(previous_snapshot):
+        calls.append(previous_snapshot)
+        raise ConnectionError('Could not connect to the endpoint URL')
+
+    for i in range(3):
+        assert model_catalog.get_snapshot(failing_discover) is stale_snapshot
+        wait_for_refresh()
+    assert len(calls) == 1
+
+    model_catalog.last_refresh_attempt = time.time() - model_catalog.MODEL_CATALOG_RETRY_INTERVAL - 1
+    model_catalog.get_snapshot(failing_discover)
+    wait_for_refresh()
+    assert len(calls) == 2
+
+def test_refresh_replaces_a_stale_snapshot(stale_snapshot):
+    model_catalog.get_snapshot(lambda previous_snapshot: dict(previous_snapshot, model_summaries=[ 'new model' ]))
+    wait_for_refresh()
+    assert model_catalog.snapshot['model_summaries'] == [ 'new model' ]
+    assert not model_catalog.is_stale(model_catalog.snapshot)
@@ -0,0 +1,80 @@
+import numpy as np
+from utils import semantic_cache
+
+
+def embed(text):
+    return semantic_cache.embed_prompt(None, text)
+
+def similarity(text, other_text):
+    return float(embed(text) @ embed(other_text))
+
+def test_lookup_hits_at_threshold_and_misses_below():
+    prompt = 'What is the capital of France?'
+    near_prompt = 'What is the capital city of France?'
+    score = similarity(prompt, near_prompt)
+    assert 0 < score < 1
+
+    cache = semantic_cache.SemanticCache(capacity=4, threshold=score - 1e-3)
+    cache.add(embed(prompt), 'Paris')
+    assert cache.lookup(embed(prompt)) == 'Paris'
+    assert cache.lookup(embed(near_prompt)) == 'Paris'
+    assert cache.lookup(embed('How do I bake sourdough bread at home?')) is None
+
+    strict_cache = semantic_cache.SemanticCache(capacity=4, threshold=score + 1e-3)
+    strict_cache.add(embed(prompt), 'Paris')
+    assert strict_cache.lookup(embed(near_prompt)) is None
+
+def test_full_cache_evicts_least_recently_used():
+    cache = semantic_cache.SemanticCache(capacity=2, threshold=0.99)
+    cache.add(embed('first question about lambda'), 'first')
+    cache.add(embed('second question about dynamodb'), 'second')
+
+    # Reading the first entry makes the second one the least recently used
+    assert cache.lookup(embed('first question about lambda')) == 'first'
+    cache.add(embed('third question about kinesis'), 'third')
+
+    assert cache.lookup(embed('second question about dynamodb')) is None
+    assert cache.lookup(embed('first question about lambda')) == 'first'
+    assert cache.lookup(embed('third question about kinesis')) == 'third'
+    assert len(cache.responses) == 2
+
+def test_cache_grows_past_initial_capacity():
+    cache = semantic_cache.SemanticCache(capacity=semantic_cache.INITIAL_CAPACITY*2, threshold=0.99)
+    for i in range(semantic_cache.INITIAL_CAPACITY + 1):
+        cache.add(embed('question number {}'.format(i)), str(i))
+    assert cache.vectors.shape[0] == semantic_cache.INITIAL_CAPACITY*2
+    assert cache.lookup(embed('question number 0')) == '0'
+
+def test_local_embedding_is_deterministic():
+    assert np.array_equal(semantic_cache.local_embedding('Same text'), semantic_cache.local_embedding('same TEXT'))
+
+def test_only_calls_with_use_cache_are_answered(monkeypatch):
+    monkeypatch.setattr(semantic_cache, 'SEMANTIC_CACHE_ENABLED', True)
+    monkeypatch.setattr(semantic_cache, 'semantic_caches', {})
+    calls = []
+
+    def model_func(prompt_text, max_tokens=100, temperature=0.5, use_cache=False):
+        calls.append((prompt_text, use_cache))
+        return 'answer {}'.format(len(calls))
+
+    func = semantic_cache.semantic_cached_model_func('test-model', model_func, None, lambda prompt_text: True)
+    assert func('What is the capital of France?', use_cache=True) == 'answer 1'
+    assert func('what is the capital of France', use_cache=True) == 'answer 1'
+    assert func('What is the capital of France?') == 'answer 2'
+    assert func('What is the capital of France?', temperature=0.9, use_cache=True) == 'answer 3'
+    assert calls == [ ('What is the capital of France?', True), ('What is the capital of France?', False),
+                      ('What is the capital of France?', True) ]
+
+def test_auto_generated_prompts_are_not_matched(monkeypatch):
+    monkeypatch.setattr(semantic_cache, 'SEMANTIC_CACHE_ENABLED', True)
+    monkeypatch.setattr(semantic_cache, 'semantic_caches', {})
+    calls = []
+
+    def model_func(prompt_text, use_cache=False):
+        calls.append(prompt_text)
+        return 'answer {}'.format(len(calls))
+
+    func = semantic_cache.semantic_cached_model_func('test-model', model_func, None, lambda prompt_text: False)
+    func('Generate three prompts', use_cache=True)
+    func('Generate three prompts', use_cache=True)
+    assert len(calls) == 2
@@ -0,0 +1,17 @@
+import logging
+from utils import structured_logging
+
+
+def invoke_model():
+    structured_logging.log_request('anthropic.claude-v2', b'{"prompt": "Hello"}')
+    structured_logging.log_response('anthropic.claude-v2', { 'completion': 'Hi' })
+    structured_logging.log_event(logging.INFO, 'Invocation Cost', 'anthropic.claude-v2', cost='$0.00000100')
+
+def test_records_point_at_the_calling_function(caplog):
+    with caplog.at_level(logging.DEBUG, logger='gen-ai-invoker'):
+        invoke_model()
+
+    records = [ record for record in caplog.records if record.name == 'gen-ai-invoker' ]
+    assert [ record.event for record in records ] == [ 'Invoking model', 'Model response', 'Invocation Cost' ]
+    assert all(record.funcName == 'invoke_model' and record.filename == 'test_structured_logging.py' for record in records)
+    assert records[0].fields['model'] == 'anthropic.claude-v2'
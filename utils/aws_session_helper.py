@@ -0,0 +1,100 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Helper utility to share one AWS session per process and hand out cached, pooled clients to all pages
+import os
+import threading
+import logging
+import boto3
+from botocore.config import Config
+import pages.imports.sts_assume_role as boto3_session
+from utils import telemetry
+
+logger = logging.getLogger('gen-ai-invoker')
+
+region = os.environ['AWS_DEFAULT_REGION']
+
+AWS_MAX_POOL_CONNECTIONS = (int)(os.getenv('AWS_MAX_POOL_CONNECTIONS', '50'))
+AWS_MAX_RETRY_ATTEMPTS = (int)(os.getenv('AWS_MAX_RETRY_ATTEMPTS', '5'))
+AWS_CONNECT_TIMEOUT = (int)(os.getenv('AWS_CONNECT_TIMEOUT', '10'))
+# Model invocations over large documents can take minutes to respond
+AWS_READ_TIMEOUT = (int)(os.getenv('AWS_READ_TIMEOUT', '300'))
+
+DEFAULT_CLIENT_CONFIG = Config(
+    region_name = region,
+    max_pool_connections = AWS_MAX_POOL_CONNECTIONS,
+    tcp_keepalive = True,
+    connect_timeout = AWS_CONNECT_TIMEOUT,
+    read_timeout = AWS_READ_TIMEOUT,
+    retries = {
+        'max_attempts': AWS_MAX_RETRY_ATTEMPTS,
+        'mode': 'adaptive'
+    }
+)
+
+# Model invocations are retried by utils/rate_limiter, which also needs to see the throttling errors
+SERVICE_CLIENT_CONFIGS = {
+    'bedrock-runtime': DEFAULT_CLIENT_CONFIG.merge(Config(retries = { 'total_max_attempts': 1, 'mode': 'standard' })),
+    # Image detections answer in seconds, utils/image_analyzer stops waiting for them after its own timeout
+    'rekognition': DEFAULT_CLIENT_CONFIG.merge(Config(read_timeout = 30, retries = { 'max_attempts': 2, 'mode': 'adaptive' }))
+}
+
+# Sessions are not thread-safe, so they are only used under the lock to create clients.
+# Clients are thread-safe and shared across all streamlit sessions in the process.
+registry_lock = threading.Lock()
+autorefresh_session = None
+static_session = None
+clients = {}
+
+
+def get_session(assume_role=True):
+    with registry_lock:
+        return get_session_locked(assume_role)
+
+def get_session_locked(assume_role):
+    global autorefresh_session, static_session
+
+    if assume_role:
+        if autorefresh_session is None:
+            logger.info('Creating shared auto-refreshing session for role: {}'.format(boto3_session.assume_role_arn))
+            autorefresh_session = boto3_session.run_autorefresh_session()
+        return autorefresh_session
+
+    # Session using the static credentials from the environment
+    if static_session is None:
+        logger.info('Creating shared session with environment credentials')
+        static_session = boto3.session.Session(region_name=region)
+    return static_session
+
+def get_client(service_name, assume_role=True):
+    client_key = (service_name, assume_role)
+    client = clients.get(client_key)
+    if client is not None:
+        return client
+
+    with registry_lock:
+        client = clients.get(client_key)
+        if client is None:
+            session = get_session_locked(assume_role)
+            client = session.client(service_name, config=SERVICE_CLIENT_CONFIGS.get(service_name, DEFAULT_CLIENT_CONFIG))
+            # Every call of the client is traced as a span, see utils/telemetry
+            telemetry.instrument_client(client)
+            clients[client_key] = client
+            logger.info('Created shared client for service: {}, assume role: {}'.format(service_name, assume_role))
+
+    return client
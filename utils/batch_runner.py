@@ -0,0 +1,628 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Offline batch runner for JSONL prompt files, run from the repository root:
+#   python -m utils.batch_runner prompts.jsonl results.jsonl [--dry-run] [--workers 8] [--backend auto]
+# Each input line is a record {"id": ..., "model": ..., "prompt": ..., "params": {...}}, model is a model name
+# from the page selectors or a Bedrock model id. Results are appended to the output file as they complete, a
+# rerun skips the records already answered. Large per-model volumes can go to Bedrock batch inference jobs.
+import os
+import sys
+import json
+import time
+import uuid
+import hashlib
+import logging
+import argparse
+import functools
+import threading
+import collections
+import concurrent.futures
+import numpy as np
+import anthropic
+from utils import gen_ai_selector
+from utils import token_counter
+from utils import response_cache
+from utils import aws_session_helper
+
+logger = logging.getLogger('gen-ai-invoker')
+
+BATCH_RUNNER_WORKERS = (int)(os.getenv('BATCH_RUNNER_WORKERS', '8'))
+# Service role and s3://bucket/prefix used for Bedrock batch inference jobs
+BATCH_JOB_ROLE_ARN = os.getenv('BATCH_JOB_ROLE_ARN')
+BATCH_JOB_S3_URI = os.getenv('BATCH_JOB_S3_URI')
+# Models with fewer pending records than this run locally with the auto backend, batch jobs have a minimum size
+BATCH_JOB_MIN_RECORDS = (int)(os.getenv('BATCH_JOB_MIN_RECORDS', '100'))
+BATCH_JOB_POLL_INTERVAL = (int)(os.getenv('BATCH_JOB_POLL_INTERVAL', '60'))
+BATCH_REPORT_INTERVAL = (int)(os.getenv('BATCH_REPORT_INTERVAL', '30'))
+
+BACKENDS = [ 'auto', 'local', 'bedrock-batch', 'local-batch' ]
+BATCH_JOB_FINAL_STATES = [ 'Completed', 'PartiallyCompleted', 'Failed', 'Stopped', 'Expired' ]
+
+
+def validate_record(record):
+    # Returns why the record cannot be run, None for a valid record
+    if not isinstance(record, dict):
+        return 'Invalid record: expected a JSON object'
+    for field in [ 'model', 'prompt' ]:
+        if not isinstance(record.get(field), str) or not record[field]:
+            return 'Invalid record: missing or non-string "{}"'.format(field)
+    if not isinstance(record.get('params', {}), dict):
+        return 'Invalid record: "params" must be a JSON object'
+    return None
+
+def parse_records(input_path, completed_ids=frozenset()):
+
+    # Streams (record_id, record, error) triples, error is None for valid records. Records without an id are
+    # keyed by their line number
+    with open(input_path, 'r') as input_file:
+        for line_number, line in enumerate(input_file, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e1:
+                record = None
+                error = 'Malformed record: {}'.format(e1)
+            else:
+                error = validate_record(record)
+
+            record_id = str(record['id']) if isinstance(record, dict) and record.get('id') is not None else f'line-{line_number}'
+            if record_id not in completed_ids:
+                yield record_id, record, error
+
+def read_records(input_path, completed_ids=frozenset()):
+    # Streams the (record_id, record) pairs of the valid records, see read_invalid_records for the others
+    for record_id, record, error in parse_records(input_path, completed_ids):
+        if error is None:
+            yield record_id, record
+
+def read_invalid_records(input_path, completed_ids=frozenset()):
+    for record_id, record, error in parse_records(input_path, completed_ids):
+        if error is not None:
+            yield record_id, record, error
+
+def read_completed_ids(output_path):
+    # Failed records are not counted as completed, so a rerun retries them
+    completed_ids = set()
+    if not os.path.exists(output_path):
+        return completed_ids
+
+    with open(output_path, 'r') as output_file:
+        for line in output_file:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line may be cut short by a crash
+                continue
+            if result.get('error') is None:
+                completed_ids.add(str(result['id']))
+    return completed_ids
+
+
+class ResultWriter:
+
+    # Appends one JSON line per result and syncs it to disk, the output file doubles as the resume checkpoint
+    def __init__(self, output_path):
+        self.lock = threading.Lock()
+        self.output_file = open(output_path, 'a')
+
+    def write(self, result):
+        line = json.dumps(result, default=str) + '\n'
+        with self.lock:
+            self.output_file.write(line)
+            self.output_file.flush()
+            os.fsync(self.output_file.fileno())
+
+    def close(self):
+        with self.lock:
+            self.output_file.close()
+
+
+class ThroughputReport:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.totals = collections.Counter()
+        self.cost = 0.0
+        self.latencies = collections.defaultdict(list)
+
+    def record(self, result):
+        with self.lock:
+            self.totals['records'] += 1
+            self.totals['errors' if result.get('error') is not None else 'succeeded'] += 1
+            self.totals['input_tokens'] += result.get('input_tokens', 0)
+            self.totals['output_tokens'] += result.get('output_tokens', 0)
+            self.cost += result.get('cost', 0.0)
+            if result.get('latency_ms') is not None:
+                self.latencies[result['model']].append(result['latency_ms'])
+
+    def get_stats(self):
+        with self.lock:
+            elapsed = max(time.time() - self.start_time, 1e-6)
+            stats = dict(self.totals)
+            stats['elapsed_seconds'] = round(elapsed, 1)
+            stats['records_per_second'] = round(self.totals['records']/elapsed, 2)
+            stats['output_tokens_per_second'] = round(self.totals['output_tokens']/elapsed, 1)
+            stats['cost'] = round(self.cost, 6)
+            stats['latency_ms'] = { model: { 'p50': int(np.percentile(latencies, 50)), 'p95': int(np.percentile(latencies, 95)) }
+                                    for model, latencies in self.latencies.items() }
+            return stats
+
+
+model_entries = {}
+model_entries_lock = threading.Lock()
+
+def get_bedrock_model_id(model):
+    # Model names from the page selectors map to Bedrock model ids, anything else is taken as a model id
+    return gen_ai_selector.genai_model_entries.get(model, model)
+
+def resolve_model(model):
+    with model_entries_lock:
+        model_entry = model_entries.get(model)
+        if model_entry is None:
+            model_entry = gen_ai_selector.genai_model_functions.get(model)
+            if model_entry is None:
+                model_entry = gen_ai_selector.wrap_model_entry(gen_ai_selector.find_bedrock_model(model))
+            model_entries[model] = model_entry
+        return model_entry
+
+def get_token_prices(model_id):
+    llm_price_entry = gen_ai_selector.LLM_COST_DATA.get(model_id) or gen_ai_selector.find_matching_entry(model_id)
+    if llm_price_entry is None:
+        return None
+    return float(llm_price_entry['input_token_price']), float(llm_price_entry['output_token_price'] or 0)
+
+def get_cost(model_id, input_tokens, output_tokens):
+    token_prices = get_token_prices(model_id)
+    if token_prices is None:
+        return 0.0
+    return input_tokens*token_prices[0]/1000 + output_tokens*token_prices[1]/1000
+
+def get_max_output_tokens(record):
+    params = record.get('params', {})
+    for name in [ 'max_tokens', 'max_new_tokens', 'max_length' ]:
+        if name in params:
+            return int(params[name])
+    return token_counter.get_reserved_output_tokens(resolve_model(record['model']))
+
+def make_result(record_id, record, backend, response=None, error=None, latency_ms=None, token_counts=None):
+    # Error results are also made for invalid records, which may have no model or not be a dict at all
+    model = record.get('model') if isinstance(record, dict) else None
+    result = { 'id': record_id, 'model': model, 'backend': backend }
+    if error is not None:
+        result['error'] = str(error)
+        return result
+
+    # Token counts are estimated when the backend does not report them
+    model_id = get_bedrock_model_id(model)
+    if token_counts is None:
+        token_counts = (token_counter.count_tokens(record['prompt'], model_id), token_counter.count_tokens(response, model_id))
+    result['response'] = response
+    result['input_tokens'], result['output_tokens'] = token_counts
+    result['cost'] = round(get_cost(model_id, *token_counts), 8)
+    if latency_ms is not None:
+        result['latency_ms'] = latency_ms
+    return result
+
+def estimate_cost(records):
+    """
+    Dry run, counts the input tokens of the records per model and prices them with utils/llm_pricing.csv.
+    The output cost is an upper bound using the max output tokens of each record.
+    """
+    estimates = {}
+    for record_id, record in records:
+        model_id = get_bedrock_model_id(record['model'])
+        estimate = estimates.setdefault(record['model'], collections.Counter())
+        estimate['records'] += 1
+        estimate['input_tokens'] += token_counter.count_tokens(record['prompt'], model_id)
+        estimate['max_output_tokens'] += get_max_output_tokens(record)
+
+    for model, estimate in estimates.items():
+        model_id = get_bedrock_model_id(model)
+        estimate['input_cost'] = round(get_cost(model_id, estimate['input_tokens'], 0), 6)
+        estimate['max_cost'] = round(get_cost(model_id, estimate['input_tokens'], estimate['max_output_tokens']), 6)
+        estimate['priced'] = get_token_prices(model_id) is not None
+    return estimates
+
+
+class LocalBackend:
+
+    # Runs the records through the model functions of gen_ai_selector, so the per-model rate limits, retries
+    # and response caches apply. At most twice the number of workers records are read ahead of the pool.
+    name = 'local'
+
+    def __init__(self, workers=BATCH_RUNNER_WORKERS):
+        self.workers = workers
+
+    def run_record(self, record_id, record):
+        start_time = time.time()
+        try:
+            model_entry = resolve_model(record['model'])
+            response = model_entry['func'](record['prompt'], **record.get('params', {}))
+        except Exception as e1:
+            logger.exception(e1)
+            return make_result(record_id, record, self.name, error=e1)
+
+        latency_ms = int((time.time() - start_time)*1000)
+        if not response_cache.is_cacheable_response(response):
+            return make_result(record_id, record, self.name, error=response or 'Empty response')
+        return make_result(record_id, record, self.name, response=response, latency_ms=latency_ms)
+
+    def run(self, records, writer, report):
+        read_ahead = threading.BoundedSemaphore(self.workers*2)
+
+        def on_done(record_id, record, future):
+            # The read ahead slot is given back whatever happens, or the reader would block for good
+            try:
+                try:
+                    result = future.result()
+                except Exception as e1:
+                    logger.exception(e1)
+                    result = make_result(record_id, record, self.name, error=e1)
+                writer.write(result)
+                report.record(result)
+            finally:
+                read_ahead.release()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='batch-runner') as executor:
+            for record_id, record in records:
+                read_ahead.acquire()
+                executor.submit(self.run_record, record_id, record).add_done_callback(functools.partial(on_done, record_id, record))
+
+
+def build_model_input(model_id, prompt_text, params):
+
+    # Request bodies of the batch job records, with the same defaults as the model functions in gen_ai_selector
+    if 'claude-3' in model_id:
+        return { 'anthropic_version': 'bedrock-2023-05-31', 'max_tokens': params.get('max_tokens', 8192),
+                 'temperature': params.get('temperature', 0.5),
+                 'messages': [ { 'role': 'user', 'content': [ { 'type': 'text', 'text': prompt_text } ] } ] }
+    if 'anthropic' in model_id:
+        return { 'prompt': anthropic.HUMAN_PROMPT + prompt_text + anthropic.AI_PROMPT,
+                 'max_tokens_to_sample': params.get('max_tokens', 2048), 'temperature': params.get('temperature', 0.5) }
+    if 'titan-text' in model_id:
+        return { 'inputText': prompt_text, 'textGenerationConfig': { 'maxTokenCount': params.get('max_tokens', 4096),
+                 'topP': params.get('top_p', 0.9), 'temperature': params.get('temperature', 0.5), 'stopSequences': params.get('stop_sequences', []) } }
+    if 'llama' in model_id:
+        return { 'prompt': prompt_text, 'max_gen_len': params.get('max_new_tokens', 2000),
+                 'temperature': params.get('temperature', 0.6), 'top_p': params.get('top_p', 0.9) }
+    if 'mistral' in model_id or 'mixtral' in model_id:
+        return { 'prompt': f'<s>[INST]{prompt_text}.[/INST]', 'max_tokens': params.get('max_tokens', 500),
+                 'temperature': params.get('temperature', 0.7), 'top_p': params.get('top_p', 0.7), 'top_k': params.get('top_k', 50) }
+    raise ValueError('Model not supported by Bedrock batch inference jobs: {}'.format(model_id))
+
+def parse_model_output(model_output):
+    # Returns the text and the (input, output) token counts when the model reports them
+    if 'content' in model_output:
+        usage = model_output.get('usage', {})
+        return model_output['content'][0]['text'], (usage['input_tokens'], usage['output_tokens']) if usage else None
+    if 'completion' in model_output:
+        return model_output['completion'], None
+    if 'results' in model_output:
+        result = model_output['results'][0]
+        return result['outputText'], (model_output['inputTextTokenCount'], result['tokenCount']) if 'inputTextTokenCount' in model_output else None
+    if 'generation' in model_output:
+        token_counts = (model_output['prompt_token_count'], model_output['generation_token_count']) if 'prompt_token_count' in model_output else None
+        return model_output['generation'], token_counts
+    if 'outputs' in model_output:
+        return model_output['outputs'][0]['text'], None
+    raise ValueError('Unknown model output format: {}'.format(list(model_output.keys())))
+
+def split_s3_uri(s3_uri):
+    bucket, _, key = s3_uri[len('s3://'):].partition('/')
+    return bucket, key
+
+
+class S3Store:
+
+    def __init__(self, s3):
+        self.s3 = s3
+
+    def put_text(self, s3_uri, text):
+        bucket, key = split_s3_uri(s3_uri)
+        self.s3.put_object(Bucket=bucket, Key=key, Body=text.encode('utf-8'))
+
+    def get_text(self, s3_uri):
+        bucket, key = split_s3_uri(s3_uri)
+        return self.s3.get_object(Bucket=bucket, Key=key)['Body'].read().decode('utf-8')
+
+
+class LocalStore:
+
+    # Keeps s3:// objects under a local directory, used with the local batch job stand-in
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+
+    def get_path(self, s3_uri):
+        return os.path.join(self.root_dir, *split_s3_uri(s3_uri))
+
+    def put_text(self, s3_uri, text):
+        # Replaced at once like an S3 object, readers never see a partial file
+        path = self.get_path(s3_uri)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(temp_path, 'w') as object_file:
+            object_file.write(text)
+        os.replace(temp_path, path)
+
+    def get_text(self, s3_uri):
+        with open(self.get_path(s3_uri), 'r') as object_file:
+            return object_file.read()
+
+
+def fake_invoke(model_id, model_input):
+    """
+    Deterministic stand-in for the models of local batch jobs, answering in the output formats read by
+    parse_model_output. The answer and the token counts only depend on the model id and the input.
+    """
+    request_text = json.dumps(model_input, sort_keys=True)
+    digest = hashlib.sha256((model_id + request_text).encode('utf-8')).hexdigest()[:16]
+    text = 'Local batch answer {} of model {}'.format(digest, model_id)
+    input_tokens = len(request_text)//4 + 1
+    output_tokens = len(text.split())
+
+    if 'claude-3' in model_id:
+        return { 'content': [ { 'type': 'text', 'text': text } ], 'usage': { 'input_tokens': input_tokens, 'output_tokens': output_tokens } }
+    if 'anthropic' in model_id:
+        return { 'completion': text, 'stop_reason': 'stop_sequence' }
+    if 'titan-text' in model_id:
+        return { 'inputTextTokenCount': input_tokens, 'results': [ { 'tokenCount': output_tokens, 'outputText': text, 'completionReason': 'FINISH' } ] }
+    if 'llama' in model_id:
+        return { 'generation': text, 'prompt_token_count': input_tokens, 'generation_token_count': output_tokens, 'stop_reason': 'stop' }
+    if 'mistral' in model_id or 'mixtral' in model_id:
+        return { 'outputs': [ { 'text': text, 'stop_reason': 'stop' } ] }
+    raise ValueError('Model not supported by Bedrock batch inference jobs: {}'.format(model_id))
+
+
+class LocalBatchJobClient:
+
+    # Stand-in for the Bedrock control plane batch job calls, no AWS access needed. Each job reads its input
+    # from the store, answers record by record with invoke_func(model_id, model_input), fake_invoke by default,
+    # and writes the .out file the way Bedrock does, under <output uri>/<job id>/<input file name>.out.
+    # Jobs are kept in the store too, so a rerun can collect the jobs of the checkpoint
+    def __init__(self, store, invoke_func=None):
+        self.store = store
+        self.invoke_func = fake_invoke if invoke_func is None else invoke_func
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def get_job_uri(self, job_arn):
+        return 's3://local-batch-jobs/{}.json'.format(job_arn.split('/')[-1])
+
+    def save_job(self, job):
+        self.store.put_text(self.get_job_uri(job['jobArn']), json.dumps(job))
+
+    def start_job(self, job):
+        with self.lock:
+            self.jobs[job['jobArn']] = job
+        self.save_job(job)
+        threading.Thread(target=self.run_job, args=(job['jobArn'],), name='local-batch-job', daemon=True).start()
+
+    def create_model_invocation_job(self, jobName, roleArn, modelId, inputDataConfig, outputDataConfig, **kwargs):
+        job_arn = 'arn:aws:bedrock:local:000000000000:model-invocation-job/' + uuid.uuid4().hex[:12]
+        self.start_job({ 'jobArn': job_arn, 'jobName': jobName, 'modelId': modelId, 'status': 'InProgress',
+                         'inputDataConfig': inputDataConfig, 'outputDataConfig': outputDataConfig })
+        return { 'jobArn': job_arn }
+
+    def get_model_invocation_job(self, jobIdentifier):
+        with self.lock:
+            job = self.jobs.get(jobIdentifier)
+        if job is not None:
+            return dict(job)
+
+        # A job of an earlier run, restarted when that run stopped before it completed
+        job = json.loads(self.store.get_text(self.get_job_uri(jobIdentifier)))
+        if job['status'] in BATCH_JOB_FINAL_STATES:
+            return job
+        self.start_job(job)
+        return dict(job)
+
+    def run_job(self, job_arn):
+        job = self.get_model_invocation_job(job_arn)
+        input_uri = job['inputDataConfig']['s3InputDataConfig']['s3Uri']
+        output_lines = []
+        for line in self.store.get_text(input_uri).splitlines():
+            batch_record = json.loads(line)
+            output_record = { 'recordId': batch_record['recordId'], 'modelInput': batch_record['modelInput'] }
+            try:
+                output_record['modelOutput'] = self.invoke_func(job['modelId'], batch_record['modelInput'])
+            except Exception as e1:
+                output_record['error'] = { 'errorCode': 500, 'errorMessage': str(e1) }
+            output_lines.append(json.dumps(output_record))
+
+        self.store.put_text(get_job_output_uri(job), '\n'.join(output_lines) + '\n')
+        with self.lock:
+            self.jobs[job_arn]['status'] = 'Completed'
+            job = dict(self.jobs[job_arn])
+        self.save_job(job)
+
+def get_job_output_uri(job):
+    input_uri = job['inputDataConfig']['s3InputDataConfig']['s3Uri']
+    output_uri = job['outputDataConfig']['s3OutputDataConfig']['s3Uri'].rstrip('/')
+    return '{}/{}/{}.out'.format(output_uri, job['jobArn'].split('/')[-1], input_uri.split('/')[-1])
+
+
+class BedrockBatchBackend:
+
+    # Submits one batch inference job per model and writes its results once the job ends. The job ARNs are
+    # kept next to the output file, so a rerun collects the jobs already submitted instead of paying twice.
+    name = 'bedrock-batch'
+
+    def __init__(self, bedrock, store, role_arn, s3_uri, checkpoint_path, poll_interval=BATCH_JOB_POLL_INTERVAL):
+        self.bedrock = bedrock
+        self.store = store
+        self.role_arn = role_arn
+        self.s3_uri = s3_uri.rstrip('/')
+        self.checkpoint_path = checkpoint_path
+        self.poll_interval = poll_interval
+
+    def load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return {}
+        with open(self.checkpoint_path, 'r') as checkpoint_file:
+            return json.load(checkpoint_file)
+
+    def save_checkpoint(self, checkpoint):
+        temp_path = self.checkpoint_path + '.tmp'
+        with open(temp_path, 'w') as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def submit_job(self, model_id, records):
+        job_name = 'gen-ai-batch-{}'.format(uuid.uuid4().hex[:12])
+        input_uri = '{}/input/{}.jsonl'.format(self.s3_uri, job_name)
+        lines = [ json.dumps({ 'recordId': record_id, 'modelInput': build_model_input(model_id, record['prompt'], record.get('params', {})) })
+                  for record_id, record in records ]
+        self.store.put_text(input_uri, '\n'.join(lines) + '\n')
+
+        response = self.bedrock.create_model_invocation_job(jobName=job_name, roleArn=self.role_arn, modelId=model_id,
+                                                             inputDataConfig={ 's3InputDataConfig': { 's3Uri': input_uri } },
+                                                             outputDataConfig={ 's3OutputDataConfig': { 's3Uri': self.s3_uri + '/output/' } })
+        logger.info('Submitted batch job: {} for {} records of model: {}'.format(response['jobArn'], len(records), model_id))
+        return response['jobArn']
+
+    def wait_for_job(self, job_arn):
+        while True:
+            job = self.bedrock.get_model_invocation_job(jobIdentifier=job_arn)
+            if job['status'] in BATCH_JOB_FINAL_STATES:
+                return job
+            logger.info('Batch job: {} is {}'.format(job_arn, job['status']))
+            time.sleep(self.poll_interval)
+
+    def collect_job(self, job, records, writer, report):
+        records_by_id = dict(records)
+        if job['status'] not in [ 'Completed', 'PartiallyCompleted' ]:
+            for record_id, record in records:
+                result = make_result(record_id, record, self.name, error='Batch job {}: {}'.format(job['status'], job.get('message', '')))
+                writer.write(result)
+                report.record(result)
+            return
+
+        for line in self.store.get_text(get_job_output_uri(job)).splitlines():
+            output_record = json.loads(line)
+            record = records_by_id.get(output_record['recordId'])
+            if record is None:
+                continue
+            if 'modelOutput' in output_record:
+                response, token_counts = parse_model_output(output_record['modelOutput'])
+                result = make_result(output_record['recordId'], record, self.name, response=response, token_counts=token_counts)
+            else:
+                result = make_result(output_record['recordId'], record, self.name, error=output_record.get('error'))
+            writer.write(result)
+            report.record(result)
+
+    def run(self, records, writer, report):
+        records_by_model = collections.defaultdict(list)
+        for record_id, record in records:
+            records_by_model[get_bedrock_model_id(record['model'])].append((record_id, record))
+
+        checkpoint = self.load_checkpoint()
+        for model_id, model_records in records_by_model.items():
+            if model_id not in checkpoint:
+                checkpoint[model_id] = self.submit_job(model_id, model_records)
+                self.save_checkpoint(checkpoint)
+
+        for model_id, model_records in records_by_model.items():
+            self.collect_job(self.wait_for_job(checkpoint[model_id]), model_records, writer, report)
+            del checkpoint[model_id]
+            self.save_checkpoint(checkpoint)
+
+
+def create_batch_backend(backend, output_path):
+    checkpoint_path = output_path + '.jobs.json'
+    if backend == 'local-batch':
+        store = LocalStore(output_path + '.store')
+        return BedrockBatchBackend(LocalBatchJobClient(store), store, 'local', BATCH_JOB_S3_URI or 's3://local-batch', checkpoint_path, poll_interval=1)
+
+    if not (BATCH_JOB_ROLE_ARN and BATCH_JOB_S3_URI):
+        raise ValueError('BATCH_JOB_ROLE_ARN and BATCH_JOB_S3_URI are required for Bedrock batch inference jobs')
+    return BedrockBatchBackend(gen_ai_selector.bedrock, S3Store(aws_session_helper.get_client('s3')), BATCH_JOB_ROLE_ARN,
+                               BATCH_JOB_S3_URI, checkpoint_path)
+
+def find_batch_models(input_path, completed_ids):
+    # Models with enough pending records to be worth a batch job
+    pending_counts = collections.Counter(get_bedrock_model_id(record['model']) for record_id, record in read_records(input_path, completed_ids))
+    return { model_id for model_id, count in pending_counts.items() if count >= BATCH_JOB_MIN_RECORDS }
+
+def report_progress(report, stop_event):
+    while not stop_event.wait(BATCH_REPORT_INTERVAL):
+        logger.info('Batch progress: {}'.format(report.get_stats()))
+
+def run_batch(input_path, output_path, backend='local', workers=BATCH_RUNNER_WORKERS):
+    """
+    Runs the pending records of the input file and appends the results to the output file.
+    backend is one of BACKENDS, auto sends the models with at least BATCH_JOB_MIN_RECORDS pending records
+    to Bedrock batch jobs when BATCH_JOB_ROLE_ARN and BATCH_JOB_S3_URI are set, the rest runs locally.
+    Returns the throughput report stats.
+    """
+    completed_ids = read_completed_ids(output_path)
+    logger.info('Resuming batch with {} completed records'.format(len(completed_ids)))
+
+    batch_models = set()
+    if backend in [ 'bedrock-batch', 'local-batch' ]:
+        batch_models = None
+    elif backend == 'auto' and BATCH_JOB_ROLE_ARN and BATCH_JOB_S3_URI:
+        batch_models = find_batch_models(input_path, completed_ids)
+
+    writer = ResultWriter(output_path)
+    report = ThroughputReport()
+    stop_event = threading.Event()
+    threading.Thread(target=report_progress, args=(report, stop_event), name='batch-report', daemon=True).start()
+    try:
+        # Invalid lines are answered with an error result, they are retried once fixed in the input file
+        for record_id, record, error in read_invalid_records(input_path, completed_ids):
+            logger.warning('Record {}: {}'.format(record_id, error))
+            result = make_result(record_id, record, 'validation', error=error)
+            writer.write(result)
+            report.record(result)
+        if batch_models is None or batch_models:
+            batch_backend = create_batch_backend('bedrock-batch' if backend == 'auto' else backend, output_path)
+            batch_backend.run(( (record_id, record) for record_id, record in read_records(input_path, completed_ids)
+                                if batch_models is None or get_bedrock_model_id(record['model']) in batch_models ), writer, report)
+        if batch_models is not None:
+            LocalBackend(workers).run(( (record_id, record) for record_id, record in read_records(input_path, completed_ids)
+                                        if get_bedrock_model_id(record['model']) not in batch_models ), writer, report)
+    finally:
+        stop_event.set()
+        writer.close()
+
+    return report.get_stats()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a JSONL file of {model, prompt, params} records through the Gen AI models.')
+    parser.add_argument('input_path')
+    parser.add_argument('output_path')
+    parser.add_argument('--dry-run', action='store_true', help='estimate the token counts and cost without invoking models')
+    parser.add_argument('--workers', type=int, default=BATCH_RUNNER_WORKERS)
+    parser.add_argument('--backend', choices=BACKENDS, default='auto')
+    args = parser.parse_args(argv)
+
+    if args.dry_run:
+        completed_ids = read_completed_ids(args.output_path)
+        for record_id, record, error in read_invalid_records(args.input_path, completed_ids):
+            logger.warning('Record {} is left out of the estimate: {}'.format(record_id, error))
+        report = estimate_cost(read_records(args.input_path, completed_ids))
+    else:
+        report = run_batch(args.input_path, args.output_path, args.backend, args.workers)
+    json.dump(report, sys.stdout, indent=2, default=str)
+    sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
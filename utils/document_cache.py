@@ -0,0 +1,329 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Helper utility to extract the text of S3 documents once. Pages are extracted lazily and cached as they are
+# produced, keyed by bucket, object key, ETag and extractor version, in a size bounded SQLite file that several
+# processes can share. A read that only needs the head of a document stops early, a full read of a long PDF is
+# spread across a process pool, and follow-up questions neither download nor parse the document again.
+import os
+import io
+import time
+import json
+import hashlib
+import sqlite3
+import logging
+import threading
+import contextlib
+import collections
+import multiprocessing
+import concurrent.futures
+from utils import page_extractor
+from utils import token_counter
+from utils import object_store
+
+logger = logging.getLogger('gen-ai-invoker')
+
+DOCUMENT_CACHE_DB = os.getenv('DOCUMENT_CACHE_DB', '/tmp/gen-ai-document-cache.db')
+# Use DELETE journal mode when the db lives on a network file system, WAL needs shared memory
+DOCUMENT_CACHE_JOURNAL_MODE = os.getenv('DOCUMENT_CACHE_JOURNAL_MODE', 'WAL')
+DOCUMENT_CACHE_MAX_DB_BYTES = (int)(os.getenv('DOCUMENT_CACHE_MAX_DB_BYTES', str(512*1024*1024)))
+DOCUMENT_CACHE_MEMORY_ENTRIES = (int)(os.getenv('DOCUMENT_CACHE_MEMORY_ENTRIES', '16'))
+# Worker processes extracting the pages of long PDFs, 1 extracts them in the calling thread
+DOCUMENT_EXTRACT_PROCESSES = (int)(os.getenv('DOCUMENT_EXTRACT_PROCESSES', str(min(os.cpu_count() or 1, 4))))
+# PDFs with fewer pages left to extract are not worth the cost of the worker processes
+DOCUMENT_EXTRACT_PARALLEL_MIN_PAGES = (int)(os.getenv('DOCUMENT_EXTRACT_PARALLEL_MIN_PAGES', '24'))
+
+# Part of the cache key, bump it whenever the extracted text of a file type changes
+EXTRACTOR_VERSION = '2'
+TEXT_FILE_TYPES = page_extractor.TEXT_FILE_TYPES
+PAGE_SEPARATOR = '\n'
+
+memory_cache = collections.OrderedDict()
+memory_cache_lock = threading.Lock()
+db_local = threading.local()
+db_init_lock = threading.Lock()
+db_initialized = False
+process_pool = None
+process_pool_lock = threading.Lock()
+
+cache_stats = collections.Counter()
+
+
+def get_cache_stats():
+    return dict(cache_stats)
+
+def make_document_key(bucket, object_key, etag):
+    key_source = json.dumps([ bucket, object_key, etag, EXTRACTOR_VERSION ])
+    return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+def get_db():
+    global db_initialized
+
+    conn = getattr(db_local, 'conn', None)
+    if conn is not None:
+        return conn
+
+    conn = sqlite3.connect(DOCUMENT_CACHE_DB, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA busy_timeout=30000')
+    with db_init_lock:
+        if not db_initialized:
+            conn.execute(f'PRAGMA journal_mode={DOCUMENT_CACHE_JOURNAL_MODE}')
+            # page_count stays null until every page of the document is extracted
+            conn.execute('CREATE TABLE IF NOT EXISTS documents ('
+                            'key TEXT PRIMARY KEY, bucket TEXT, object_key TEXT, etag TEXT, page_count INTEGER, '
+                            'size INTEGER, created REAL, last_access REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS documents_last_access ON documents(last_access)')
+            conn.execute('CREATE TABLE IF NOT EXISTS pages ('
+                            'key TEXT, page_number INTEGER, text TEXT, PRIMARY KEY (key, page_number))')
+            db_initialized = True
+
+    db_local.conn = conn
+    return conn
+
+def memory_get(key):
+    with memory_cache_lock:
+        document = memory_cache.get(key)
+        if document is not None:
+            memory_cache.move_to_end(key)
+        return document
+
+def memory_put(key, document):
+    with memory_cache_lock:
+        memory_cache[key] = document
+        memory_cache.move_to_end(key)
+        while len(memory_cache) > DOCUMENT_CACHE_MEMORY_ENTRIES:
+            memory_cache.popitem(last=False)
+
+def disk_get(key):
+    """
+    Returns the page count of the document, None while it is not fully extracted, and its cached pages.
+    """
+    conn = get_db()
+    row = conn.execute('SELECT page_count FROM documents WHERE key = ?', (key,)).fetchone()
+    if row is None:
+        return None, []
+
+    conn.execute('UPDATE documents SET last_access = ? WHERE key = ?', (time.time(), key))
+    pages = [ text for (text,) in conn.execute('SELECT text FROM pages WHERE key = ? ORDER BY page_number', (key,)) ]
+    return row[0], pages
+
+def disk_put_pages(key, bucket, object_key, etag, first_page_number, pages, page_count=None):
+    conn = get_db()
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        inserted = conn.execute('INSERT OR IGNORE INTO documents (key, bucket, object_key, etag, page_count, size, created, last_access) '
+                                'VALUES (?, ?, ?, ?, NULL, 0, ?, ?)', (key, bucket, object_key, etag, now, now)).rowcount
+        # Pages stored by another process extracting the same range are kept, only new rows add to the size
+        size = 0
+        for index, page in enumerate(pages):
+            if conn.execute('INSERT OR IGNORE INTO pages (key, page_number, text) VALUES (?, ?, ?)', (key, first_page_number + index, page)).rowcount:
+                size += len(page.encode('utf-8'))
+        conn.execute('UPDATE documents SET size = size + ?, last_access = ?, page_count = COALESCE(?, page_count) WHERE key = ?',
+                        (size, now, page_count, key))
+        if inserted:
+            # Older versions of the object are never asked for again
+            stale_keys = conn.execute('SELECT key FROM documents WHERE bucket = ? AND object_key = ? AND key != ?', (bucket, object_key, key)).fetchall()
+            delete_documents(conn, stale_keys)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+    if page_count is not None:
+        evict_disk_entries(conn)
+
+def delete_documents(conn, keys):
+    conn.executemany('DELETE FROM pages WHERE key = ?', keys)
+    conn.executemany('DELETE FROM documents WHERE key = ?', keys)
+
+def evict_disk_entries(conn):
+    total_size = conn.execute('SELECT COALESCE(SUM(size), 0) FROM documents').fetchone()[0]
+    if total_size <= DOCUMENT_CACHE_MAX_DB_BYTES:
+        return
+
+    # Drop least recently used documents until back under the limit
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rows = conn.execute('SELECT key, size FROM documents ORDER BY last_access').fetchall()
+        evict_keys = []
+        for key, size in rows:
+            if total_size <= DOCUMENT_CACHE_MAX_DB_BYTES:
+                break
+            evict_keys.append((key,))
+            total_size -= size
+        delete_documents(conn, evict_keys)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+    cache_stats['evictions'] += len(evict_keys)
+    logger.info('Document cache evicted {} entries'.format(len(evict_keys)))
+
+def store_pages(key, bucket, object_key, etag, first_page_number, pages, page_count=None):
+    try:
+        disk_put_pages(key, bucket, object_key, etag, first_page_number, pages, page_count)
+    except sqlite3.Error as e1:
+        logger.warning('Document cache store failed: {}'.format(e1))
+
+
+def get_process_pool():
+    global process_pool
+
+    # Spawned workers only import utils/page_extractor, forking the streamlit process with its threads is unsafe
+    with process_pool_lock:
+        if process_pool is None:
+            process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=DOCUMENT_EXTRACT_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+        return process_pool
+
+def extract_pages_parallel(local_file, start_page, page_count):
+    # Consecutive page ranges, a few per worker so a slow range does not hold up the others
+    range_size = max(1, -(-(page_count - start_page)//(DOCUMENT_EXTRACT_PROCESSES*2)))
+    pool = get_process_pool()
+    futures = [ pool.submit(page_extractor.extract_pdf_page_range, local_file, range_start, min(range_start + range_size, page_count))
+                for range_start in range(start_page, page_count, range_size) ]
+    pages = []
+    for future in futures:
+        pages += future.result()
+    cache_stats['parallel_extractions'] += 1
+    return pages
+
+def extract_remaining_pages(source, object_key, file_type, start_page):
+    page_count = page_extractor.count_pages(source, file_type)
+    if DOCUMENT_EXTRACT_PROCESSES > 1 and page_count is not None and page_count - start_page >= DOCUMENT_EXTRACT_PARALLEL_MIN_PAGES:
+        if isinstance(source, str):
+            return extract_pages_parallel(source, start_page, page_count)
+        # Worker processes open the file on their own
+        with object_store.spill_to_file(source, object_key) as local_file:
+            return extract_pages_parallel(local_file, start_page, page_count)
+    return list(page_extractor.iter_pages(source, file_type, start_page))
+
+@contextlib.contextmanager
+def open_source(s3, bucket, object_key, file_type):
+    # Formats the extractors read from file objects are read into memory, the others go to a managed temp file
+    data = None
+    if page_extractor.reads_file_objects(file_type):
+        try:
+            data = object_store.read_object(s3, bucket, object_key)
+        except object_store.ObjectTooLarge as e1:
+            logger.info('Extracting from a temp file: {}'.format(e1))
+    cache_stats['downloads'] += 1
+    if data is not None:
+        yield io.BytesIO(data)
+    else:
+        with object_store.temporary_file(s3, bucket, object_key) as local_file:
+            yield local_file
+
+def join_pages(pages):
+    page_offsets = []
+    offset = 0
+    for page in pages:
+        page_offsets.append(offset)
+        offset += len(page) + len(PAGE_SEPARATOR)
+    return PAGE_SEPARATOR.join(pages), page_offsets
+
+def read_cached(key):
+    try:
+        return disk_get(key)
+    except sqlite3.Error as e1:
+        logger.warning('Document cache lookup failed: {}'.format(e1))
+        return None, []
+
+def iter_document_pages(s3, bucket, object_key, file_type):
+    """
+    Yields the text of the pages of an S3 object in order. Cached pages come first, the object is
+    read only when more pages are needed, and each extracted page is cached before it is yielded,
+    so a reader that stops early keeps the pages it read for the next one.
+    """
+    etag = object_store.get_etag(s3, bucket, object_key)
+    key = make_document_key(bucket, object_key, etag)
+    document = memory_get(key)
+    if document is not None:
+        cache_stats['memory_hits'] += 1
+        text, page_offsets = document
+        for index, offset in enumerate(page_offsets):
+            end = page_offsets[index + 1] - len(PAGE_SEPARATOR) if index + 1 < len(page_offsets) else len(text)
+            yield text[offset:end]
+        return
+
+    page_count, cached_pages = read_cached(key)
+    cache_stats['cached_pages'] += len(cached_pages)
+    yield from cached_pages
+    if page_count is not None:
+        return
+
+    with open_source(s3, bucket, object_key, file_type) as source:
+        page_number = len(cached_pages)
+        for page in page_extractor.iter_pages(source, file_type, page_number):
+            store_pages(key, bucket, object_key, etag, page_number, [ page ])
+            cache_stats['extracted_pages'] += 1
+            page_number += 1
+            yield page
+        store_pages(key, bucket, object_key, etag, page_number, [], page_count=page_number)
+
+def get_document_head(s3, bucket, object_key, file_type, max_tokens, model_id):
+    """
+    Returns the leading pages of an S3 object up to the first one that reaches max_tokens for the model,
+    extraction stops there. Summaries of the head of a long document need no more than that.
+    """
+    pages = []
+    tokens = 0
+    document_pages = iter_document_pages(s3, bucket, object_key, file_type)
+    try:
+        for page in document_pages:
+            pages.append(page)
+            tokens += token_counter.count_tokens(page, model_id)
+            if tokens >= max_tokens:
+                cache_stats['early_stops'] += 1
+                break
+    finally:
+        document_pages.close()
+    return PAGE_SEPARATOR.join(pages)
+
+def get_document_text(s3, bucket, object_key, file_type):
+    """
+    Returns the extracted text of an S3 object and the offsets of its pages. The object is read
+    and parsed only for the pages not cached for its current ETag, pages of long PDFs in parallel.
+    """
+    etag = object_store.get_etag(s3, bucket, object_key)
+    key = make_document_key(bucket, object_key, etag)
+
+    document = memory_get(key)
+    if document is not None:
+        cache_stats['memory_hits'] += 1
+        return document
+
+    page_count, pages = read_cached(key)
+    if page_count is not None:
+        cache_stats['disk_hits'] += 1
+        document = join_pages(pages)
+        memory_put(key, document)
+        return document
+
+    cache_stats['misses'] += 1
+    start_time = time.time()
+    with open_source(s3, bucket, object_key, file_type) as source:
+        new_pages = extract_remaining_pages(source, object_key, file_type, len(pages))
+    cache_stats['extracted_pages'] += len(new_pages)
+    store_pages(key, bucket, object_key, etag, len(pages), new_pages, page_count=len(pages) + len(new_pages))
+
+    document = join_pages(pages + new_pages)
+    logger.info('Extracted {} pages ({} cached) of s3://{}/{} in {:.2f}s'.format(len(new_pages), len(pages), bucket, object_key, time.time() - start_time))
+    memory_put(key, document)
+    return document
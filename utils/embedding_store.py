@@ -0,0 +1,223 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Helper utility to embed texts in batches and keep the vectors. Texts are keyed by the hash of their content,
+# only the ones not stored yet are embedded, concurrently, and the unit length float32 vectors are kept in a
+# memory-mapped NumPy file per embedding model with a json index of the keys, so they survive restarts.
+import os
+import json
+import hashlib
+import logging
+import threading
+import collections
+import concurrent.futures
+import numpy as np
+
+logger = logging.getLogger('gen-ai-invoker')
+
+EMBEDDING_STORE_DIR = os.getenv('EMBEDDING_STORE_DIR', '/tmp/gen-ai-embeddings')
+EMBEDDING_STORE_WORKERS = (int)(os.getenv('EMBEDDING_STORE_WORKERS', '8'))
+# New vectors beyond this many are returned but not stored
+EMBEDDING_STORE_MAX_ENTRIES = (int)(os.getenv('EMBEDDING_STORE_MAX_ENTRIES', '100000'))
+
+INITIAL_CAPACITY = 256
+
+store_stats = collections.Counter()
+
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=EMBEDDING_STORE_WORKERS, thread_name_prefix='embedding-store')
+
+
+def get_store_stats():
+    return dict(store_stats)
+
+def content_key(text):
+    return hashlib.sha256(str(text).encode('utf-8')).hexdigest()
+
+def normalize(embedding):
+    # Embedding functions return an error string or exception on failure
+    if embedding is None or isinstance(embedding, (str, Exception)):
+        return None
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if vector.ndim != 1 or norm == 0:
+        return None
+    return vector / norm
+
+
+class EmbeddingStore:
+    """
+    Unit length vectors of one embedding model, rows of a float32 memory-mapped file. The json index
+    holds the dimension and the content keys of the rows, and is written after the rows it lists.
+    """
+
+    def __init__(self, name, directory=EMBEDDING_STORE_DIR, max_entries=EMBEDDING_STORE_MAX_ENTRIES):
+        self.name = name
+        self.max_entries = max_entries
+        self.vectors_path = os.path.join(directory, name + '.f32')
+        self.index_path = os.path.join(directory, name + '.ids.json')
+        self.lock = threading.Lock()
+        self.dimension = None
+        self.vectors = None
+        self.keys = []
+        self.rows = {}
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    def load(self):
+        if not (os.path.exists(self.index_path) and os.path.exists(self.vectors_path)):
+            return
+        try:
+            with open(self.index_path, 'r') as index_file:
+                index = json.load(index_file)
+            dimension = index['dimension']
+            capacity = os.path.getsize(self.vectors_path)//(4*dimension)
+            keys = index['keys'][:capacity]
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r+', shape=(capacity, dimension))
+            self.dimension = dimension
+            self.keys = keys
+            self.rows = { key: row for row, key in enumerate(keys) }
+            logger.info('Loaded {} embeddings of dimension {} from: {}'.format(len(keys), dimension, self.vectors_path))
+        except Exception as e1:
+            # A damaged store is started over rather than failing the pages
+            logger.warning('Ignoring embedding store {}: {}'.format(self.vectors_path, e1))
+
+    def ensure_capacity(self, size):
+        capacity = 0 if self.vectors is None else self.vectors.shape[0]
+        if size <= capacity:
+            return
+        new_capacity = max(INITIAL_CAPACITY, capacity*2, size)
+        if self.vectors is not None:
+            self.vectors.flush()
+            self.vectors = None
+        with open(self.vectors_path, 'ab') as vectors_file:
+            vectors_file.truncate(new_capacity*self.dimension*4)
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r+', shape=(new_capacity, self.dimension))
+
+    def save_index(self):
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w') as index_file:
+            json.dump({ 'dimension': self.dimension, 'keys': self.keys }, index_file)
+        os.replace(temp_path, self.index_path)
+
+    def add(self, keys, vectors):
+        with self.lock:
+            new_rows = [ (key, vector) for key, vector in zip(keys, vectors)
+                         if key not in self.rows and (self.dimension is None or vector.shape[0] == self.dimension) ]
+            new_rows = new_rows[:max(self.max_entries - len(self.keys), 0)]
+            if not new_rows:
+                return
+            if self.dimension is None:
+                self.dimension = new_rows[0][1].shape[0]
+
+            start = len(self.keys)
+            self.ensure_capacity(start + len(new_rows))
+            self.vectors[start:start + len(new_rows)] = np.stack([ vector for key, vector in new_rows ])
+            self.vectors.flush()
+            for key, vector in new_rows:
+                self.rows[key] = len(self.keys)
+                self.keys.append(key)
+            self.save_index()
+            store_stats['stored'] += len(new_rows)
+
+    def get_vectors(self, keys):
+        """
+        Returns the vectors of the keys as one matrix, with zero rows for the keys not stored.
+        """
+        with self.lock:
+            matrix = np.zeros((len(keys), self.dimension or 0), dtype=np.float32)
+            for index, key in enumerate(keys):
+                row = self.rows.get(key)
+                if row is not None:
+                    matrix[index] = self.vectors[row]
+            return matrix
+
+    def embed_texts(self, texts, embed_func):
+        """
+        Embeds the texts with embed_func, a function of one text returning its embedding, and returns
+        their unit length vectors as one matrix in the order of the texts. Texts already stored and
+        duplicates are embedded once, the others concurrently. Texts that fail to embed get zero rows.
+        """
+        keys = [ content_key(text) for text in texts ]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self.rows and key not in missing:
+                missing[key] = text
+        store_stats['hits'] += len(keys) - len(missing)
+        store_stats['embedded'] += len(missing)
+
+        if missing:
+            missing_keys = list(missing)
+            embeddings = list(executor.map(embed_func, [ missing[key] for key in missing_keys ]))
+            vectors = [ normalize(embedding) for embedding in embeddings ]
+            failed = [ key for key, vector in zip(missing_keys, vectors) if vector is None ]
+            if failed:
+                store_stats['failures'] += len(failed)
+                logger.warning('Could not embed {} of {} texts for store: {}'.format(len(failed), len(missing_keys), self.name))
+            self.add([ key for key, vector in zip(missing_keys, vectors) if vector is not None ], [ vector for vector in vectors if vector is not None ])
+
+            # Vectors not kept because the store is full are still returned
+            unstored = { key: vector for key, vector in zip(missing_keys, vectors) if vector is not None and key not in self.rows }
+            if unstored:
+                matrix = self.get_vectors(keys)
+                for index, key in enumerate(keys):
+                    if key in unstored:
+                        matrix[index] = unstored[key]
+                return matrix
+
+        return self.get_vectors(keys)
+
+    def search(self, query_vector, k=5, keys=None):
+        """
+        Top k stored vectors by cosine similarity to the query vector, among the given keys or all of
+        them. Returns (key, similarity) pairs, most similar first.
+        """
+        query_vector = normalize(query_vector)
+        with self.lock:
+            if query_vector is None or not self.keys or query_vector.shape[0] != self.dimension:
+                return []
+            if keys is None:
+                candidate_keys = self.keys
+                candidates = self.vectors[:len(self.keys)]
+            else:
+                candidate_keys = [ key for key in dict.fromkeys(keys) if key in self.rows ]
+                candidates = self.vectors[[ self.rows[key] for key in candidate_keys ]]
+            if not candidate_keys:
+                return []
+
+            # Rows are unit length, so the dot product is the cosine similarity
+            similarities = np.asarray(candidates @ query_vector)
+        k = min(k, len(candidate_keys))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        return [ (candidate_keys[index], float(similarities[index])) for index in top ]
+
+
+stores = {}
+stores_lock = threading.Lock()
+
+def get_store(name):
+    """
+    Shared store of the vectors of one embedding model, name is the model id or another stable name
+    of the embedding function, as it names the files of the store.
+    """
+    with stores_lock:
+        store = stores.get(name)
+        if store is None:
+            store = EmbeddingStore(name.replace('/', '_').replace(':', '_'))
+            stores[name] = store
+        return store
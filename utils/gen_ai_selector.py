@@ -20,22 +20,32 @@ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 import os
 import boto3
 import botocore
-import json
-import anthropic
 import ai21
 import time
 import logging
-import pages.imports.sts_assume_role as boto3_session
+import threading
+import contextlib
+from utils import aws_session_helper
+from utils import model_catalog
+from utils import response_cache
+from utils import semantic_cache
+from utils import rate_limiter
+from utils import hedged_requests
+from utils import single_flight
+from utils import token_counter
+from utils import telemetry
+from utils import structured_logging
+from utils import model_codec
+from utils import jumpstart_invoker
+from utils import embedding_store
 import csv
 import collections
 import streamlit as st
 
-autorefresh_session = boto3_session.run_autorefresh_session()
-
 FORMAT = '%(asctime)s %(message)s'
 logging.basicConfig(format=FORMAT, level=logging.INFO)
 logger = logging.getLogger('gen-ai-invoker')
-client = boto3.client('runtime.sagemaker')
+client = aws_session_helper.get_client('runtime.sagemaker', assume_role=False)
 
 MODEL_FAMILY = [ 'JUMPSTART', 'BEDROCK' ]
 MODEL_FAMILY_JUMPSTART = 0
@@ -46,27 +56,30 @@ secret = os.environ['AWS_SECRET_ACCESS_KEY']
 region = os.environ['AWS_DEFAULT_REGION']
 BEDROCK_TITAN_PAYLOAD_LIMIT = (int)(os.getenv('BEDROCK_TITAN_PAYLOAD_LIMIT', '20000'))
 
-bedrock = autorefresh_session.client('bedrock')
-bedrockruntime = autorefresh_session.client('bedrock-runtime')
-sagemaker = autorefresh_session.client('runtime.sagemaker')
+bedrock = aws_session_helper.get_client('bedrock')
+bedrockruntime = aws_session_helper.get_client('bedrock-runtime')
+sagemaker = aws_session_helper.get_client('runtime.sagemaker')
+sagemaker_control = aws_session_helper.get_client('sagemaker')
 bedrock_models = None
 
-jumpstart_endpoint = None
-jumpstart_detection_passed = None
-
-bedrock_text_provider_map = {}
-bedrock_img_provider_map = {}
-bedrock_embedding_provider_map = {}
+jumpstart_endpoint = os.environ.get('JUMPSTART_MODEL_ENDPOINT')
 
-genai_models = []
-genai_model_entries= {}
-genai_model_functions = {}
+# Built lazily from the model catalog snapshot, see get_model_catalog()
+model_catalog_state = None
+model_catalog_state_lock = threading.Lock()
+CATALOG_ATTRIBUTES = [ 'has_bedrock', 'has_jumpstart', 'env_model_preference',
+                        'bedrock_text_provider_map', 'bedrock_img_provider_map', 'bedrock_embedding_provider_map',
+                        'genai_models', 'genai_model_entries', 'genai_model_functions',
+                        'default_genai_model', 'default_genai_model_index' ]
 
 MAX_RECENT_RUNS = 5
 recent_cost_stats = collections.deque(MAX_RECENT_RUNS*[ {}], MAX_RECENT_RUNS)
+# Serializes the running total of a session when several models of it save their cost concurrently
+session_cost_lock = threading.Lock()
 
 
 LLM_PRICING = './utils/llm_pricing.csv'
+MODEL_SUMMARY_FIELDS = [ 'modelId', 'modelName', 'providerName', 'outputModalities', 'inferenceTypesSupported' ]
 AUTO_GENERATED_PROMPT = 'Generate three prompts'
 
 def add_cost_entry(total_cost, model_id, input_tokens, output_tokens, user_generated_prompt ):
@@ -98,13 +111,41 @@ def report_cost():
         #recent_cost_entries = recent_cost_entries + '  \n\n' if recent_cost_entries != '' else ''
         recent_cost_entries += f"  \n\n Invoke cost: ${entry['cost']}, model: {entry['model_id']}, input tokens: {entry['input']}," + f" output tokens: {entry['output']}, user-generated-prompt: {entry['user_generated']}"
         
+    # Hedged calls show up above as one entry for each model that was invoked
+    hedging_stats = hedged_requests.get_hedging_stats()
+    if hedging_stats.get('hedged'):
+        recent_cost_entries += f"  \n\n Hedged requests (all sessions): {hedging_stats['hedged']}, won by fallback: {hedging_stats.get('fallback_wins', 0)}"
+    
+    # Internal prompts answered by a cheaper model than the selected one, see utils/model_router.py
+    routed_calls = st.session_state.get('routed_calls', 0)
+    if routed_calls:
+        recent_cost_entries += f"  \n\n Saved by routing {routed_calls} internal prompts to cheaper models: ${st.session_state.get('routing_savings', 0.0):.6f}"
+        
     return f'Estimated cost of recent runs: ${total_cost}  \n\n Breakdown:  \n\n {recent_cost_entries}'    
+
+def report_performance():
+    
+    # Recent model and AWS calls of this session, for the optional performance panel of the pages
+    if not telemetry.TELEMETRY_SIDEBAR_ENABLED:
+        return ''
+    
+    performance_entries = ''
+    for span in reversed(telemetry.get_session_spans()):
+        first_byte = f"{span['ttfb']*1000:.0f} ms" if span['ttfb'] is not None else '-'
+        performance_entries += f"  \n\n {span['name']}: {span['duration']*1000:.0f} ms, first byte: {first_byte}, bytes sent/received: {span['request_bytes']}/{span['response_bytes']}"
+        if span['kind'] == telemetry.MODEL_SPAN:
+            performance_entries += f", tokens: {span['input_tokens']}/{span['output_tokens']}, retries: {span['retries']}, cache: {span['cache']}"
+        if span['status'] != 'ok':
+            performance_entries += f", error: {span['error']}"
+    
+    return performance_entries
     
 def load_llm_pricing():
     global region
     llm_price_dict = {}
     with open(LLM_PRICING, 'r') as llm_pricing:
-        reader = csv.DictReader(llm_pricing)
+        # Values in the pricing file may have a leading space after the comma
+        reader = csv.DictReader(llm_pricing, skipinitialspace=True)
         for row in reader:
             if row['region'] == 'all':
                 llm_price_dict[row['model_id']] = row
@@ -124,51 +165,103 @@ def find_matching_entry(model_id):
     
     return None
 
-def save_cost_entry_for_model( model_id, input_body, output_body):
+def is_user_generated_prompt(prompt_text):
+    return AUTO_GENERATED_PROMPT not in prompt_text
+
+def save_cost_entry_for_model( model_id, input_body, output_body, response=None):
     
-    input_tokens =int(len(input_body)/4) + 1 
-    output_tokens =int(len(output_body)/4) + 1 
+    # Prefer the token counts reported by Bedrock, otherwise count them with the tokenizer of the model
+    token_counts = get_response_token_counts(response) if response is not None else None
+    if token_counts is not None:
+        input_tokens, output_tokens = token_counts
+    else:
+        input_tokens = token_counter.count_tokens(input_body, model_id)
+        output_tokens = token_counter.count_tokens(output_body, model_id)
 
     user_generated_prompt = True if (AUTO_GENERATED_PROMPT not in input_body) else False
     save_cost_entry_for_model_tokens( model_id, input_tokens, output_tokens, user_generated_prompt)
 
 
-def save_cost_entry_for_model_tokens( model_id, input_tokens, output_tokens, user_generated_prompt):
+@contextlib.contextmanager
+def collect_costs():
+    """
+    Collects the cost entries saved by model calls of the current thread, as dicts with the model_id,
+    input and output tokens and cost. Calls run for it on worker threads (coalesced streams, hedged
+    requests) carry the collector. Calls answered from a cache or by another session's in-flight
+    invocation save no entry.
+    """
+    previous_entries = telemetry.get_cost_entries()
+    entries = []
+    try:
+        with telemetry.use_cost_entries(entries):
+            yield entries
+    finally:
+        # An enclosing collector also gets the entries of the nested one
+        if previous_entries is not None:
+            previous_entries.extend(entries)
 
+def save_routing_savings(savings):
+    with session_cost_lock:
+        st.session_state['routing_savings'] = st.session_state.get('routing_savings', 0.0) + savings
+        st.session_state['routed_calls'] = st.session_state.get('routed_calls', 0) + 1
+
+def get_model_cost(model_id, input_tokens, output_tokens):
+    
+    # Cost in dollars from the pricing file, None for models without a price
     llm_price_entry = LLM_COST_DATA.get(model_id)
     if llm_price_entry is None:
         llm_price_entry = find_matching_entry(model_id)
     
     if llm_price_entry is None:
-        return
+        return None
     
     input_token_cost = llm_price_entry['input_token_price']
-    output_token_cost = llm_price_entry['output_token_price']
+    output_token_cost = llm_price_entry['output_token_price'] or 0
+    return input_tokens*float(input_token_cost)/1000 + output_tokens*float(output_token_cost)/1000
+
+def save_cost_entry_for_model_tokens( model_id, input_tokens, output_tokens, user_generated_prompt):
+
+    # A response replayed from the response cache cost nothing
+    if response_cache.take_replayed():
+        return
     
-    total_cost = input_tokens*float(input_token_cost)/1000 + output_tokens*float(output_token_cost)/1000
+    llm_price_entry = LLM_COST_DATA.get(model_id)
+    if llm_price_entry is None:
+        llm_price_entry = find_matching_entry(model_id)
+    
+    if llm_price_entry is None:
+        return
+    
+    total_cost = get_model_cost(model_id, input_tokens, output_tokens)
     cost_entry = f'Invoke cost: ${total_cost:.8f}, model: {llm_price_entry["model_id"]}, input tokens: {input_tokens}, output tokens: {output_tokens}'
     current_cost = f'{cost_entry}, user-generated-prompt: {user_generated_prompt}'
     
-    logger.info(f'Invocation Cost : {cost_entry}')
+    structured_logging.log_event(logging.INFO, 'Invocation Cost', llm_price_entry['model_id'], cost='${:.8f}'.format(total_cost),
+                                 input_tokens=input_tokens, output_tokens=output_tokens)
+    telemetry.record_tokens(input_tokens, output_tokens)
      
     add_cost_entry(total_cost, model_id, input_tokens, output_tokens, user_generated_prompt )
+    collected_entries = telemetry.get_cost_entries()
+    if collected_entries is not None:
+        collected_entries.append({ 'model_id': model_id, 'input_tokens': input_tokens, 'output_tokens': output_tokens, 'cost': total_cost })
     
     # Check session state for previously saved invocation costs
     # Add current costs to prev states.
     #prev_costs = st.session_state.get('invoke_cost_summary')
     #st.session_state['invoke_cost_summary'] =  current_cost if prev_costs is None else current_cost  + '\n\n' + prev_costs
-    prev_total_costs = st.session_state.get('total_running_cost')
-    new_total_cost = total_cost 
-    if prev_total_costs is not None: 
-        new_total_cost += float(prev_total_costs)
-    new_total_cost_str = f'{new_total_cost:.8f}'
-    st.session_state['total_running_cost'] = new_total_cost_str
+    with session_cost_lock:
+        prev_total_costs = st.session_state.get('total_running_cost')
+        new_total_cost = total_cost 
+        if prev_total_costs is not None: 
+            new_total_cost += float(prev_total_costs)
+        new_total_cost_str = f'{new_total_cost:.8f}'
+        st.session_state['total_running_cost'] = new_total_cost_str
 
 
-def create_model_function_mapping():
-    global genai_models, genai_model_entries
+def create_model_function_mapping(bedrock_text_provider_map):
+    genai_models = []
+    genai_model_entries = {}
     
-    has_bedrock_access()
     for provider in bedrock_text_provider_map.keys():
         
         # Ignore Cohere for this v1 release
@@ -211,10 +304,8 @@ def create_model_function_mapping():
                 if addEntry:
                     genai_models.append(modelName) 
                     genai_model_entries[modelName] = modelId
-        
-    
 
-    
+    return genai_models, genai_model_entries
 
 def find_matching_model_id_by_type(model_type_prefix, model_type_list, model_id_list):
     index = 0
@@ -232,99 +323,98 @@ def find_matching_model_id_by_type(model_type_prefix, model_type_list, model_id_
 
     
     
-def has_jumpstart_deployed():
-    global jumpstart_endpoint
-    global jumpstart_detection_passed
-    
-    if jumpstart_detection_passed is not None:
-        return jumpstart_detection_passed
+def has_jumpstart_deployed(previous_has_jumpstart=False):
     
     logger.debug('Checking if jumpstart endpoint was defined and deployed??')
-    jumpstart_endpoint = os.environ.get('JUMPSTART_MODEL_ENDPOINT')
     logger.info('Jumpstart endpoint from env: {}'.format(jumpstart_endpoint))
     if jumpstart_endpoint == None or jumpstart_endpoint == 'None' or jumpstart_endpoint == '':
-        jumpstart_detection_passed = False
         err = 'Jumpstart Endpoint not defined, detection failed!'
         logger.warning(err)
-        return jumpstart_detection_passed
+        return False
         
     try:
-        #print(client)
-        
-        payload = {
-            "inputs": 'Test data'
-            }
-        
-        response = client.invoke_endpoint(EndpointName=jumpstart_endpoint, 
-                                            ContentType='application/json', 
-                                            Body=json.dumps(payload).encode('utf-8'),
-                                            CustomAttributes='accept_eula=true')
-        #print(response)
-        jumpstart_detection_passed = True
-        return jumpstart_detection_passed
+        # Check the endpoint status on the control plane instead of sending a test inference
+        response = sagemaker_control.describe_endpoint(EndpointName=jumpstart_endpoint)
+        endpoint_status = response['EndpointStatus']
+        logger.info('Jumpstart endpoint status: {}'.format(endpoint_status))
+        return endpoint_status in [ 'InService', 'Updating' ]
 
     except botocore.exceptions.ClientError as e1:
         errorMsg = str(e1)
-        #logger.exception(e1)
         logger.error('Got error in accessing Jumpstart endpoint: {}'.format(errorMsg))
-        jumpstart_detection_passed = True if ('/aws/sagemaker/Endpoints' in errorMsg) else False
-        if jumpstart_detection_passed:
-            logger.info('Ignoring prev error as it indicates the endpoint is setup')
-        logger.info('Jumpstart Detection Passed?: {}'.format(jumpstart_detection_passed))
-        return jumpstart_detection_passed
-    
-def has_bedrock_access():
-    global bedrock_models
-    global bedrock_text_provider_map, bedrock_img_provider_map, bedrock_embedding_provider_map
+        if 'AccessDenied' in errorMsg:
+            # Role can invoke but not describe the endpoint, trust the configured endpoint
+            logger.info('Ignoring prev error as the endpoint is configured')
+            return True
+        if 'ValidationException' in errorMsg:
+            return False
+        return previous_has_jumpstart
+    
+def list_bedrock_model_summaries():
     logger.info('Checking Bedrock access')
+    
+    response = bedrock.list_foundation_models()
+    #logger.info('List foundation models: {}'.format(response))
+    
+    # Only keep the fields used for the model selection so the summaries can be saved as json
+    return [ { field: summary.get(field) for field in MODEL_SUMMARY_FIELDS } for summary in response['modelSummaries'] ]
 
+def build_provider_maps(model_summaries):
+    bedrock_text_provider_map = {}
+    bedrock_img_provider_map = {}
+    bedrock_embedding_provider_map = {}
     
-    try:
-        response = bedrock.list_foundation_models()
-        #logger.info('List foundation models: {}'.format(response))
+    for summary in model_summaries:
+        provider = summary['providerName']
+        modality = summary['outputModalities'][0]
         
-        model_summaries = response['modelSummaries']
+        #print('Provider: ', provider)
+        if modality == 'TEXT':
+            bedrock_provider_map = bedrock_text_provider_map
+        elif modality == 'IMAGE':
+            bedrock_provider_map = bedrock_img_provider_map
+        elif modality == 'EMBEDDING':
+            bedrock_provider_map = bedrock_embedding_provider_map
         
-        for summary in model_summaries:
-            provider = summary['providerName']
-            modality = summary['outputModalities'][0]
-            
-            #print('Provider: ', provider)
-            if modality == 'TEXT':
-                bedrock_provider_map = bedrock_text_provider_map
-            elif modality == 'IMAGE':
-                bedrock_provider_map = bedrock_img_provider_map
-            elif modality == 'EMBEDDING':
-                bedrock_provider_map = bedrock_embedding_provider_map
-            
-            model_list = bedrock_provider_map.get(provider)
-            if model_list == None:
-                model_list = {}
-            
-            # Only add those that support on-demand for our demo app
-            if 'ON_DEMAND' in summary['inferenceTypesSupported']:
-                model_list[summary['modelId']] = summary
-            bedrock_provider_map[provider] = model_list
+        model_list = bedrock_provider_map.get(provider)
+        if model_list == None:
+            model_list = {}
         
-            
+        # Only add those that support on-demand for our demo app
+        if 'ON_DEMAND' in summary['inferenceTypesSupported']:
+            model_list[summary['modelId']] = summary
+        bedrock_provider_map[provider] = model_list
+
+    # logger.info('Bedrock Text models List: {}'.format(bedrock_text_provider_map))
+    # logger.info('Bedrock Img models List: {}'.format(bedrock_img_provider_map))
+    # logger.info('Bedrock Embedding models List: {}'.format(bedrock_embedding_provider_map))
+    return bedrock_text_provider_map, bedrock_img_provider_map, bedrock_embedding_provider_map
+
+def discover_model_catalog(previous_snapshot):
     
-        # logger.info('Bedrock Text models List: {}'.format(bedrock_text_provider_map))
-        # logger.info('Bedrock Img models List: {}'.format(bedrock_img_provider_map))
-        # logger.info('Bedrock Embedding models List: {}'.format(bedrock_embedding_provider_map))
-        # logger.debug('Bedrock models raw response: {}'.format(response))
-        
-        #response_lines = response['body'].readlines()
-        #print(response_lines)
-    except botocore.exceptions.ClientError as e1:
+    # Called by model_catalog on a background thread when the snapshot is stale
+    snapshot = dict(previous_snapshot) if previous_snapshot is not None else { 'has_bedrock': False, 'model_summaries': [] }
+    try:
+        snapshot['model_summaries'] = list_bedrock_model_summaries()
+        snapshot['has_bedrock'] = True
+    except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e1:
         errorMsg = str(e1)
         logger.exception(e1)
-        #if 'AccessDenied' in errorMsg:
-        return False
-        
-    return True
+        # Keep the previous models on transient errors, only drop them when access is denied
+        if 'AccessDenied' in errorMsg:
+            snapshot['has_bedrock'] = False
+            snapshot['model_summaries'] = []
+        elif previous_snapshot is None:
+            return None
+    
+    snapshot['has_jumpstart'] = has_jumpstart_deployed(snapshot.get('has_jumpstart', False))
+    return snapshot
+
+def has_bedrock_access():
+    return get_model_catalog()['has_bedrock']
 
 
-def check_preference():
+def check_preference(has_bedrock, has_jumpstart):
     preference = MODEL_FAMILY[MODEL_FAMILY_BEDROCK]
     
     bedrock_models_env = os.getenv('BEDROCK_MODEL_TYPES')
@@ -356,23 +446,17 @@ def check_preference():
 
     return preference
 
-has_bedrock = has_bedrock_access()
-has_jumpstart = has_jumpstart_deployed()
-env_model_preference = check_preference()
-
 def get_bedrock_models_access():
     global bedrock_models
     
-    if not has_bedrock:
+    if not has_bedrock_access():
         return None
-    
-    if bedrock_models is None:
-        has_bedrock_access()
         
     return bedrock_models
     
 def get_model(model_name):
-    if (has_bedrock):
+    catalog = get_model_catalog()
+    if (catalog['has_bedrock']):
         model_function = find_bedrock_model(model_name)
         if model_function is None:
             err = 'Unable to find matching bedrock model!!'
@@ -381,8 +465,8 @@ def get_model(model_name):
         else:
             return model_function
     
-    if (has_jumpstart):
-        model_function = find_jumpstart_model(model_name)
+    if (catalog['has_jumpstart']):
+        model_function = find_jumpstart_model(model_name, catalog['has_jumpstart'])
         if model_function is None:
             err = 'Unable to find matching jumpstart model!!'
             logger.error(err)
@@ -395,7 +479,7 @@ def get_model(model_name):
     raise Exception(finalErr)
 
 
-def get_jumpstart_model():
+def get_jumpstart_model(has_bedrock, has_jumpstart, env_model_preference):
     
     if not has_jumpstart and has_bedrock and env_model_preference == 'BEDROCK':
         # Go with default Bedrock Claude
@@ -404,9 +488,9 @@ def get_jumpstart_model():
     jumpstart_model_name = os.environ.get('PREFERRED_JUMPSTART_MODEL_TYPE')
     jumpstart_model_id = os.environ.get('PREFERRED_JUMPSTART_MODEL_ID')
     
-    return find_jumpstart_model(jumpstart_model_name)
+    return find_jumpstart_model(jumpstart_model_name, has_jumpstart)
     
-def find_jumpstart_model(model_name):
+def find_jumpstart_model(model_name, has_jumpstart):
     if model_name.lower().startswith('bedrock'):
         raise Exception('Searching for Jumpstart Models against Bedrock!!')
     
@@ -416,6 +500,7 @@ def find_jumpstart_model(model_name):
     call_models = [
             {
                 'func': call_hf_falcon_model,
+                'stream': stream_hf_falcon_model if jumpstart_invoker.JUMPSTART_STREAMING_ENABLED else None,
                 'model_id': 'falcon',
                 'label': 'Huggingface Falcon',
                 'char_limits':10000
@@ -472,10 +557,7 @@ def call_llama_2_7b_f(query, max_new_tokens=512, temperature = 0.6, top_p = 0.9)
     #inputs_str = json.dumps(inputs_json)
     #payload = {"inputs": json.dumps(inputs_json), "parameters": {"max_new_tokens": max_new_tokens, "top_p": top_p, "temperature": temperature}}
     payload = {"inputs": inputs_json, "parameters": {"max_new_tokens": max_new_tokens, "top_p": top_p, "temperature": temperature}}
-    response = client.invoke_endpoint( EndpointName=jumpstart_endpoint, ContentType="application/json", Body=json.dumps(payload).encode('utf-8'), CustomAttributes="accept_eula=true" )
-    
-    responseBody = response['Body'].read()
-    json_obj = json.loads(responseBody)
+    json_obj = jumpstart_invoker.invoke_endpoint(jumpstart_endpoint, payload, custom_attributes="accept_eula=true")
     result_text = json_obj[0]['generation']['content']
 
     # Strip off additional quotes as it breaks the model with subsequent calls
@@ -497,7 +579,6 @@ def call_llama_2_code_response(query, model_id, max_new_tokens, temperature, top
     #qa_prompt = f'Context: {passage}\nQuestion: {prompt}\nAnswer:'
     qa_prompt = f'Question: {query}\nAnswer:'
     inputs_json = [[{"role": "user", "content": qa_prompt}]] 
-    inputs_str = json.dumps(inputs_json)
     #payload = {"inputs": json.dumps(query_template), "parameters": {"max_new_tokens": max_new_tokens, "top_p": top_p, "temperature": temperature}}
     payload = {"inputs": inputs_json, "parameters": {"max_new_tokens": max_new_tokens, "top_p": top_p, "temperature": temperature}}
     
@@ -505,10 +586,7 @@ def call_llama_2_code_response(query, model_id, max_new_tokens, temperature, top
     #logger.debug('Llama Incoming payload: {}', payload)
     
     
-    response = client.invoke_endpoint( EndpointName=jumpstart_endpoint, ContentType="application/json", Body=json.dumps(payload).encode('utf-8'), CustomAttributes="accept_eula=true" )
-    responseBody = response['Body'].read()
-
-    json_obj = json.loads(responseBody)
+    json_obj = jumpstart_invoker.invoke_endpoint(jumpstart_endpoint, payload, custom_attributes="accept_eula=true")
     result_text = json_obj[0]['generated_text']
 
     #logger.debug('Llama payload: {} \n------- and associated response: {}'.format(body_string, result_text))
@@ -522,11 +600,34 @@ def call_hf_falcon_model(query, max_new_tokens=1024, return_full_text=True, do_s
     model_type = 'falcon'
     
     logger.info('Invoking HuggingFace Falcon ... model: {}'.format(model_id))
+    parameters = {
+            "max_new_tokens": max_new_tokens,
+            "return_full_text": return_full_text,
+            "do_sample": do_sample,
+            "temperature": temperature,
+            "repetition_penalty": repetition_penalty,
+            "top_p": top_p,
+            "top_k": top_k,
+            "stop": ["<|endoftext|>", "</s>"]
+        }
+    
+    # Concurrent prompts with the same parameters go to the endpoint as one list of inputs
+    def send_batch(queries):
+        model_predictions = jumpstart_invoker.invoke_endpoint(jumpstart_endpoint, { "inputs": queries, "parameters": parameters })
+        return jumpstart_invoker.parse_generated_texts(model_predictions, len(queries))
+    
+    generated_text = jumpstart_invoker.invoke_batched((jumpstart_endpoint, model_id, model_codec.dumps(parameters)), query, send_batch)
+    resp = str(generated_text[len(query):])
+    return resp
+
+def stream_hf_falcon_model(query, max_new_tokens=1024, do_sample = True, temperature = 0.5, repetition_penalty = 1.03, top_p = 0.9, top_k = 1):
+    model_id = 'hf-llm-falcon-7b-instruct-bf16'
+    
+    # The Falcon container is TGI, which streams only the generated tokens
     payload = {
-    "inputs": query,
+        "inputs": query,
         "parameters": {
             "max_new_tokens": max_new_tokens,
-            "return_full_text": return_full_text,
             "do_sample": do_sample,
             "temperature": temperature,
             "repetition_penalty": repetition_penalty,
@@ -535,11 +636,27 @@ def call_hf_falcon_model(query, max_new_tokens=1024, return_full_text=True, do_s
             "stop": ["<|endoftext|>", "</s>"]
         }
     }
-    #print('Payload for falcon', payload)
-    response = client.invoke_endpoint(EndpointName=jumpstart_endpoint, ContentType='application/json', Body=json.dumps(payload).encode('utf-8'))
-    model_predictions = json.loads(response['Body'].read())
-    resp = str(model_predictions[0]['generated_text'][len(query):])
-    return resp
+    return stream_jumpstart_model(model_id, payload)
+
+def stream_jumpstart_model(model_id, payload, custom_attributes=None):
+    
+    logger.info('Invoking Jumpstart streaming... model: {}'.format(model_id))
+    start_time = time.time()
+    first_token_time = None
+    try:
+        for token in jumpstart_invoker.stream_endpoint(jumpstart_endpoint, payload, custom_attributes):
+            if first_token_time is None:
+                first_token_time = time.time()
+                save_time_to_first_token(model_id, first_token_time - start_time)
+            yield token
+    except Exception as e1:
+        logger.exception(e1)
+        err = 'Error!! ' + str(e1)
+        logger.error(err)
+        yield err
+        return
+    
+    logger.info('Completed Jumpstart streaming... model: {}, total time: {:.3f}s'.format(model_id, time.time() - start_time))
 
 
 def call_flan_t5_model(query, max_length=512, top_k = 1):
@@ -552,16 +669,18 @@ def call_flan_t5_model(query, max_length=512, top_k = 1):
     if jumpstart_endpoint == None:
         raise Exception('Jumpstart Endpoint not defined!!')
         
-    payload = {
-    "text_inputs": query,
-        "parameters": {
+    parameters = {
             "max_length": max_length,
             "top_k": top_k
         }
-    }
-    response = client.invoke_endpoint(EndpointName=jumpstart_endpoint, ContentType='application/json', Body=json.dumps(payload).encode('utf-8'))
-    model_predictions = json.loads(response['Body'].read())
-    resp = str(model_predictions[0]['generated_text'][len(query):])
+    
+    # Concurrent prompts with the same parameters go to the endpoint as one list of text inputs
+    def send_batch(queries):
+        model_predictions = jumpstart_invoker.invoke_endpoint(jumpstart_endpoint, { "text_inputs": queries, "parameters": parameters })
+        return jumpstart_invoker.parse_generated_texts(model_predictions, len(queries))
+    
+    generated_text = jumpstart_invoker.invoke_batched((jumpstart_endpoint, model_id, model_codec.dumps(parameters)), query, send_batch)
+    resp = str(generated_text[len(query):])
     return resp
 
 def call_jumpstart_ai21_j2_ultra_model(prompt_text, max_tokens = 500, temperature = 1, top_p = 1, top_k = 250, stop_sequences = [],  countPenalty = 0, presencePenalty = 0, frequencyPenalty = 0):
@@ -624,8 +743,8 @@ def call_sdxl_model(prompt_text, style_preset='digital-art',height=512, width=51
                     "steps": steps
                 }
     
-    response = client.invoke_endpoint(EndpointName=jumpstart_endpoint, ContentType='application/json', Body=json.dumps(payload).encode('utf-8'))
-    model_predictions = json.loads(response['Body'].read())
+    response = client.invoke_endpoint(EndpointName=jumpstart_endpoint, ContentType='application/json', Body=model_codec.dumps(payload))
+    model_predictions = model_codec.read_json(response['Body'])
     resp = str(model_predictions[0]['generated_text'][len(query):])
     return resp
         
@@ -635,12 +754,14 @@ def find_bedrock_model(model_id):
     call_models = [
             {
                 'func': call_bedrock_titan_text_lite_model,
+                'stream': stream_bedrock_titan_text_lite_model,
                 'model_id': 'titan-text-lite',
                 'label': 'Bedrock Titan Text Lite',
                 'char_limits':4000
             },
             {
                 'func': call_bedrock_titan_text_express_model,
+                'stream': stream_bedrock_titan_text_express_model,
                 'model_id': 'titan-text-express',
                 'label': 'Bedrock Titan Text Express',
                 'char_limits':4000
@@ -653,42 +774,49 @@ def find_bedrock_model(model_id):
             },
             {
                 'func': call_bedrock_claude_model_v3,
+                'stream': stream_bedrock_claude_model_v3,
                 'model_id': 'bedrock claude-v3-sonnet',
                 'label': 'Anthropic Claude v3 Sonnet',
                 'char_limits':20000
             },
             {
                 'func': call_bedrock_claude_model_v2_1,
+                'stream': stream_bedrock_claude_model_v2_1,
                 'model_id': 'claude-v2:1',
                 'label': 'Anthropic Claude v2.1',
                 'char_limits':15000
             },
             {
                 'func': call_bedrock_claude_model_instant_v1,
+                'stream': stream_bedrock_claude_model_instant_v1,
                 'model_id': 'claude-instant-v1',
                 'label': 'Anthropic Claude Instant v1',
                 'char_limits':10000
             },
             {
                 'func': call_bedrock_claude_model_v1,
+                'stream': stream_bedrock_claude_model_v1,
                 'model_id': 'claude-v1',
                 'label': 'Anthropic Claude v1',
                 'char_limits':10000
             },
             {
                 'func': call_bedrock_claude_v1_100k,
+                'stream': stream_bedrock_claude_v1_100k,
                 'model_id': 'claude-v1-100k',
                 'label': 'Anthropic Claude v1 100K',
                 'char_limits':50000
             },
             {
                 'func': call_bedrock_claude_v2_100k,
+                'stream': stream_bedrock_claude_v2_100k,
                 'model_id': 'claude-v2-100k',
                 'label': 'Anthropic Claude v2 100K',
                 'char_limits':50000
             },
             {
                 'func': call_bedrock_claude_model_v2,
+                'stream': stream_bedrock_claude_model_v2,
                 'model_id': 'claude-v2',
                 'label': 'Anthropic Claude v2',
                 'char_limits': 15000
@@ -712,30 +840,35 @@ def find_bedrock_model(model_id):
             },
             {
                 'func': call_bedrock_llama_2_13b,
+                'stream': stream_bedrock_llama_2_13b,
                 'model_id': 'llama2-13b-chat',
                 'label': 'Meta Llama2-13b-chat',
                 'char_limits':5000
             },
             {
                 'func': call_bedrock_llama_2_70b,
+                'stream': stream_bedrock_llama_2_70b,
                 'model_id': 'llama2-70b-chat',
                 'label': 'Meta Llama2-70b-chat',
                 'char_limits':5000
             },
             {
                 'func': call_bedrock_mistral_7b,
+                'stream': stream_bedrock_mistral_7b,
                 'model_id': 'mistral-7b-instruct',
                 'label': 'Mistral 7B Instruct',
                 'char_limits':400
             },
             {
                 'func': call_bedrock_mistral_8x7b,
+                'stream': stream_bedrock_mistral_8x7b,
                 'model_id': 'mistral-8x7b-instruct',
                 'label': 'Mistral 8x7B Instruct',
                 'char_limits':400
             },
             {
                 'func': call_bedrock_cohere_text_v14,
+                'stream': stream_bedrock_cohere_text_v14,
                 'model_id': 'cohere text v14',
                 'label': 'Cohere Command Text v14',
                 'char_limits':8000
@@ -754,18 +887,62 @@ def find_bedrock_model(model_id):
     # Default return Bedrock Claude
     return {
                 'func': call_bedrock_claude_model_v2,
+                'stream': stream_bedrock_claude_model_v2,
                 'model_id': 'claude-v2',
                 'label': 'Anthropic Claude v2',
                 'char_limits': 15000
             }
 
+def estimate_request_tokens(body):
+    return int(len(body)/4) + 1
+
+def get_response_token_counts(response):
+    headers = response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+    input_tokens = headers.get('x-amzn-bedrock-input-token-count')
+    output_tokens = headers.get('x-amzn-bedrock-output-token-count')
+    if input_tokens is None or output_tokens is None:
+        return None
+    return int(input_tokens), int(output_tokens)
+
+def send_bedrock_request(**kwargs):
+    
+    # Queues for the model quota and retries throttling or 5xx errors, see utils/rate_limiter
+    model_id = kwargs['modelId']
+    estimated_tokens = estimate_request_tokens(kwargs['body'])
+    response = rate_limiter.call_with_retry(model_id, lambda: bedrockruntime.invoke_model(**kwargs), estimated_tokens)
+    
+    token_counts = get_response_token_counts(response)
+    if token_counts is not None:
+        rate_limiter.get_rate_limiter(model_id).record_usage(estimated_tokens, sum(token_counts))
+    return response
+
+def invoke_bedrock_model(**kwargs):
+    
+    # Calls that opted in with use_cache are answered from the response cache, keyed by the request body
+    response_cache.set_replayed(False)
+    if response_cache.is_caching_requests():
+        return response_cache.cached_invoke(kwargs['modelId'], kwargs['body'], lambda: send_bedrock_request(**kwargs))
+    return send_bedrock_request(**kwargs)
+
+def send_bedrock_stream_request(**kwargs):
+    
+    # Only the request is retried, the token usage is settled by the caller from the invocation metrics
+    model_id = kwargs['modelId']
+    return rate_limiter.call_with_retry(model_id, lambda: bedrockruntime.invoke_model_with_response_stream(**kwargs), estimate_request_tokens(kwargs['body']))
+
+def invoke_bedrock_model_with_response_stream(**kwargs):
+    
+    response_cache.set_replayed(False)
+    if response_cache.is_caching_requests():
+        return response_cache.cached_invoke_stream(kwargs['modelId'], kwargs['body'], lambda: send_bedrock_stream_request(**kwargs))
+    return send_bedrock_stream_request(**kwargs)
+
 def call_bedrock_titan_text_lite_model(prompt_text, max_tokens = 4096, temperature = 0.5, top_p = 0.9, top_k = 250, stop_sequences = []):
     #model_id = 'amazon.titan-tg1-large'
     model_type = 'amazon.titan'
     model_id = 'amazon.titan-text-lite-v1'
 
-    # Strip off newlines as it breaks the model
-    prompt_text = prompt_text.replace('\n', ' ')[:BEDROCK_TITAN_PAYLOAD_LIMIT]
+    prompt_text = prompt_text[:BEDROCK_TITAN_PAYLOAD_LIMIT]
     
     logger.info('Invoking Bedrock Titan... with model: {}'.format(model_id))
     
@@ -774,37 +951,25 @@ def call_bedrock_titan_text_lite_model(prompt_text, max_tokens = 4096, temperatu
     #    return 'Error!! Incoming payload length over ' + str(BEDROCK_TITAN_PAYLOAD_LIMIT) \
     #        + ', please use smaller sample input!!'
         
-    body_string = "{\"inputText\":\"" + f"{prompt_text}" +\
-                    "\",\"textGenerationConfig\":{" +\
-                    "\"maxTokenCount\":" + f"{max_tokens}" +\
-                    ",\"topP\":" + f"{top_p}" +\
-                    ",\"stopSequences\":" + f"{stop_sequences}" +\
-                    ",\"temperature\":" + f"{temperature}" +\
-                    "}}"
-    logger.info('Invoking Bedrock Titan Text Lite... with model: {} and body: {}'.format(model_id, body_string))
-    body = bytes(body_string, 'utf-8')
+    body = model_codec.dumps(model_codec.titan_text_request(prompt_text, max_tokens, temperature, top_p, stop_sequences))
+    structured_logging.log_request(model_id, body, 'Invoking Bedrock Titan Text Lite')
     response = None
     try:
-        response = bedrockruntime.invoke_model(
+        response = invoke_bedrock_model(
             modelId = model_id,
             contentType = "application/json",
             accept = "application/json",
             body = body)
             
         
-        responseBody = response['body'].read()
-        json_str = responseBody.decode('utf-8')
-        
-        json_obj = json.loads(json_str)
+        json_obj = model_codec.read_json(response['body'])
         result_text = json_obj['results'][0]['outputText']
-        #logger.debug('Titan payload: ', body_string, ' \n------- and associated response: ', result_text)
-        logger.debug('Invoking Titan TextLite ... model: {}, response: {}'.format(model_id, responseBody))
+        structured_logging.log_response(model_id, json_obj, 'Invoking Titan TextLite')
         
         # Generate the cost and save in session
-        save_cost_entry_for_model(model_id, prompt_text, responseBody)
+        save_cost_entry_for_model(model_id, prompt_text, result_text, response)
         
-        # Strip off additional quotes as it breaks the model with subsequent calls
-        return result_text.strip('\"')
+        return result_text
             
     except Exception as e1:
         logger.exception(e1)
@@ -827,8 +992,7 @@ def call_bedrock_titan_text_express_model(prompt_text, max_tokens = 4096, temper
     model_type = 'amazon.titan'
     model_id = 'amazon.titan-text-express-v1'
 
-    # Strip off newlines as it breaks the model
-    prompt_text = prompt_text.replace('\n', ' ')[:BEDROCK_TITAN_PAYLOAD_LIMIT]
+    prompt_text = prompt_text[:BEDROCK_TITAN_PAYLOAD_LIMIT]
     
     
     # Check if content over Bedrock Titan limit
@@ -836,39 +1000,26 @@ def call_bedrock_titan_text_express_model(prompt_text, max_tokens = 4096, temper
     #    return 'Error!! Incoming payload length over ' + str(BEDROCK_TITAN_PAYLOAD_LIMIT) \
     #        + ', please use smaller sample input!!'
         
-    body_string = "{\"inputText\":\"" + f"{prompt_text}" +\
-                    "\",\"textGenerationConfig\":{" +\
-                    "\"maxTokenCount\":" + f"{max_tokens}" +\
-                    ",\"topP\":" + f"{top_p}" +\
-                    ",\"stopSequences\":" + f"{stop_sequences}" +\
-                    ",\"temperature\":" + f"{temperature}" +\
-                    "}}"
-    logger.info('Invoking Bedrock Titan Text Exp... with model: {} and body: {}'.format(model_id, body_string))
-    
-    body = bytes(body_string, 'utf-8')
+    body = model_codec.dumps(model_codec.titan_text_request(prompt_text, max_tokens, temperature, top_p, stop_sequences))
+    structured_logging.log_request(model_id, body, 'Invoking Bedrock Titan Text Exp')
+    
     response = None
     try:
-        response = bedrockruntime.invoke_model(
+        response = invoke_bedrock_model(
             modelId = model_id,
             contentType = "application/json",
             accept = "application/json",
             body = body)
             
         
-        responseBody = response['body'].read()
-        json_str = responseBody.decode('utf-8')
-        logger.debug('Invoking Titan TextExpress ... model: {}, response: {}'.format(model_id, responseBody))
-        
-        json_obj = json.loads(json_str)
+        json_obj = model_codec.read_json(response['body'])
+        structured_logging.log_response(model_id, json_obj, 'Invoking Titan TextExpress')
         result_text = json_obj['results'][0]['outputText']
-        #logger.debug('Titan payload: ', body_string, ' \n------- and associated response: ', result_text)
-    
         
         # Generate the cost and save in session
-        save_cost_entry_for_model(model_id, prompt_text, responseBody)
+        save_cost_entry_for_model(model_id, prompt_text, result_text, response)
         
-        # Strip off additional quotes as it breaks the model with subsequent calls
-        return result_text.strip('\"')
+        return result_text
             
     except Exception as e1:
         logger.exception(e1)
@@ -893,32 +1044,26 @@ def call_bedrock_titan_embedding_text_model(prompt_text, max_tokens = 2048, temp
     model_id = 'amazon.titan-embed-text-v1'
     model_type = 'amazon.titan'
     
-    # Strip off newlines as it breaks the model
-    prompt_text = prompt_text.replace('\n', ' ')[:BEDROCK_TITAN_PAYLOAD_LIMIT]
+    prompt_text = prompt_text[:BEDROCK_TITAN_PAYLOAD_LIMIT]
     
     # Check if content over Bedrock Titan limit
     #if (len(prompt_text)) > BEDROCK_TITAN_PAYLOAD_LIMIT:
     #    return 'Error!! Incoming payload length over ' + str(BEDROCK_TITAN_PAYLOAD_LIMIT) \
     #        + ', please use smaller sample input!!'
         
-    body_string = "{\"inputText\":\"" + f"{prompt_text}" +\
-                    "\"}"
-    logger.info('Invoking Bedrock Titan... with model: {} and body: {}'.format(model_id, body_string))
-    body = bytes(body_string, 'utf-8')
+    body = model_codec.dumps(model_codec.titan_embedding_request(prompt_text))
+    structured_logging.log_request(model_id, body, 'Invoking Bedrock Titan Embedding')
     response = None
     try:
-        response = bedrockruntime.invoke_model(
+        response = invoke_bedrock_model(
             modelId = model_id,
             contentType = "application/json",
             accept = "application/json",
             body = body)
             
         
-        responseBody = response['body'].read()
-        json_str = responseBody.decode('utf-8')
-        logger.debug('Invoking Titan Embedding  ... model: {}, response: {}'.format(model_id, responseBody))
-        json_obj = json.loads(json_str)
-        logger.info('Response body as json: {}'.format(json_str))
+        json_obj = model_codec.read_json(response['body'])
+        structured_logging.log_response(model_id, json_obj, 'Invoking Titan Embedding')
         embeddings = json_obj['embedding']
         
         return embeddings
@@ -935,9 +1080,25 @@ def call_bedrock_titan_embedding_text_model(prompt_text, max_tokens = 2048, temp
             return err
         return e1
 
+TITAN_EMBEDDING_MODEL_ID = 'amazon.titan-embed-text-v1'
+
+def embed_texts(texts):
+    """
+    Titan embeddings of the texts as one float32 matrix of unit length rows, in the order of the texts.
+    Vectors are kept in the shared embedding store, so each distinct text is embedded once across runs.
+    """
+    return embedding_store.get_store(TITAN_EMBEDDING_MODEL_ID).embed_texts(texts, call_bedrock_titan_embedding_text_model)
+
+def embed_text(text):
+    return embed_texts([ text ])[0]
+
+def search_embeddings(query_text, k=5, keys=None):
+    # Top k stored texts by cosine similarity to the query, keys are embedding_store.content_key of the texts
+    return embedding_store.get_store(TITAN_EMBEDDING_MODEL_ID).search(embed_text(query_text), k, keys)
+
 def call_bedrock_claude_model_v3(prompt_text, max_tokens = 8192, temperature = 0.5, top_p = 1, top_k = 250):
     model_id = 'anthropic.claude-3-sonnet-20240229-v1:0'
-    return call_bedrock_claude_3(prompt_text, model_id, max_tokens, temperature, top_p, top_k)
+    return call_bedrock_claude_model_3(prompt_text, model_id, max_tokens, temperature, top_p, top_k)
 
 def call_bedrock_claude_model_instant_v1(prompt_text, max_tokens = 2048, temperature = 0.5, top_p = 1, top_k = 250, stop_sequences = []):
     model_id = 'anthropic.claude-instant-v1'
@@ -964,32 +1125,26 @@ def call_bedrock_claude_v2_100k(prompt_text, max_tokens = 2048, temperature = 0.
     return call_bedrock_claude_model(prompt_text, model_id, max_tokens, temperature, top_p, top_k, stop_sequences)
     
 def call_bedrock_claude_model(prompt_text, model_id, max_tokens = 2048, temperature = 0.5, top_p = 1, top_k = 250, stop_sequences = []):
-    body = {
-        "prompt": anthropic.HUMAN_PROMPT+prompt_text+anthropic.AI_PROMPT,
-        "max_tokens_to_sample": max_tokens
-    }
-    
-    body_string = json.dumps(body)
-    body_bytes = bytes(body_string, 'utf-8')
+    body = model_codec.claude_request(prompt_text, max_tokens)
+    body_bytes = model_codec.dumps(body)
     
     
-    logger.info('Invoking Bedrock Claude... model: {} with body: {}'.format(model_id, body_string))
+    structured_logging.log_request(model_id, body_bytes, 'Invoking Bedrock Claude')
     response = None
     try:
-        response = bedrockruntime.invoke_model(
+        response = invoke_bedrock_model(
             modelId = model_id,
             contentType = "application/json",
             accept = "application/json",
             body = body_bytes)
         
-        responseBody = response['body'].read()
-        logger.debug('Invoking Claude  ... model: {}, response: {}'.format(model_id, response))
-        json_obj = json.loads(responseBody)
+        json_obj = model_codec.read_json(response['body'])
+        structured_logging.log_response(model_id, json_obj, 'Invoking Claude')
         result_text = json_obj['completion']
 
         
         # Generate the cost and save in session
-        save_cost_entry_for_model(model_id, body['prompt'], responseBody)
+        save_cost_entry_for_model(model_id, body['prompt'], result_text, response)
 
         return result_text
     except Exception as e1:
@@ -1008,39 +1163,24 @@ def call_bedrock_claude_model(prompt_text, model_id, max_tokens = 2048, temperat
 def call_bedrock_claude_model_3(prompt_text, model_id, max_tokens = 8192, temperature = 0.5, top_p = 1, top_k = 250):
     """ invokes the new claude 3 model via the messages api """
     
-    payload=json.dumps(
-                {
-                    "anthropic_version": "bedrock-2023-05-31",
-                    "max_tokens": 8096,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": [{"type": "text", "text": prompt_text}],
-                        }
-                    ],
-                }
-            )
+    payload = model_codec.dumps(model_codec.claude_messages_request(prompt_text, 8096))
     try:
         
-        logger.info('Invoking Bedrock Claude v3... model: {} with body: {}'.format(model_id, payload))
+        structured_logging.log_request(model_id, payload, 'Invoking Bedrock Claude v3')
         
-        response = bedrockruntime.invoke_model(
+        response = invoke_bedrock_model(
             modelId=model_id,
             body=payload
         )
 
             
-        result = json.loads(response.get("body").read())
+        result = model_codec.read_json(response.get("body"))
         input_tokens = result["usage"]["input_tokens"]
         output_tokens = result["usage"]["output_tokens"]
         output_list = result.get("content", [])
 
-        logger.debug('Invoking Claude v3  ... model: {}, response: {}'.format(model_id, result))
-        logger.debug("Invocation details:")
-        logger.debug(f"- The input length is {input_tokens} tokens.")
-        logger.debug(f"- The output length is {output_tokens} tokens.")
-
-        logger.debug(f"- The model returned {len(output_list)} response(s):{output_list[0]['text']}" )
+        structured_logging.log_event(logging.DEBUG, 'Invoking Claude v3', model_id, payloads={ 'response': result },
+                                     input_tokens=input_tokens, output_tokens=output_tokens, responses=len(output_list))
         
         # Generate the cost and save in session
         user_generated_prompt = True if ( AUTO_GENERATED_PROMPT not in prompt_text) else False
@@ -1049,40 +1189,43 @@ def call_bedrock_claude_model_3(prompt_text, model_id, max_tokens = 8192, temper
         return output_list[0]["text"]
     except Exception as e1:
         logger.error('Error!! Failure in backend model processing!!' + str(e1))
+        if 'Throttling' in str(e1):
+            err = 'Error!! Request Throttled!! Please retry later'
+            logger.error(err)
+            return err
         return str(e1)
         
 
 
 def call_bedrock_cohere_text_v14(prompt_text, max_tokens = 1024, temperature = 0.5, top_p = 1, top_k = 250, stop_sequences = []):
     model_id='cohere.command-text-v14'
-    body = json.dumps({
-        "prompt": prompt_text,
-        "max_tokens": max_tokens,
-        "temperature": temperature,
-        "p": top_p
-    })
-    
-    logger.info('Invoking Bedrock Cohere text... model: {} with body: {}'.format(model_id, body))
+    body = model_codec.dumps(model_codec.cohere_request(prompt_text, max_tokens, temperature, top_p))
+    
+    structured_logging.log_request(model_id, body, 'Invoking Bedrock Cohere text')
     response = None
     try:
-        response = bedrockruntime.invoke_model(
+        response = invoke_bedrock_model(
             modelId = model_id,
             contentType = "application/json",
             accept = "application/json",
             body = body)
         
-        response_body = json.loads(response.get('body').read())
-        logger.debug('Invoking Cohere text  ... model: {}, response: {}'.format(model_id, response_body))
+        response_body = model_codec.read_json(response.get('body'))
+        structured_logging.log_response(model_id, response_body, 'Invoking Cohere text')
         
         result_text = response_body.get('generations')[0].get('text')
         #print(result_text)
         
         # Generate the cost and save in session
-        save_cost_entry_for_model(model_id, prompt_text, responseBody)
+        save_cost_entry_for_model(model_id, prompt_text, result_text, response)
         
         return result_text
     except Exception as e1:
         logger.error('Error!! Failure in backend model processing!!' + str(e1))
+        if 'Throttling' in str(e1):
+            err = 'Error!! Request Throttled!! Please retry later'
+            logger.error(err)
+            return err
         return str(e1)
 
 def call_bedrock_j2_ultra_model(prompt_text,max_tokens = 500, temperature = 1, top_p = 1, top_k = 250, stop_sequences = [],  countPenalty = 0, presencePenalty = 0, frequencyPenalty = 0):
@@ -1098,34 +1241,20 @@ def call_bedrock_j2_mid_model(prompt_text,max_tokens = 500, temperature = 1, top
 
 def call_ai21_model(model_id, model_type, prompt_text,max_tokens, temperature, top_p, top_k, stop_sequences, countPenalty, presencePenalty, frequencyPenalty):
     
-    # Strip off newlines and tabs as it breaks the model
-    prompt_text = prompt_text.replace('\n', ' ').replace('\t', ' ')
-    
-    body_string = "{\"prompt\":\"" + f"{prompt_text}" + "\"" +\
-                    ",\"maxTokens\":" + f"{max_tokens}" +\
-                    ",\"temperature\":"  + f"{temperature}" +\
-                    ",\"topP\":" + f"{top_p}" +\
-                    ",\"stopSequences\": " + f"{stop_sequences}" +\
-                    ",\"countPenalty\":{\"scale\": " + f"{countPenalty}" + "}" +\
-                    ",\"presencePenalty\":{\"scale\": " + f"{presencePenalty}" + "}" +\
-                    ",\"frequencyPenalty\":{\"scale\": " + f"{frequencyPenalty}" + "}" +\
-                    "}"
-    body = bytes(body_string, 'utf-8')
-    logger.debug('Invoking Bedrock AI21 Jurassic  ... model: {}, body: {}'.format(model_id, body_string))
+    body = model_codec.dumps(model_codec.ai21_request(prompt_text, max_tokens, temperature, top_p, stop_sequences, countPenalty, presencePenalty, frequencyPenalty))
+    structured_logging.log_event(logging.DEBUG, 'Invoking Bedrock AI21 Jurassic', model_id, payloads={ 'body': body })
     try:
-        response = bedrockruntime.invoke_model(
+        response = invoke_bedrock_model(
             modelId = model_id,
             contentType = "application/json",
             accept = "application/json",
             body = body)
-        response_lines = response['body'].readlines()
-        logger.debug('Invoking AI21  ... model: {}, response: {}'.format(model_id, response))
-        json_str = response_lines[0].decode('utf-8')
-        json_obj = json.loads(json_str)
+        json_obj = model_codec.read_json(response['body'])
+        structured_logging.log_response(model_id, json_obj, 'Invoking AI21')
         result_text = json_obj['completions'][0]['data']['text']
         
         # Generate the cost and save in session
-        save_cost_entry_for_model(model_id, prompt_text, response)
+        save_cost_entry_for_model(model_id, prompt_text, result_text, response)
         
         return result_text
     except Exception as e1:
@@ -1146,29 +1275,18 @@ def call_bedrock_sdxl_model(prompt_text, style_preset='digital-art',height=512,w
     model_id = 'stability.stable-diffusion-xl-v1'
     model_type = 'sd.sdxl'
     
-    payload = { "text_prompts": [ 
-                        { "text": prompt_text} 
-                    ] ,
-                    "cfg_scale": cfg_scale,
-                    "height": height,
-                    "width": width,
-                    "image_strength": image_strength,
-                    "style_preset": style_preset,
-                    "seed": seed,
-                    "steps": steps
-                }
-                
-    body = json.dumps(payload).encode('utf-8')
-    logger.info('Invoking Bedrock stable-diffusion... model: {} and request:{}'.format(model_id, payload))
+    payload = model_codec.sdxl_request(prompt_text, style_preset, height, width, image_strength, cfg_scale, seed, steps)
+    body = model_codec.dumps(payload)
+    structured_logging.log_request(model_id, payload, 'Invoking Bedrock stable-diffusion')
     
     try:
-        response = bedrockruntime.invoke_model(
+        response = invoke_bedrock_model(
             modelId = model_id,
             contentType = "application/json",
             accept = "application/json",
             body = body)
-        response = json.loads(response['body'].read())
-        logger.debug('Invoking Stable diffusion  ... model: {}, response: {}'.format(model_id, response))
+        response = model_codec.read_json(response['body'])
+        structured_logging.log_response(model_id, response, 'Invoking Stable diffusion')
         return response
 
     except Exception as e1:
@@ -1196,24 +1314,23 @@ def call_bedrock_llama_2_70b(query, max_new_tokens=4096, temperature = 0.6, top_
 
 def call_bedrock_llama_2_code_response(query, model_id, max_new_tokens, temperature, top_p):
     
-    payload = {"prompt": query, "max_gen_len": 2000, "top_p": top_p, "temperature": temperature }
-    body = json.dumps(payload).encode('utf-8')
-    #logger.debug('Llama Incoming payload: {}', payload)
-    logger.info('Invoking Bedrock Llama2... model: {} and request:{}'.format(model_id, payload))
+    payload = model_codec.llama2_request(query, 2000, temperature, top_p)
+    body = model_codec.dumps(payload)
+    structured_logging.log_request(model_id, payload, 'Invoking Bedrock Llama2')
     
     try:
         
-        response = bedrockruntime.invoke_model( modelId = model_id, 
+        response = invoke_bedrock_model( modelId = model_id, 
                                                 contentType="application/json", 
                                                 accept = "application/json",
                                                 body=body
                                             )
-        response = json.loads(response['body'].read())
-        logger.debug('Invoking Llama  ... model: {}, response: {}'.format(model_id, response))
-        result_text = response['generation']
+        response_body = model_codec.read_json(response['body'])
+        structured_logging.log_response(model_id, response_body, 'Invoking Llama')
+        result_text = response_body['generation']
 
         # Generate the cost and save in session
-        save_cost_entry_for_model(model_id, query, response)
+        save_cost_entry_for_model(model_id, query, result_text, response)
         
         # Strip off additional quotes as it breaks the model with subsequent calls
         return result_text #.strip('\"')
@@ -1244,24 +1361,24 @@ def call_bedrock_mistral_8x7b(query, max_tokens = 500, temperature = 0.7, top_p
 def call_bedrock_mistral(query, model_id,max_tokens, temperature, top_p, top_k, stop_sequences):
     
 
-    payload = {"prompt": f'<s>[INST]{query}.[/INST]\\', "max_tokens": max_tokens, "top_k": top_k,  "top_p": top_p, "temperature": temperature }
-    body = json.dumps(payload).encode('utf-8')
-    logger.info('Invoking Bedrock Mistral... model: {} and request:{}'.format(model_id, payload))
+    payload = model_codec.mistral_request(query, max_tokens, temperature, top_p, top_k)
+    body = model_codec.dumps(payload)
+    structured_logging.log_request(model_id, payload, 'Invoking Bedrock Mistral')
     
     
     try:
         
-        response = bedrockruntime.invoke_model( modelId = model_id,
+        response = invoke_bedrock_model( modelId = model_id,
                                                 contentType="application/json", 
                                                 accept = "application/json",
                                                 body=body
                                             )
-        response = json.loads(response['body'].read())
-        logger.debug('Invoking Mistral  ... model: {}, response: {}'.format(model_id, response))
-        result_text = response['outputs'][0]['text']
+        response_body = model_codec.read_json(response['body'])
+        structured_logging.log_response(model_id, response_body, 'Invoking Mistral')
+        result_text = response_body['outputs'][0]['text']
 
         # Generate the cost and save in session
-        save_cost_entry_for_model(model_id, query, response)
+        save_cost_entry_for_model(model_id, query, result_text, response)
         
         # Strip off additional quotes as it breaks the model with subsequent calls
         return result_text #.strip('\"')
@@ -1278,53 +1395,317 @@ def call_bedrock_mistral(query, model_id,max_tokens, temperature, top_p, top_k,
             return err
         return e1        
        
-def to_camel_case(text):
-    s = text.replace("-", " ").replace("_", " ").replace('.', ' ').replace(':', '.')
-    s = s.split()
-    if len(text) == 0:
-        return text
-    return ' '.join(i.capitalize() for i in s[0:])
 
+# Streaming variants of the Bedrock text models, registered as 'stream' next to 'func' in find_bedrock_model.
+# Each one is a generator yielding text tokens as they arrive from invoke_model_with_response_stream.
+# Cost is saved once the stream ends, using the token counts reported by Bedrock when available.
+
+def stream_bedrock_model(model_id, body, prompt_text, parse_chunk):
+    
+    logger.info('Invoking Bedrock streaming... model: {}'.format(model_id))
+    body_bytes = model_codec.dumps(body)
+    start_time = time.time()
+    first_token_time = None
+    result_text = ''
+    invocation_metrics = None
+    try:
+        response = invoke_bedrock_model_with_response_stream(
+            modelId = model_id,
+            contentType = "application/json",
+            accept = "application/json",
+            body = body_bytes)
+        
+        for event in response['body']:
+            chunk = event.get('chunk')
+            if chunk is None:
+                continue
+            
+            chunk_obj = model_codec.loads(chunk['bytes'])
+            if 'amazon-bedrock-invocationMetrics' in chunk_obj:
+                invocation_metrics = chunk_obj['amazon-bedrock-invocationMetrics']
+            
+            token = parse_chunk(chunk_obj)
+            if not token:
+                continue
+            
+            if first_token_time is None:
+                first_token_time = time.time()
+                save_time_to_first_token(model_id, first_token_time - start_time)
+            
+            result_text += token
+            yield token
+    
+    except Exception as e1:
+        logger.exception(e1)
+        if 'Throttling' in str(e1):
+            err = 'Error!! Request Throttled!! Please retry later'
+        elif 'ValidationException' in str(e1):
+            err = 'Error!! Failure in backend model processing!!'
+        elif 'AccessDeniedException' in str(e1):
+            err = 'Error!! Problem in accessing model, possible its not available!!'
+        else:
+            err = 'Error!! ' + str(e1)
+        logger.error(err)
+        yield err
+        return
+    
+    logger.info('Completed Bedrock streaming... model: {}, total time: {:.3f}s'.format(model_id, time.time() - start_time))
+    
+    # Generate the cost and save in session
+    if invocation_metrics is not None:
+        rate_limiter.get_rate_limiter(model_id).record_usage(estimate_request_tokens(body_bytes),
+                                                             invocation_metrics['inputTokenCount'] + invocation_metrics['outputTokenCount'])
+        user_generated_prompt = True if (AUTO_GENERATED_PROMPT not in prompt_text) else False
+        save_cost_entry_for_model_tokens(model_id, invocation_metrics['inputTokenCount'], invocation_metrics['outputTokenCount'], user_generated_prompt)
+    else:
+        save_cost_entry_for_model(model_id, prompt_text, result_text)
+
+def save_time_to_first_token(model_id, time_to_first_token):
+    
+    logger.info(f'Time to first token: {time_to_first_token:.3f}s, model: {model_id}')
+    st.session_state['last_time_to_first_token'] = { 'model_id': model_id, 'ttft': f'{time_to_first_token:.3f}' }
+
+def get_stream_func(model_entry):
+    
+    # Models without a streaming variant (Jumpstart, AI21) yield their full response as a single chunk
+    stream_func = model_entry.get('stream')
+    if stream_func is not None:
+        return stream_func
+    
+    func = model_entry['func']
+    def single_chunk_stream(prompt_text, *args, **kwargs):
+        yield str(func(prompt_text, *args, **kwargs))
+    
+    return single_chunk_stream
+
+def write_stream(model_entry, prompt_text, container=None, use_cache=False):
+    
+    # Render tokens into the given streamlit container as they arrive and return the full, unescaped response
+    container = st if container is None else container
+    stream_func = get_stream_func(model_entry)
+    tokens = []
+    
+    def escaped_tokens():
+        for token in stream_func(prompt_text, use_cache=use_cache):
+            tokens.append(token)
+            yield token.replace("$","\$")
+    
+    container.write_stream(escaped_tokens())
+    return ''.join(tokens)
+
+def stream_bedrock_titan_text_lite_model(prompt_text, max_tokens = 4096, temperature = 0.5, top_p = 0.9, top_k = 250, stop_sequences = []):
+    model_id = 'amazon.titan-text-lite-v1'
+    return stream_bedrock_titan_model(prompt_text, model_id, max_tokens, temperature, top_p, stop_sequences)
+
+def stream_bedrock_titan_text_express_model(prompt_text, max_tokens = 4096, temperature = 0.5, top_p = 0.9, top_k = 250, stop_sequences = []):
+    model_id = 'amazon.titan-text-express-v1'
+    return stream_bedrock_titan_model(prompt_text, model_id, max_tokens, temperature, top_p, stop_sequences)
+
+def stream_bedrock_titan_model(prompt_text, model_id, max_tokens, temperature, top_p, stop_sequences):
+    
+    prompt_text = prompt_text[:BEDROCK_TITAN_PAYLOAD_LIMIT]
+    body = model_codec.titan_text_request(prompt_text, max_tokens, temperature, top_p, stop_sequences)
+    return stream_bedrock_model(model_id, body, prompt_text, lambda chunk_obj: chunk_obj.get('outputText'))
+
+def stream_bedrock_claude_model_v3(prompt_text, max_tokens = 8192, temperature = 0.5, top_p = 1, top_k = 250):
+    model_id = 'anthropic.claude-3-sonnet-20240229-v1:0'
+    return stream_bedrock_claude_model_3(prompt_text, model_id, max_tokens, temperature, top_p, top_k)
+
+def stream_bedrock_claude_model_instant_v1(prompt_text, max_tokens = 2048, temperature = 0.5, top_p = 1, top_k = 250, stop_sequences = []):
+    model_id = 'anthropic.claude-instant-v1'
+    return stream_bedrock_claude_model(prompt_text, model_id, max_tokens, temperature, top_p, top_k, stop_sequences)
+
+def stream_bedrock_claude_model_v2_1(prompt_text, max_tokens = 2048, temperature = 0.5, top_p = 1, top_k = 250, stop_sequences = []):
+    model_id = 'anthropic.claude-v2:1'
+    return stream_bedrock_claude_model(prompt_text, model_id, max_tokens, temperature, top_p, top_k, stop_sequences)
+
+def stream_bedrock_claude_model_v2(prompt_text, max_tokens = 2048, temperature = 0.5, top_p = 1, top_k = 250, stop_sequences = []):
+    model_id = 'anthropic.claude-v2'
+    return stream_bedrock_claude_model(prompt_text, model_id, max_tokens, temperature, top_p, top_k, stop_sequences)
 
-create_model_function_mapping()
-if has_jumpstart == True:
-    genai_models.append('Sagemaker Jumpstart')
+def stream_bedrock_claude_model_v1(prompt_text, max_tokens = 2048, temperature = 0.5, top_p = 1, top_k = 250, stop_sequences = []):
+    model_id = 'anthropic.claude-v1'
+    return stream_bedrock_claude_model(prompt_text, model_id, max_tokens, temperature, top_p, top_k, stop_sequences)
 
-for model_name in genai_model_entries.keys():
-    genai_model_functions[model_name] = find_bedrock_model(genai_model_entries[model_name])
-genai_model_functions["sagemaker jumpstart"] = get_jumpstart_model()
+def stream_bedrock_claude_v1_100k(prompt_text, max_tokens = 2048, temperature = 0.5, top_p = 1, top_k = 250, stop_sequences = []):
+    model_id = 'anthropic.claude-v1-100k'
+    return stream_bedrock_claude_model(prompt_text, model_id, max_tokens, temperature, top_p, top_k, stop_sequences)
 
+def stream_bedrock_claude_v2_100k(prompt_text, max_tokens = 2048, temperature = 0.5, top_p = 1, top_k = 250, stop_sequences = []):
+    model_id = 'anthropic.claude-v2-100k'
+    return stream_bedrock_claude_model(prompt_text, model_id, max_tokens, temperature, top_p, top_k, stop_sequences)
 
-#logger.info('genai-models: {}'.format(genai_models))
-#logger.info('genai-genai_model_functions: {}'.format(genai_model_functions))
+def stream_bedrock_claude_model(prompt_text, model_id, max_tokens = 2048, temperature = 0.5, top_p = 1, top_k = 250, stop_sequences = []):
+    
+    body = model_codec.claude_request(prompt_text, max_tokens)
+    return stream_bedrock_model(model_id, body, body['prompt'], lambda chunk_obj: chunk_obj.get('completion'))
 
-default_genai_model = 'Anthropic Claude V2.1'
-default_genai_model_index = -1
+def stream_bedrock_claude_model_3(prompt_text, model_id, max_tokens = 8192, temperature = 0.5, top_p = 1, top_k = 250):
+    """ streams the new claude 3 model via the messages api """
+    
+    body = model_codec.claude_messages_request(prompt_text, 8096)
+    
+    def parse_chunk(chunk_obj):
+        if chunk_obj.get('type') == 'content_block_delta':
+            return chunk_obj['delta'].get('text')
+        return None
+    
+    return stream_bedrock_model(model_id, body, prompt_text, parse_chunk)
 
-try:
+def stream_bedrock_cohere_text_v14(prompt_text, max_tokens = 1024, temperature = 0.5, top_p = 1, top_k = 250, stop_sequences = []):
+    model_id='cohere.command-text-v14'
+    body = model_codec.cohere_request(prompt_text, max_tokens, temperature, top_p)
+    body['stream'] = True
     
-    default_genai_model_index = genai_models.index(default_genai_model)
-except:
-    logger.info('Didnt find default model ...Claude V2.1')
+    def parse_chunk(chunk_obj):
+        if 'generations' in chunk_obj:
+            return chunk_obj['generations'][0].get('text')
+        return chunk_obj.get('text')
     
-    if default_genai_model_index == -1:
-        just_claude_index = -1
-        other_match = None
-        for key in genai_models:
-            if 'Claude' in key and '2' in key:
-                default_genai_model = key
-                default_genai_model_index = genai_models.index(key)
-                break
-            elif 'Claude' in key:
-                other_match = key
-                just_claude_index =  genai_models.index(key)
-        
-        if default_genai_model_index == -1 and just_claude_index != -1:
-            default_genai_model = other_match
-            default_genai_model_index = just_claude_index
-            
-logger.info('######## Default Genai model: {}, index: {}, call_model: {}'.format(default_genai_model, default_genai_model_index, genai_model_functions[default_genai_model] ) )
+    return stream_bedrock_model(model_id, body, prompt_text, parse_chunk)
 
+def stream_bedrock_llama_2_13b(query, max_new_tokens=4096, temperature = 0.6, top_p = 0.9):
+    
+    return stream_bedrock_llama_2_code_response(query, 'meta.llama2-13b-chat-v1', max_new_tokens, temperature, top_p)
+
+def stream_bedrock_llama_2_70b(query, max_new_tokens=4096, temperature = 0.6, top_p = 0.9):
+    
+    return stream_bedrock_llama_2_code_response(query, 'meta.llama2-70b-chat-v1', max_new_tokens, temperature, top_p)
 
+def stream_bedrock_llama_2_code_response(query, model_id, max_new_tokens, temperature, top_p):
     
+    body = model_codec.llama2_request(query, 2000, temperature, top_p)
+    return stream_bedrock_model(model_id, body, query, lambda chunk_obj: chunk_obj.get('generation'))
 
+def stream_bedrock_mistral_7b(query, max_tokens = 500, temperature = 0.7, top_p = 0.7, top_k = 50, stop_sequences = []):
+    
+    model_id = "mistral.mistral-7b-instruct-v0:2"
+    return stream_bedrock_mistral(query, model_id,max_tokens, temperature, top_p, top_k, stop_sequences)
+
+def stream_bedrock_mistral_8x7b(query, max_tokens = 500, temperature = 0.7, top_p = 0.7, top_k = 50, stop_sequences = []):
+    
+    model_id = "mistral.mistral-8x7b-instruct-v0:1"
+    return stream_bedrock_mistral(query, model_id,max_tokens, temperature, top_p, top_k, stop_sequences)
+
+def stream_bedrock_mistral(query, model_id,max_tokens, temperature, top_p, top_k, stop_sequences):
+    
+    body = model_codec.mistral_request(query, max_tokens, temperature, top_p, top_k)
+    
+    def parse_chunk(chunk_obj):
+        outputs = chunk_obj.get('outputs')
+        return outputs[0].get('text') if outputs else None
+    
+    return stream_bedrock_model(model_id, body, query, parse_chunk)
+
+def wrap_model_entry(model_entry):
+    
+    # Layer hedging, coalescing of identical concurrent calls, the exact-match and the semantic response caches
+    # and the trace span over the invocation functions of a model entry
+    wrapped_entry = dict(model_entry)
+    model_id = model_entry['model_id']
+    embed_func = None if semantic_cache.SEMANTIC_CACHE_EMBEDDING == 'local' else embed_text
+    
+    func = model_entry['func']
+    stream_func = model_entry.get('stream')
+    fallback_entry = find_bedrock_model(hedged_requests.HEDGING_FALLBACK_MODEL_ID)
+    if fallback_entry['model_id'] != model_id:
+        func = hedged_requests.hedged_model_func(model_id, func, fallback_entry)
+        if stream_func is not None:
+            stream_func = hedged_requests.hedged_model_stream(model_id, stream_func, fallback_entry)
+    
+    func = single_flight.coalesced_model_func(model_id, func)
+    if stream_func is not None:
+        stream_func = single_flight.coalesced_model_stream(model_id, stream_func)
+    
+    func = response_cache.cached_model_func(model_id, func)
+    func = semantic_cache.semantic_cached_model_func(model_id, func, embed_func, is_user_generated_prompt)
+    wrapped_entry['func'] = telemetry.traced_model_func(model_id, func)
+    if stream_func is not None:
+        stream_func = response_cache.cached_model_stream(model_id, stream_func)
+        stream_func = semantic_cache.semantic_cached_model_stream(model_id, stream_func, embed_func, is_user_generated_prompt)
+        wrapped_entry['stream'] = telemetry.traced_model_stream(model_id, stream_func)
+    
+    return wrapped_entry
+
+def to_camel_case(text):
+    s = text.replace("-", " ").replace("_", " ").replace('.', ' ').replace(':', '.')
+    s = s.split()
+    if len(text) == 0:
+        return text
+    return ' '.join(i.capitalize() for i in s[0:])
+
+
+def find_default_genai_model(genai_models):
+    default_genai_model = 'Anthropic Claude V2.1'
+    default_genai_model_index = -1
+
+    try:
+        
+        default_genai_model_index = genai_models.index(default_genai_model)
+    except:
+        logger.info('Didnt find default model ...Claude V2.1')
+        
+        if default_genai_model_index == -1:
+            just_claude_index = -1
+            other_match = None
+            for key in genai_models:
+                if 'Claude' in key and '2' in key:
+                    default_genai_model = key
+                    default_genai_model_index = genai_models.index(key)
+                    break
+                elif 'Claude' in key:
+                    other_match = key
+                    just_claude_index =  genai_models.index(key)
+            
+            if default_genai_model_index == -1 and just_claude_index != -1:
+                default_genai_model = other_match
+                default_genai_model_index = just_claude_index
+    
+    return default_genai_model, default_genai_model_index
+
+def build_model_catalog(snapshot):
+    catalog = { 'snapshot': snapshot, 'has_bedrock': snapshot['has_bedrock'], 'has_jumpstart': snapshot['has_jumpstart'] }
+    catalog['env_model_preference'] = check_preference(catalog['has_bedrock'], catalog['has_jumpstart'])
+    
+    provider_maps = build_provider_maps(snapshot['model_summaries'])
+    catalog['bedrock_text_provider_map'], catalog['bedrock_img_provider_map'], catalog['bedrock_embedding_provider_map'] = provider_maps
+    
+    genai_models, genai_model_entries = create_model_function_mapping(catalog['bedrock_text_provider_map'])
+    if catalog['has_jumpstart'] == True:
+        genai_models.append('Sagemaker Jumpstart')
+
+    genai_model_functions = {}
+    for model_name in genai_model_entries.keys():
+        genai_model_functions[model_name] = wrap_model_entry(find_bedrock_model(genai_model_entries[model_name]))
+    genai_model_functions["sagemaker jumpstart"] = wrap_model_entry(get_jumpstart_model(catalog['has_bedrock'], catalog['has_jumpstart'], catalog['env_model_preference']))
+
+    #logger.info('genai-models: {}'.format(genai_models))
+    #logger.info('genai-genai_model_functions: {}'.format(genai_model_functions))
+    
+    catalog['genai_models'] = genai_models
+    catalog['genai_model_entries'] = genai_model_entries
+    catalog['genai_model_functions'] = genai_model_functions
+    catalog['default_genai_model'], catalog['default_genai_model_index'] = find_default_genai_model(genai_models)
+    
+    logger.info('######## Default Genai model: {}, index: {}, call_model: {}'.format(catalog['default_genai_model'], catalog['default_genai_model_index'], genai_model_functions.get(catalog['default_genai_model']) ) )
+    return catalog
+
+def get_model_catalog():
+    global model_catalog_state
+    
+    # Rebuild the model lists whenever the background refresh swapped in a new snapshot
+    snapshot = model_catalog.get_snapshot(discover_model_catalog)
+    catalog = model_catalog_state
+    if catalog is None or catalog['snapshot'] is not snapshot:
+        with model_catalog_state_lock:
+            if model_catalog_state is None or model_catalog_state['snapshot'] is not snapshot:
+                model_catalog_state = build_model_catalog(snapshot)
+            catalog = model_catalog_state
+    
+    return catalog
+
+def __getattr__(name):
+    # Keeps gen_ai_selector.genai_models and friends working for the pages without discovery at import
+    if name in CATALOG_ATTRIBUTES:
+        return get_model_catalog()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
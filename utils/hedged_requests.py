@@ -0,0 +1,254 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Helper utility to keep live latency histograms per model and hedge slow invocations.
+# When the primary model has not answered (or streamed a first token) by its percentile deadline,
+# the same prompt goes to a fallback model and the first good answer wins.
+import os
+import time
+import queue
+import bisect
+import logging
+import threading
+import collections
+import functools
+import concurrent.futures
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from utils import response_cache
+from utils import telemetry
+
+logger = logging.getLogger('gen-ai-invoker')
+
+HEDGING_ENABLED = os.getenv('HEDGING_ENABLED', 'false').lower() == 'true'
+HEDGING_FALLBACK_MODEL_ID = os.getenv('HEDGING_FALLBACK_MODEL_ID', 'anthropic.claude-instant-v1')
+HEDGING_PERCENTILE = (float)(os.getenv('HEDGING_PERCENTILE', '95'))
+# Until a model has this many samples the default deadline is used
+HEDGING_MIN_SAMPLES = (int)(os.getenv('HEDGING_MIN_SAMPLES', '20'))
+HEDGING_DEFAULT_DEADLINE = (float)(os.getenv('HEDGING_DEFAULT_DEADLINE', '30'))
+HEDGING_MAX_WORKERS = (int)(os.getenv('HEDGING_MAX_WORKERS', '32'))
+
+# Bucket upper bounds in seconds, roughly 25% apart from 50ms to 10 minutes
+LATENCY_BUCKETS = [ round(0.05*(1.25**i), 3) for i in range(43) ]
+
+RESPONSE_LATENCY = 'response'
+FIRST_TOKEN_LATENCY = 'first_token'
+
+hedging_stats = collections.Counter()
+
+
+class LatencyHistogram:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = [0]*(len(LATENCY_BUCKETS) + 1)
+        self.total = 0
+        self.sum = 0.0
+
+    def record(self, seconds):
+        with self.lock:
+            self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            self.total += 1
+            self.sum += seconds
+
+    def percentile(self, percent):
+        with self.lock:
+            if self.total == 0:
+                return None
+            rank = self.total*percent/100.0
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank:
+                    return LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else LATENCY_BUCKETS[-1]
+
+    def get_stats(self):
+        with self.lock:
+            return { 'count': self.total, 'sum': self.sum, 'buckets': list(zip(LATENCY_BUCKETS + [ float('inf') ], self.counts)) }
+
+
+latency_histograms = {}
+latency_histograms_lock = threading.Lock()
+
+def get_latency_histogram(model_id, kind):
+    with latency_histograms_lock:
+        histogram = latency_histograms.get((model_id, kind))
+        if histogram is None:
+            histogram = LatencyHistogram()
+            latency_histograms[(model_id, kind)] = histogram
+        return histogram
+
+def record_latency(model_id, kind, seconds):
+    get_latency_histogram(model_id, kind).record(seconds)
+
+def get_latency_stats():
+    with latency_histograms_lock:
+        current_histograms = dict(latency_histograms)
+    return { f'{model_id}:{kind}': histogram.get_stats() for (model_id, kind), histogram in current_histograms.items() }
+
+def get_hedging_stats():
+    return dict(hedging_stats)
+
+def get_deadline(model_id, kind):
+    histogram = get_latency_histogram(model_id, kind)
+    if histogram.total < HEDGING_MIN_SAMPLES:
+        return HEDGING_DEFAULT_DEADLINE
+    return histogram.percentile(HEDGING_PERCENTILE)
+
+
+# Worker threads carry the streamlit context, trace span and cost collector of the caller so both calls can save their cost in the session.
+# Fallbacks have their own workers so they never queue behind the primaries they hedge, streams run on their own threads
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=HEDGING_MAX_WORKERS, thread_name_prefix='hedged-request')
+fallback_executor = concurrent.futures.ThreadPoolExecutor(max_workers=HEDGING_MAX_WORKERS, thread_name_prefix='hedged-fallback')
+
+def with_context(func, *args, **kwargs):
+    ctx = get_script_run_ctx()
+    parent_span = telemetry.get_current_span()
+    cost_entries = telemetry.get_cost_entries()
+    caching = response_cache.is_caching_requests()
+
+    def run_with_context():
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        with telemetry.use_span(parent_span), telemetry.use_cost_entries(cost_entries), response_cache.caching_requests(caching):
+            return func(*args, **kwargs)
+
+    return run_with_context
+
+def start_stream_thread(*args):
+    threading.Thread(target=with_context(run_stream, *args), name='hedged-stream', daemon=True).start()
+
+def is_good_response(response):
+    return response_cache.is_cacheable_response(response)
+
+def timed_call(model_id, func, *args, **kwargs):
+    
+    # Latencies are kept for good answers only, fast failures would pull the deadline down
+    start_time = time.time()
+    response = func(*args, **kwargs)
+    if is_good_response(response):
+        record_latency(model_id, RESPONSE_LATENCY, time.time() - start_time)
+    return response
+
+def hedged_model_func(model_id, func, fallback_entry):
+
+    # The fallback only gets the prompt, sampling params are not portable across model families
+    @functools.wraps(func)
+    def hedged_func(prompt_text, *args, **kwargs):
+        if not HEDGING_ENABLED:
+            return timed_call(model_id, func, prompt_text, *args, **kwargs)
+
+        deadline = get_deadline(model_id, RESPONSE_LATENCY)
+        started = threading.Event()
+
+        def started_call():
+            started.set()
+            return timed_call(model_id, func, prompt_text, *args, **kwargs)
+
+        primary = executor.submit(with_context(started_call))
+        # Time queued behind other primaries does not count, the deadline starts when the call does
+        started.wait()
+        try:
+            return primary.result(timeout=deadline)
+        except concurrent.futures.TimeoutError:
+            pass
+
+        logger.info('Hedging model: {} after {:.2f}s with fallback: {}'.format(model_id, deadline, fallback_entry['model_id']))
+        hedging_stats['hedged'] += 1
+        fallback = fallback_executor.submit(with_context(timed_call, fallback_entry['model_id'], fallback_entry['func'], prompt_text))
+
+        # First good answer wins, the other call is left to finish in the background and is ignored
+        pending = { primary, fallback }
+        response = None
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                response = future.result()
+                if is_good_response(response):
+                    hedging_stats['primary_wins' if future is primary else 'fallback_wins'] += 1
+                    return response
+
+        return response
+
+    return hedged_func
+
+def timed_stream(model_id, stream_func, prompt_text, *args, **kwargs):
+    start_time = time.time()
+    first_token = None
+    for token in stream_func(prompt_text, *args, **kwargs):
+        if first_token is None:
+            first_token = token
+            if is_good_response(token):
+                record_latency(model_id, FIRST_TOKEN_LATENCY, time.time() - start_time)
+        yield token
+    
+    if first_token is not None and is_good_response(first_token):
+        record_latency(model_id, RESPONSE_LATENCY, time.time() - start_time)
+
+def run_stream(source, model_id, stream_func, prompt_text, args, kwargs, tokens):
+    
+    # Pushes (source, token) pairs and a final (source, None) once the stream ends
+    try:
+        for token in timed_stream(model_id, stream_func, prompt_text, *args, **kwargs):
+            tokens.put((source, token))
+    finally:
+        tokens.put((source, None))
+
+def hedged_model_stream(model_id, stream_func, fallback_entry):
+
+    @functools.wraps(stream_func)
+    def hedged_stream(prompt_text, *args, **kwargs):
+        if not HEDGING_ENABLED or fallback_entry.get('stream') is None:
+            yield from timed_stream(model_id, stream_func, prompt_text, *args, **kwargs)
+            return
+
+        deadline = get_deadline(model_id, FIRST_TOKEN_LATENCY)
+        tokens = queue.Queue()
+        start_stream_thread('primary', model_id, stream_func, prompt_text, args, kwargs, tokens)
+        try:
+            winner, token = tokens.get(timeout=deadline)
+        except queue.Empty:
+            logger.info('Hedging streaming model: {} after {:.2f}s with fallback: {}'.format(model_id, deadline, fallback_entry['model_id']))
+            hedging_stats['hedged'] += 1
+            start_stream_thread('fallback', fallback_entry['model_id'], fallback_entry['stream'], prompt_text, (), {}, tokens)
+            winner, token = wait_first_token(tokens)
+            hedging_stats[winner + '_wins'] += 1
+
+        # Tokens of the losing stream are ignored, it runs to the end in the background so its cost is saved
+        while token is not None:
+            yield token
+            source, token = tokens.get()
+            while source != winner:
+                source, token = tokens.get()
+
+    return hedged_stream
+
+def wait_first_token(tokens):
+    
+    # The first good token wins, when both streams fail the last error is returned
+    finished = set()
+    last_error = None
+    while True:
+        source, token = tokens.get()
+        if token is not None and is_good_response(token):
+            return source, token
+        if token is None:
+            finished.add(source)
+            if len(finished) == 2:
+                return source, last_error
+        else:
+            last_error = token
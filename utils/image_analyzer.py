@@ -0,0 +1,149 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Helper utility to analyze S3 images with Rekognition. The detections of an image are requested concurrently on
+# the shared client, each within a timeout, and the features that answered are used even when others failed.
+# Results are cached per image ETag and feature, so analyzing the same image again makes no Rekognition call.
+import os
+import time
+import logging
+import threading
+import collections
+import concurrent.futures
+from utils import aws_session_helper
+from utils import object_store
+from utils import hedged_requests
+
+logger = logging.getLogger('gen-ai-invoker')
+
+# Seconds the analysis waits for all the detections of an image
+IMAGE_ANALYSIS_TIMEOUT = (float)(os.getenv('IMAGE_ANALYSIS_TIMEOUT', '10'))
+# Detections added to labels, text and celebrities, comma separated: moderation, faces
+IMAGE_ANALYSIS_EXTRA_FEATURES = os.getenv('IMAGE_ANALYSIS_EXTRA_FEATURES', '')
+IMAGE_ANALYSIS_CACHE_ENTRIES = (int)(os.getenv('IMAGE_ANALYSIS_CACHE_ENTRIES', '1024'))
+# Concurrent Rekognition calls across all sessions in the process
+IMAGE_ANALYSIS_MAX_WORKERS = (int)(os.getenv('IMAGE_ANALYSIS_MAX_WORKERS', '16'))
+
+DEFAULT_FEATURES = [ 'celebrities', 'text', 'labels' ]
+
+rekognition = aws_session_helper.get_client('rekognition', assume_role=False)
+s3 = aws_session_helper.get_client('s3', assume_role=False)
+
+FEATURE_CALLS = {
+    'labels': lambda image: rekognition.detect_labels(Image=image, Features=['GENERAL_LABELS']),
+    'text': lambda image: rekognition.detect_text(Image=image),
+    'celebrities': lambda image: rekognition.recognize_celebrities(Image=image),
+    'moderation': lambda image: rekognition.detect_moderation_labels(Image=image),
+    'faces': lambda image: rekognition.detect_faces(Image=image, Attributes=['DEFAULT'])
+}
+
+analysis_cache = collections.OrderedDict()
+analysis_cache_lock = threading.Lock()
+
+analysis_stats = collections.Counter()
+
+# Worker threads carry the streamlit context of the caller so the calls show up in its performance panel
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=IMAGE_ANALYSIS_MAX_WORKERS, thread_name_prefix='image-analyzer')
+
+
+def get_analysis_stats():
+    return dict(analysis_stats)
+
+def get_features():
+    extra_features = [ feature.strip() for feature in IMAGE_ANALYSIS_EXTRA_FEATURES.split(',') if feature.strip() in FEATURE_CALLS ]
+    return DEFAULT_FEATURES + [ feature for feature in extra_features if feature not in DEFAULT_FEATURES ]
+
+def cache_get(key):
+    with analysis_cache_lock:
+        result = analysis_cache.get(key)
+        if result is not None:
+            analysis_cache.move_to_end(key)
+        return result
+
+def cache_put(key, result):
+    with analysis_cache_lock:
+        analysis_cache[key] = result
+        analysis_cache.move_to_end(key)
+        while len(analysis_cache) > IMAGE_ANALYSIS_CACHE_ENTRIES:
+            analysis_cache.popitem(last=False)
+
+def submit_with_context(func, *args):
+    # Carries the streamlit context, trace span and cost collector of the caller, see hedged_requests.with_context
+    return executor.submit(hedged_requests.with_context(func, *args))
+
+def analyze_image(bucket, object_key, features=None):
+    """
+    Runs the Rekognition detections of an S3 image concurrently, by default the ones of get_features().
+    Returns a dict from feature to the Rekognition response, without the features that failed or did
+    not answer within IMAGE_ANALYSIS_TIMEOUT. Only answered features are cached, a rerun retries the others.
+    """
+    features = get_features() if features is None else features
+    try:
+        etag = object_store.get_etag(s3, bucket, object_key)
+    except Exception as e1:
+        # Without an ETag the image is analyzed uncached
+        logger.warning('Could not read the ETag of s3://{}/{}: {}'.format(bucket, object_key, e1))
+        etag = None
+
+    results = {}
+    pending = []
+    for feature in features:
+        result = cache_get((bucket, object_key, etag, feature)) if etag is not None else None
+        if result is not None:
+            analysis_stats['cache_hits'] += 1
+            results[feature] = result
+        else:
+            pending.append(feature)
+    if not pending:
+        return results
+
+    start_time = time.time()
+    image = { 'S3Object': { 'Bucket': bucket, 'Name': object_key } }
+    futures = { submit_with_context(FEATURE_CALLS[feature], image): feature for feature in pending }
+    done, not_done = concurrent.futures.wait(futures, timeout=IMAGE_ANALYSIS_TIMEOUT)
+
+    for future in not_done:
+        # The call finishes in the background, its result is dropped
+        analysis_stats['timeouts'] += 1
+        logger.warning('Rekognition {} timed out for s3://{}/{}'.format(futures[future], bucket, object_key))
+    for future in done:
+        feature = futures[future]
+        try:
+            results[feature] = future.result()
+        except Exception as e1:
+            analysis_stats['failures'] += 1
+            logger.warning('Rekognition {} failed for s3://{}/{}: {}'.format(feature, bucket, object_key, e1))
+            continue
+        analysis_stats['calls'] += 1
+        if etag is not None:
+            cache_put((bucket, object_key, etag, feature), results[feature])
+
+    logger.info('Analyzed s3://{}/{} with {} of {} detections in {:.2f}s'.format(bucket, object_key, len(done), len(pending), time.time() - start_time))
+    return results
+
+def get_label_text(results):
+    # Words for the prompt describing the image, celebrities first, then text, labels and the extra detections
+    words = []
+    words += [ celebrity['Name'] for celebrity in results.get('celebrities', {}).get('CelebrityFaces', []) ]
+    words += [ text['DetectedText'] for text in results.get('text', {}).get('TextDetections', []) ]
+    words += [ label['Name'] for label in results.get('labels', {}).get('Labels', []) ]
+    words += [ label['Name'] for label in results.get('moderation', {}).get('ModerationLabels', []) ]
+    face_count = len(results.get('faces', {}).get('FaceDetails', []))
+    if face_count:
+        words.append(f'{face_count} faces')
+    return ''.join(word + ' ' for word in words)
@@ -0,0 +1,176 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Helper utility for the SageMaker JumpStart endpoint. Concurrent prompts with the same generation parameters
+# are micro-batched into one multi-input request for the containers that accept lists, and the text generation
+# inference (TGI) containers are streamed token by token with invoke_endpoint_with_response_stream.
+import os
+import logging
+import threading
+import collections
+import concurrent.futures
+from utils import aws_session_helper
+from utils import model_codec
+
+logger = logging.getLogger('gen-ai-invoker')
+
+JUMPSTART_STREAMING_ENABLED = os.getenv('JUMPSTART_STREAMING_ENABLED', 'true').lower() == 'true'
+JUMPSTART_BATCHING_ENABLED = os.getenv('JUMPSTART_BATCHING_ENABLED', 'true').lower() == 'true'
+JUMPSTART_BATCH_MAX_SIZE = (int)(os.getenv('JUMPSTART_BATCH_MAX_SIZE', '8'))
+# How long the first prompt of a batch waits for others, in milliseconds
+JUMPSTART_BATCH_MAX_WAIT_MS = (int)(os.getenv('JUMPSTART_BATCH_MAX_WAIT_MS', '20'))
+
+TGI_DATA_PREFIX = b'data:'
+
+batching_stats = collections.Counter()
+
+sagemaker_runtime = aws_session_helper.get_client('runtime.sagemaker', assume_role=False)
+
+
+def get_batching_stats():
+    return dict(batching_stats)
+
+def invoke_endpoint(endpoint_name, payload, custom_attributes=None):
+    kwargs = { 'EndpointName': endpoint_name, 'ContentType': 'application/json', 'Body': model_codec.dumps(payload) }
+    if custom_attributes is not None:
+        kwargs['CustomAttributes'] = custom_attributes
+    response = sagemaker_runtime.invoke_endpoint(**kwargs)
+    return model_codec.read_json(response['Body'])
+
+
+def parse_tgi_events(event_stream):
+
+    # Server-sent events of TGI, a data line can be split across payload parts
+    buffer = b''
+    for event in event_stream:
+        payload_part = event.get('PayloadPart')
+        if payload_part is None:
+            continue
+        buffer += payload_part['Bytes']
+        lines = buffer.split(b'\n')
+        buffer = lines.pop()
+        for line in lines:
+            if line.startswith(TGI_DATA_PREFIX):
+                yield model_codec.loads(line[len(TGI_DATA_PREFIX):])
+    if buffer.startswith(TGI_DATA_PREFIX):
+        yield model_codec.loads(buffer[len(TGI_DATA_PREFIX):])
+
+def stream_endpoint(endpoint_name, payload, custom_attributes=None):
+    """
+    Streams the generated text of a TGI container, payload is the TGI request and 'stream' is set on it.
+    Yields the text of each generated token, special tokens excluded.
+    """
+    kwargs = { 'EndpointName': endpoint_name, 'ContentType': 'application/json', 'Body': model_codec.dumps(dict(payload, stream=True)) }
+    if custom_attributes is not None:
+        kwargs['CustomAttributes'] = custom_attributes
+    response = sagemaker_runtime.invoke_endpoint_with_response_stream(**kwargs)
+    for event in parse_tgi_events(response['Body']):
+        token = event.get('token')
+        if token is None or token.get('special'):
+            continue
+        yield token['text']
+
+
+def parse_generated_texts(predictions, count):
+    # Multi-input responses come as {'generated_texts': [...]} or as one prediction (or list of them) per input
+    if isinstance(predictions, dict):
+        texts = predictions.get('generated_texts')
+        if texts is None:
+            texts = [ predictions['generated_text'] ]
+    else:
+        texts = [ (prediction[0] if isinstance(prediction, list) else prediction)['generated_text'] for prediction in predictions ]
+    if len(texts) != count:
+        raise ValueError('Expected {} generated texts from the endpoint, got {}'.format(count, len(texts)))
+    return texts
+
+
+class PendingBatch:
+
+    def __init__(self):
+        self.items = []
+        self.futures = []
+        self.full = threading.Event()
+
+
+class MicroBatcher:
+    """
+    Groups the items submitted concurrently by different threads. The first caller of a batch waits up to
+    the maximum wait, or until the batch is full, then sends the whole batch with send_batch, a function
+    from the list of items to the list of their results. Every caller gets the result of its own item.
+    """
+
+    def __init__(self, send_batch, max_size=JUMPSTART_BATCH_MAX_SIZE, max_wait=JUMPSTART_BATCH_MAX_WAIT_MS/1000.0):
+        self.send_batch = send_batch
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self.batch = None
+
+    def submit(self, item):
+        future = concurrent.futures.Future()
+        with self.lock:
+            batch = self.batch
+            is_leader = batch is None
+            if is_leader:
+                batch = PendingBatch()
+                self.batch = batch
+            batch.items.append(item)
+            batch.futures.append(future)
+            if len(batch.items) >= self.max_size:
+                self.batch = None
+                batch.full.set()
+
+        if is_leader:
+            batch.full.wait(self.max_wait)
+            with self.lock:
+                if self.batch is batch:
+                    self.batch = None
+            self.run_batch(batch)
+        return future.result()
+
+    def run_batch(self, batch):
+        batching_stats['batches'] += 1
+        batching_stats['items'] += len(batch.items)
+        # BaseException as well, a stopped streamlit script must not leave the other callers waiting
+        try:
+            results = self.send_batch(batch.items)
+        except BaseException as e1:
+            for future in batch.futures:
+                future.set_exception(e1)
+            raise
+        for future, result in zip(batch.futures, results):
+            future.set_result(result)
+
+
+batchers = {}
+batchers_lock = threading.Lock()
+
+def invoke_batched(batch_key, item, send_batch):
+    """
+    Sends the item in a micro-batch with the concurrent items of the same batch key, which must cover the
+    endpoint and the generation parameters. Without batching the item is sent on its own.
+    """
+    if not JUMPSTART_BATCHING_ENABLED:
+        return send_batch([ item ])[0]
+
+    with batchers_lock:
+        batcher = batchers.get(batch_key)
+        if batcher is None:
+            batcher = MicroBatcher(send_batch)
+            batchers[batch_key] = batcher
+    return batcher.submit(item)
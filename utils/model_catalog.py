@@ -0,0 +1,113 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Helper utility to keep the discovered model catalog in a JSON snapshot on disk.
+# The snapshot is served right away and refreshed in a background thread once older than the TTL,
+# so page loads never wait on Bedrock or Jumpstart discovery.
+import os
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger('gen-ai-invoker')
+
+MODEL_CATALOG_SNAPSHOT = os.getenv('MODEL_CATALOG_SNAPSHOT', '/tmp/gen-ai-model-catalog.json')
+# Snapshot shipped with the app, used on a fresh container until the first refresh completes
+MODEL_CATALOG_DEFAULT_SNAPSHOT = './utils/model_catalog_snapshot.json'
+MODEL_CATALOG_TTL = (int)(os.getenv('MODEL_CATALOG_TTL', '3600'))
+# Run discovery inline on first access instead of in the background (previous behavior)
+MODEL_CATALOG_SYNC_DISCOVERY = os.getenv('MODEL_CATALOG_SYNC_DISCOVERY', 'false').lower() == 'true'
+# Seconds between refresh attempts of a stale snapshot, so a failing discovery is not retried on every page load
+MODEL_CATALOG_RETRY_INTERVAL = (int)(os.getenv('MODEL_CATALOG_RETRY_INTERVAL', '300'))
+
+snapshot = None
+snapshot_lock = threading.Lock()
+refresh_thread = None
+last_refresh_attempt = 0
+
+
+def read_snapshot(path):
+    try:
+        with open(path, 'r') as snapshot_file:
+            return json.load(snapshot_file)
+    except (OSError, ValueError) as e1:
+        logger.info('Unable to read model catalog snapshot {}: {}'.format(path, e1))
+        return None
+
+def write_snapshot(new_snapshot):
+    # Write to a temp file and rename so other processes never read a partial snapshot
+    tmp_path = '{}.{}.tmp'.format(MODEL_CATALOG_SNAPSHOT, os.getpid())
+    try:
+        with open(tmp_path, 'w') as snapshot_file:
+            json.dump(new_snapshot, snapshot_file)
+        os.replace(tmp_path, MODEL_CATALOG_SNAPSHOT)
+    except OSError as e1:
+        logger.warning('Unable to save model catalog snapshot {}: {}'.format(MODEL_CATALOG_SNAPSHOT, e1))
+
+def is_stale(current_snapshot):
+    return time.time() - current_snapshot.get('created', 0) > MODEL_CATALOG_TTL
+
+def refresh_snapshot(discover_func):
+    global snapshot, last_refresh_attempt
+
+    start_time = time.time()
+    last_refresh_attempt = start_time
+    try:
+        new_snapshot = discover_func(snapshot)
+    except Exception as e1:
+        logger.exception(e1)
+        new_snapshot = None
+    if new_snapshot is None:
+        logger.warning('Model catalog discovery failed, keeping previous snapshot')
+        return snapshot
+
+    new_snapshot['created'] = time.time()
+    write_snapshot(new_snapshot)
+    snapshot = new_snapshot
+    logger.info('Refreshed model catalog snapshot in {:.3f}s'.format(time.time() - start_time))
+    return snapshot
+
+def start_background_refresh(discover_func):
+    global refresh_thread
+
+    with snapshot_lock:
+        if refresh_thread is not None and refresh_thread.is_alive():
+            return
+        refresh_thread = threading.Thread(target=refresh_snapshot, args=(discover_func,), name='model-catalog-refresh', daemon=True)
+        refresh_thread.start()
+
+def get_snapshot(discover_func):
+    global snapshot
+
+    # discover_func receives the previous snapshot and returns a new one, or None on failure
+    if snapshot is None:
+        with snapshot_lock:
+            if snapshot is None:
+                snapshot = read_snapshot(MODEL_CATALOG_SNAPSHOT)
+                if snapshot is None and not MODEL_CATALOG_SYNC_DISCOVERY:
+                    snapshot = read_snapshot(MODEL_CATALOG_DEFAULT_SNAPSHOT)
+                if snapshot is None:
+                    refresh_snapshot(discover_func)
+                if snapshot is None:
+                    snapshot = { 'created': 0, 'has_bedrock': False, 'has_jumpstart': False, 'model_summaries': [] }
+
+    if is_stale(snapshot) and time.time() - last_refresh_attempt > MODEL_CATALOG_RETRY_INTERVAL:
+        start_background_refresh(discover_func)
+
+    return snapshot
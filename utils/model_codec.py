@@ -0,0 +1,88 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Helper utility to encode the request bodies and decode the responses of the model providers. Bodies are
+# built per model family and serialized straight to utf-8 bytes, with orjson when it is installed, and
+# responses are decoded in one pass from the bytes of the botocore StreamingBody.
+import json
+import anthropic
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CLAUDE_MESSAGES_VERSION = 'bedrock-2023-05-31'
+
+
+if orjson is not None:
+
+    def dumps(obj):
+        return orjson.dumps(obj)
+
+    def loads(data):
+        return orjson.loads(data)
+
+else:
+
+    def dumps(obj):
+        # Compact and not ascii escaped, the same bytes orjson writes
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def loads(data):
+        return json.loads(data)
+
+
+def read_json(streaming_body):
+    """
+    Reads and decodes a json response body once, without an intermediate str.
+    """
+    return loads(streaming_body.read())
+
+
+def titan_text_request(prompt_text, max_tokens, temperature, top_p, stop_sequences):
+    return { 'inputText': prompt_text,
+             'textGenerationConfig': { 'maxTokenCount': max_tokens, 'topP': top_p, 'stopSequences': stop_sequences, 'temperature': temperature } }
+
+def titan_embedding_request(prompt_text):
+    return { 'inputText': prompt_text }
+
+def claude_request(prompt_text, max_tokens):
+    return { 'prompt': anthropic.HUMAN_PROMPT + prompt_text + anthropic.AI_PROMPT, 'max_tokens_to_sample': max_tokens }
+
+def claude_messages_request(prompt_text, max_tokens):
+    return { 'anthropic_version': CLAUDE_MESSAGES_VERSION, 'max_tokens': max_tokens,
+             'messages': [ { 'role': 'user', 'content': [ { 'type': 'text', 'text': prompt_text } ] } ] }
+
+def ai21_request(prompt_text, max_tokens, temperature, top_p, stop_sequences, count_penalty, presence_penalty, frequency_penalty):
+    return { 'prompt': prompt_text, 'maxTokens': max_tokens, 'temperature': temperature, 'topP': top_p, 'stopSequences': stop_sequences,
+             'countPenalty': { 'scale': count_penalty }, 'presencePenalty': { 'scale': presence_penalty },
+             'frequencyPenalty': { 'scale': frequency_penalty } }
+
+def cohere_request(prompt_text, max_tokens, temperature, top_p):
+    return { 'prompt': prompt_text, 'max_tokens': max_tokens, 'temperature': temperature, 'p': top_p }
+
+def llama2_request(prompt_text, max_gen_len, temperature, top_p):
+    return { 'prompt': prompt_text, 'max_gen_len': max_gen_len, 'top_p': top_p, 'temperature': temperature }
+
+def mistral_request(prompt_text, max_tokens, temperature, top_p, top_k):
+    return { 'prompt': f'<s>[INST]{prompt_text}.[/INST]\\', 'max_tokens': max_tokens, 'top_k': top_k, 'top_p': top_p, 'temperature': temperature }
+
+def sdxl_request(prompt_text, style_preset, height, width, image_strength, cfg_scale, seed, steps):
+    return { 'text_prompts': [ { 'text': prompt_text } ], 'cfg_scale': cfg_scale, 'height': height, 'width': width,
+             'image_strength': image_strength, 'style_preset': style_preset, 'seed': seed, 'steps': steps }
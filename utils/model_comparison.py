@@ -0,0 +1,172 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Helper utility to compare models side by side. One prompt is fanned out concurrently to the selected entries
+# of genai_model_functions, the answers stream into one column per model and each answer is reported with its
+# latency, time to first token, token counts and estimated cost, so the comparison takes as long as the slowest model.
+import os
+import time
+import queue
+import logging
+import collections
+import concurrent.futures
+import streamlit as st
+from utils import gen_ai_selector
+from utils import token_counter
+from utils import hedged_requests
+
+logger = logging.getLogger('gen-ai-invoker')
+
+COMPARISON_MAX_MODELS = (int)(os.getenv('COMPARISON_MAX_MODELS', '4'))
+# Concurrent model calls across all sessions in the process
+COMPARISON_MAX_WORKERS = (int)(os.getenv('COMPARISON_MAX_WORKERS', '16'))
+# Seconds between redraws of the streaming columns
+COMPARISON_REFRESH_INTERVAL = 0.1
+
+comparison_stats = collections.Counter()
+
+# Worker threads carry the streamlit context of the caller so the invocations are added to its cost
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=COMPARISON_MAX_WORKERS, thread_name_prefix='model-comparison')
+
+
+def get_comparison_stats():
+    return dict(comparison_stats)
+
+def submit_with_context(func, *args):
+    # Carries the streamlit context, trace span and cost collector of the caller, see hedged_requests.with_context
+    return executor.submit(hedged_requests.with_context(func, *args))
+
+def run_model(model_name, model_entry, prompt_text, token_queue):
+
+    # Streams one model, tokens go to the queue drained by the script thread and None marks the end
+    model_id = gen_ai_selector.genai_model_entries.get(model_name, model_entry['model_id'])
+    result = { 'model': model_name, 'model_id': model_id, 'text': '', 'latency': None, 'ttft': None,
+               'input_tokens': 0, 'output_tokens': 0, 'cost': None, 'estimated': False, 'error': None }
+    tokens = []
+    start_time = time.perf_counter()
+    try:
+        with gen_ai_selector.collect_costs() as cost_entries:
+            for token in gen_ai_selector.get_stream_func(model_entry)(prompt_text):
+                if result['ttft'] is None:
+                    result['ttft'] = time.perf_counter() - start_time
+                tokens.append(token)
+                token_queue.put((model_name, token))
+    except Exception as e1:
+        logger.exception(e1)
+        result['error'] = str(e1)
+    finally:
+        result['latency'] = time.perf_counter() - start_time
+        token_queue.put((model_name, None))
+
+    result['text'] = ''.join(tokens)
+    if result['error'] is None and result['text'].startswith('Error'):
+        result['error'] = result['text']
+
+    if cost_entries:
+        result['input_tokens'] = sum(entry['input_tokens'] for entry in cost_entries)
+        result['output_tokens'] = sum(entry['output_tokens'] for entry in cost_entries)
+        result['cost'] = sum(entry['cost'] for entry in cost_entries)
+    elif result['error'] is None:
+        # Answered from a cache or by another session's in-flight call, the tokens are counted as a fresh call would use them
+        result['input_tokens'] = token_counter.count_tokens(prompt_text, model_id)
+        result['output_tokens'] = token_counter.count_tokens(result['text'], model_id)
+        result['cost'] = gen_ai_selector.get_model_cost(model_id, result['input_tokens'], result['output_tokens'])
+        result['estimated'] = True
+    return result
+
+def draw_streams(model_names, token_queue, placeholders):
+
+    # Only the script thread writes to the page, it redraws the columns that received tokens since the last pass
+    texts = { model_name: '' for model_name in model_names }
+    remaining = len(model_names)
+    while remaining:
+        changed = set()
+        deadline = time.monotonic() + COMPARISON_REFRESH_INTERVAL
+        while remaining and time.monotonic() < deadline:
+            try:
+                model_name, token = token_queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if token is None:
+                remaining -= 1
+                continue
+            texts[model_name] += token
+            changed.add(model_name)
+        for model_name in changed:
+            placeholders[model_name].markdown(texts[model_name].replace('$', '\\$'))
+
+def compare_models(model_names, prompt_text, containers=None):
+    """
+    Sends one prompt to each of the named entries of genai_model_functions concurrently, at most
+    COMPARISON_MAX_MODELS. prompt_text is the prompt, or a function of the model entry returning the
+    prompt fitted to its context window. When streamlit containers are given, one per model, the
+    answers stream into them. Returns the results in the order of the names, with the answer text,
+    latency and time to first token in seconds, token counts, estimated cost and error, and the wall
+    time of the whole comparison.
+    """
+    models = gen_ai_selector.genai_model_functions
+    model_names = list(model_names)[:COMPARISON_MAX_MODELS]
+    token_queue = queue.Queue()
+    comparison_stats['comparisons'] += 1
+    comparison_stats['model_calls'] += len(model_names)
+
+    start_time = time.perf_counter()
+    futures = []
+    for model_name in model_names:
+        model_prompt = prompt_text(models[model_name]) if callable(prompt_text) else prompt_text
+        futures.append(submit_with_context(run_model, model_name, models[model_name], model_prompt, token_queue))
+
+    if containers is not None:
+        placeholders = { model_name: container.empty() for model_name, container in zip(model_names, containers) }
+        draw_streams(model_names, token_queue, placeholders)
+
+    results = [ future.result() for future in futures ]
+    wall_time = time.perf_counter() - start_time
+    logger.info('Compared {} models in {:.3f}s, slowest model: {:.3f}s'.format(len(results), wall_time, max([ result['latency'] for result in results ], default=0)))
+    return results, wall_time
+
+def format_result(result):
+    # One markdown line of metrics below the answer of a model
+    if result['error'] is not None:
+        return ':red[Failed after {:.2f}s]'.format(result['latency'])
+    ttft = '{:.2f}s'.format(result['ttft']) if result['ttft'] is not None else '-'
+    cost = '${:.6f}'.format(result['cost']) if result['cost'] is not None else 'n/a'
+    estimated = ' (estimated)' if result['estimated'] else ''
+    return 'Latency: {:.2f}s, first token: {}, tokens in/out: {}/{}{}, cost: {}'.format(
+        result['latency'], ttft, result['input_tokens'], result['output_tokens'], estimated, cost)
+
+def render_comparison(model_names, prompt_text, container=None):
+    """
+    Renders a side by side comparison of the named models into the container (the page by default),
+    one column per model with its streamed answer and metrics. Returns the results of compare_models.
+    """
+    container = st if container is None else container
+    model_names = list(model_names)[:COMPARISON_MAX_MODELS]
+    columns = container.columns(len(model_names))
+    for model_name, column in zip(model_names, columns):
+        column.markdown('**{}**'.format(model_name))
+    answer_containers = [ column.container() for column in columns ]
+
+    results, wall_time = compare_models(model_names, prompt_text, answer_containers)
+    for result, answer_container in zip(results, answer_containers):
+        if result['error'] is not None:
+            answer_container.error(result['error'])
+        answer_container.caption(format_result(result))
+    container.caption('Compared {} models in {:.2f}s, sum of the model latencies: {:.2f}s'.format(
+        len(results), wall_time, sum(result['latency'] for result in results)))
+    return results
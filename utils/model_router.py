@@ -0,0 +1,183 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Helper utility to route the internal calls of the pages, the suggested prompts and the hallucination checks,
+# to a tier of fast and cheap models instead of the model selected in the sidebar. Each task has a latency and
+# cost target, answers shown to the user stay on the selected model, and the savings are added to the cost report.
+import os
+import time
+import logging
+import threading
+import functools
+import collections
+from utils import gen_ai_selector
+from utils import token_counter
+
+logger = logging.getLogger('gen-ai-invoker')
+
+MODEL_ROUTING_ENABLED = os.getenv('MODEL_ROUTING_ENABLED', 'true').lower() == 'true'
+# Bedrock model ids (or prefixes) of the cheap tier, in order of preference
+MODEL_ROUTING_CHEAP_MODELS = os.getenv('MODEL_ROUTING_CHEAP_MODELS', 'anthropic.claude-instant-v1,amazon.titan-text-lite,mistral.mistral-7b-instruct')
+# Per task targets as task=latency seconds:cost dollars, the first model of the tier meeting both is used
+MODEL_ROUTING_TARGETS = os.getenv('MODEL_ROUTING_TARGETS', 'prompt_suggestions=10:0.002,hallucination_check=20:0.01')
+
+PROMPT_SUGGESTIONS = 'prompt_suggestions'
+HALLUCINATION_CHECK = 'hallucination_check'
+
+# Output tokens expected of each task, for the cost estimate before the call
+TASK_OUTPUT_TOKENS = { PROMPT_SUGGESTIONS: 150, HALLUCINATION_CHECK: 400 }
+DEFAULT_TASK_OUTPUT_TOKENS = 300
+# Weight of the latest call in the moving average of the latency of a model
+LATENCY_SMOOTHING = 0.3
+
+routing_stats = collections.Counter()
+model_latencies = {}
+model_latencies_lock = threading.Lock()
+
+
+def parse_targets(targets):
+    task_targets = {}
+    for entry in targets.split(','):
+        if '=' not in entry:
+            continue
+        task, target = entry.split('=', 1)
+        try:
+            max_latency, max_cost = target.split(':')
+            task_targets[task.strip()] = (float(max_latency), float(max_cost))
+        except ValueError:
+            logger.warning('Ignoring model routing target: {}'.format(entry))
+    return task_targets
+
+cheap_models = [ model_id.strip() for model_id in MODEL_ROUTING_CHEAP_MODELS.split(',') if model_id.strip() ]
+task_targets = parse_targets(MODEL_ROUTING_TARGETS)
+
+
+def get_routing_stats():
+    return dict(routing_stats)
+
+def record_latency(model_name, latency):
+    with model_latencies_lock:
+        previous = model_latencies.get(model_name)
+        model_latencies[model_name] = latency if previous is None else LATENCY_SMOOTHING*latency + (1 - LATENCY_SMOOTHING)*previous
+
+def get_model_id(model_name, model_entry):
+    return gen_ai_selector.genai_model_entries.get(model_name, model_entry['model_id'])
+
+def get_cheap_tier():
+    # Names of the cheap models available in this account, in the order of MODEL_ROUTING_CHEAP_MODELS
+    models = gen_ai_selector.genai_model_functions
+    tier = []
+    for cheap_model in cheap_models:
+        for model_name, model_id in gen_ai_selector.genai_model_entries.items():
+            if model_id.startswith(cheap_model) and model_name in models and model_name not in tier:
+                tier.append(model_name)
+                break
+    return tier
+
+def estimate_cost(model_name, model_entry, prompt_text, output_tokens):
+    model_id = get_model_id(model_name, model_entry)
+    return gen_ai_selector.get_model_cost(model_id, token_counter.count_tokens(prompt_text, model_id), output_tokens)
+
+def choose_model(task, model_name, prompt_text):
+    """
+    Picks the model for an internal task: the first model of the cheap tier whose prompt fits its
+    context window and whose estimated cost and recent latency meet the targets of the task, else the
+    cheapest fitting one, preferring those within the latency target. The selected model is kept when it is not priced (Jumpstart) or is no dearer.
+    """
+    models = gen_ai_selector.genai_model_functions
+    selected_entry = models[model_name]
+    output_tokens = TASK_OUTPUT_TOKENS.get(task, DEFAULT_TASK_OUTPUT_TOKENS)
+    selected_cost = estimate_cost(model_name, selected_entry, prompt_text, output_tokens)
+    if selected_cost is None:
+        return model_name
+
+    max_latency, max_cost = task_targets.get(task, (None, None))
+    candidates = []
+    for candidate in get_cheap_tier():
+        candidate_entry = models[candidate]
+        candidate_id = get_model_id(candidate, candidate_entry)
+        if token_counter.count_tokens(prompt_text, candidate_id) > token_counter.get_prompt_budget(candidate_entry):
+            continue
+        candidate_cost = estimate_cost(candidate, candidate_entry, prompt_text, output_tokens)
+        if candidate_cost is None:
+            continue
+        latency = model_latencies.get(candidate)
+        misses_latency = max_latency is not None and latency is not None and latency > max_latency
+        if not misses_latency and (max_cost is None or candidate_cost <= max_cost):
+            candidates = [ (misses_latency, candidate_cost, candidate) ]
+            break
+        candidates.append((misses_latency, candidate_cost, candidate))
+
+    if not candidates:
+        return model_name
+    misses_latency, candidate_cost, candidate = min(candidates)
+    return candidate if candidate_cost < selected_cost else model_name
+
+def save_savings(task, model_name, cost_entries):
+
+    # What the routed calls would have cost on the selected model, for the same token counts
+    model_id = get_model_id(model_name, gen_ai_selector.genai_model_functions[model_name])
+    savings = 0.0
+    for entry in cost_entries:
+        selected_cost = gen_ai_selector.get_model_cost(model_id, entry['input_tokens'], entry['output_tokens'])
+        if selected_cost is not None:
+            savings += selected_cost - entry['cost']
+
+    gen_ai_selector.save_routing_savings(savings)
+    logger.info('Routed {} of model: {} to a cheaper model, saved ${:.6f}'.format(task, model_name, savings))
+
+def call_routed(task, model_name, prompt_text, *args, **kwargs):
+    models = gen_ai_selector.genai_model_functions
+    routed_name = choose_model(task, model_name, prompt_text)
+    routing_stats[task] += 1
+    if routed_name == model_name:
+        return models[model_name]['func'](prompt_text, *args, **kwargs)
+
+    routing_stats['routed'] += 1
+    start_time = time.perf_counter()
+    result = None
+    try:
+        with gen_ai_selector.collect_costs() as cost_entries:
+            result = models[routed_name]['func'](prompt_text, *args, **kwargs)
+    except Exception as e1:
+        logger.exception(e1)
+    record_latency(routed_name, time.perf_counter() - start_time)
+
+    if result is None or str(result).startswith('Error'):
+        # The selected model answers when the cheap one fails
+        routing_stats['fallbacks'] += 1
+        logger.warning('Routed {} failed on model: {}, falling back to: {}'.format(task, routed_name, model_name))
+        return models[model_name]['func'](prompt_text, *args, **kwargs)
+
+    save_savings(task, model_name, cost_entries)
+    return result
+
+def get_func(task, model_name):
+    """
+    Returns the function to call for an internal task of a page, in place of the func of the model
+    selected in the sidebar, or that func itself when routing is disabled. Internal prompts are
+    regenerated on every rerun of a page, their answers are taken from the response cache.
+    """
+    if not MODEL_ROUTING_ENABLED:
+        return functools.partial(gen_ai_selector.genai_model_functions[model_name]['func'], use_cache=True)
+
+    def routed_func(prompt_text, *args, **kwargs):
+        kwargs.setdefault('use_cache', True)
+        return call_routed(task, model_name, prompt_text, *args, **kwargs)
+
+    return routed_func
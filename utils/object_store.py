@@ -0,0 +1,204 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Helper utility to read S3 objects without leaving files behind. Objects are read into memory, large ones with
+# concurrent ranged GETs, up to a size limit. Extractors that need a path get a file in a managed temp directory
+# that is removed after use. Images are shown from a downscaled thumbnail cached per ETag.
+import os
+import io
+import time
+import shutil
+import logging
+import tempfile
+import threading
+import contextlib
+import collections
+import concurrent.futures
+from PIL import Image
+
+logger = logging.getLogger('gen-ai-invoker')
+
+# Largest object read into memory, larger ones only go to the temp directory
+OBJECT_STORE_MAX_MEMORY_BYTES = (int)(os.getenv('OBJECT_STORE_MAX_MEMORY_BYTES', str(64*1024*1024)))
+# Objects larger than this are read with concurrent ranged GETs of this size
+OBJECT_STORE_PART_BYTES = (int)(os.getenv('OBJECT_STORE_PART_BYTES', str(8*1024*1024)))
+OBJECT_STORE_MAX_WORKERS = (int)(os.getenv('OBJECT_STORE_MAX_WORKERS', '8'))
+OBJECT_STORE_TEMP_DIR = os.getenv('OBJECT_STORE_TEMP_DIR', os.path.join(tempfile.gettempdir(), 'gen-ai-objects'))
+# Temp files older than this were left by a process that died, they are removed on start
+OBJECT_STORE_TEMP_MAX_AGE = (int)(os.getenv('OBJECT_STORE_TEMP_MAX_AGE', '3600'))
+# Longest side in pixels of the thumbnails shown for images
+OBJECT_STORE_THUMBNAIL_SIZE = (int)(os.getenv('OBJECT_STORE_THUMBNAIL_SIZE', '768'))
+OBJECT_STORE_THUMBNAIL_ENTRIES = (int)(os.getenv('OBJECT_STORE_THUMBNAIL_ENTRIES', '128'))
+# Seconds a known ETag is trusted before the object is checked again with a HEAD request
+DOCUMENT_CACHE_REVALIDATE_SECONDS = (int)(os.getenv('DOCUMENT_CACHE_REVALIDATE_SECONDS', '300'))
+
+# (bucket, object key) to (ETag, time of the last check)
+known_etags = {}
+thumbnail_cache = collections.OrderedDict()
+thumbnail_cache_lock = threading.Lock()
+temp_dir_lock = threading.Lock()
+temp_dir_ready = False
+
+object_stats = collections.Counter()
+
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=OBJECT_STORE_MAX_WORKERS, thread_name_prefix='object-store')
+
+
+class ObjectTooLarge(Exception):
+    pass
+
+
+def get_object_stats():
+    return dict(object_stats)
+
+def get_etag(s3, bucket, object_key):
+    now = time.time()
+    known = known_etags.get((bucket, object_key))
+    if known is not None and now - known[1] < DOCUMENT_CACHE_REVALIDATE_SECONDS:
+        return known[0]
+
+    etag = s3.head_object(Bucket=bucket, Key=object_key)['ETag']
+    known_etags[(bucket, object_key)] = (etag, now)
+    return etag
+
+def read_range(s3, bucket, object_key, etag, start, end):
+    # IfMatch fails the read if the object changes between the parts
+    response = s3.get_object(Bucket=bucket, Key=object_key, Range='bytes={}-{}'.format(start, end - 1), IfMatch=etag)
+    return start, response['Body'].read()
+
+def read_object(s3, bucket, object_key, max_bytes=None):
+    """
+    Returns the content of an S3 object as bytes. Objects larger than OBJECT_STORE_PART_BYTES are read
+    with concurrent ranged GETs. Raises ObjectTooLarge, before reading anything, for objects larger than
+    max_bytes, OBJECT_STORE_MAX_MEMORY_BYTES by default.
+    """
+    max_bytes = OBJECT_STORE_MAX_MEMORY_BYTES if max_bytes is None else max_bytes
+    head = s3.head_object(Bucket=bucket, Key=object_key)
+    size = head['ContentLength']
+    if size > max_bytes:
+        raise ObjectTooLarge('s3://{}/{} has {} bytes, more than {}'.format(bucket, object_key, size, max_bytes))
+
+    start_time = time.time()
+    if size <= OBJECT_STORE_PART_BYTES:
+        data = s3.get_object(Bucket=bucket, Key=object_key, IfMatch=head['ETag'])['Body'].read()
+        object_stats['reads'] += 1
+    else:
+        buffer = bytearray(size)
+        futures = [ executor.submit(read_range, s3, bucket, object_key, head['ETag'], start, min(start + OBJECT_STORE_PART_BYTES, size))
+                    for start in range(0, size, OBJECT_STORE_PART_BYTES) ]
+        for future in concurrent.futures.as_completed(futures):
+            start, part = future.result()
+            buffer[start:start + len(part)] = part
+        data = bytes(buffer)
+        object_stats['ranged_reads'] += 1
+        object_stats['parts'] += len(futures)
+        logger.info('Read s3://{}/{} in {} ranges in {:.2f}s'.format(bucket, object_key, len(futures), time.time() - start_time))
+
+    object_stats['bytes'] += len(data)
+    return data
+
+def remove_stale_temp_dirs():
+    now = time.time()
+    for name in os.listdir(OBJECT_STORE_TEMP_DIR):
+        path = os.path.join(OBJECT_STORE_TEMP_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > OBJECT_STORE_TEMP_MAX_AGE:
+                shutil.rmtree(path, ignore_errors=True)
+                object_stats['stale_temp_dirs'] += 1
+        except OSError:
+            # Removed by another process in the meantime
+            pass
+
+def make_temp_dir():
+    global temp_dir_ready
+
+    with temp_dir_lock:
+        if not temp_dir_ready:
+            os.makedirs(OBJECT_STORE_TEMP_DIR, exist_ok=True)
+            remove_stale_temp_dirs()
+            temp_dir_ready = True
+    # One directory per use, sessions reading objects with the same name do not collide
+    return tempfile.mkdtemp(dir=OBJECT_STORE_TEMP_DIR)
+
+@contextlib.contextmanager
+def temporary_file(s3, bucket, object_key):
+    """
+    Context manager downloading an S3 object to a file of the managed temp directory, for extractors that
+    need a path, and yielding its path. The file keeps the name of the object, textract picks its parser
+    from the extension. The file is removed on exit.
+    """
+    temp_dir = make_temp_dir()
+    try:
+        local_file = os.path.join(temp_dir, os.path.basename(object_key))
+        # The transfer manager downloads large objects in concurrent ranges straight to the file
+        s3.download_file(bucket, object_key, local_file)
+        object_stats['temp_files'] += 1
+        yield local_file
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+@contextlib.contextmanager
+def spill_to_file(buffer, name):
+    """
+    Context manager writing an in-memory object to a file of the managed temp directory, for work handed
+    to other processes, and yielding its path. The file is removed on exit.
+    """
+    temp_dir = make_temp_dir()
+    try:
+        local_file = os.path.join(temp_dir, os.path.basename(name))
+        with open(local_file, 'wb') as f:
+            f.write(buffer.getbuffer())
+        object_stats['spilled_files'] += 1
+        yield local_file
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def make_thumbnail(data):
+    image = Image.open(io.BytesIO(data))
+    # JPEG images are decoded at a reduced scale right away
+    image.draft('RGB', (OBJECT_STORE_THUMBNAIL_SIZE, OBJECT_STORE_THUMBNAIL_SIZE))
+    image.thumbnail((OBJECT_STORE_THUMBNAIL_SIZE, OBJECT_STORE_THUMBNAIL_SIZE))
+    output = io.BytesIO()
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image.save(output, format='PNG', optimize=True)
+    else:
+        image.convert('RGB').save(output, format='JPEG', quality=85)
+    return output.getvalue()
+
+def get_thumbnail(s3, bucket, object_key):
+    """
+    Returns the bytes of a downscaled copy of an S3 image, at most OBJECT_STORE_THUMBNAIL_SIZE pixels on
+    its longest side, to show with st.image. Thumbnails are cached per ETag, reruns do not read the image again.
+    """
+    etag = get_etag(s3, bucket, object_key)
+    key = (bucket, object_key, etag)
+    with thumbnail_cache_lock:
+        thumbnail = thumbnail_cache.get(key)
+        if thumbnail is not None:
+            thumbnail_cache.move_to_end(key)
+            object_stats['thumbnail_hits'] += 1
+            return thumbnail
+
+    thumbnail = make_thumbnail(read_object(s3, bucket, object_key))
+    object_stats['thumbnails'] += 1
+    with thumbnail_cache_lock:
+        thumbnail_cache[key] = thumbnail
+        thumbnail_cache.move_to_end(key)
+        while len(thumbnail_cache) > OBJECT_STORE_THUMBNAIL_ENTRIES:
+            thumbnail_cache.popitem(last=False)
+    return thumbnail
@@ -0,0 +1,104 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Helper utility to extract the text of a file page by page. PDF pages, PowerPoint slides and Excel sheets are
+# produced lazily one at a time, other formats are one page extracted with textract. The source is a path or, for
+# the formats of reads_file_objects, an in-memory binary file. Kept free of streamlit and AWS imports, its
+# functions also run in the worker processes of utils/document_cache.
+import textract
+from pypdf import PdfReader
+
+# python-pptx comes with textract, openpyxl is optional, without them the whole file goes through textract
+try:
+    import pptx
+except ImportError:
+    pptx = None
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+# Files read as utf-8 text rather than through an extractor
+TEXT_FILE_TYPES = [ 'py', 'java', 'ipynb' ]
+
+
+def normalize_text(text):
+    return text.replace('\r\n', '\n').replace('\x00', '')
+
+def reads_file_objects(file_type):
+    # textract only works on paths
+    return file_type in TEXT_FILE_TYPES or is_paged(file_type)
+
+def is_paged(file_type):
+    return file_type == 'pdf' or (file_type == 'pptx' and pptx is not None) or (file_type == 'xlsx' and openpyxl is not None)
+
+def count_pages(local_file, file_type):
+    # Only PDFs know their page count without extracting the pages
+    if file_type == 'pdf':
+        return len(PdfReader(local_file).pages)
+    return None
+
+def iter_pdf_pages(local_file, start_page):
+    reader = PdfReader(local_file)
+    for page_number in range(start_page, len(reader.pages)):
+        yield normalize_text(reader.pages[page_number].extract_text())
+
+def iter_pptx_pages(local_file, start_page):
+    presentation = pptx.Presentation(local_file)
+    for slide_number, slide in enumerate(presentation.slides):
+        if slide_number < start_page:
+            continue
+        texts = [ shape.text_frame.text for shape in slide.shapes if shape.has_text_frame ]
+        yield normalize_text('\n'.join(text for text in texts if text))
+
+def iter_xlsx_pages(local_file, start_page):
+    workbook = openpyxl.load_workbook(local_file, read_only=True, data_only=True)
+    try:
+        for sheet_number, sheet in enumerate(workbook.worksheets):
+            if sheet_number < start_page:
+                continue
+            rows = [ '\t'.join('' if value is None else str(value) for value in row) for row in sheet.iter_rows(values_only=True) ]
+            yield normalize_text(sheet.title + '\n' + '\n'.join(row for row in rows if row.strip()))
+    finally:
+        workbook.close()
+
+def iter_pages(local_file, file_type, start_page=0):
+    """
+    Yields the text of the pages of the file, a path or binary file object, from start_page on, one at
+    a time: PDF pages, PowerPoint slides or Excel sheets. Other formats have a single page.
+    """
+    if file_type == 'pdf':
+        yield from iter_pdf_pages(local_file, start_page)
+    elif file_type == 'pptx' and pptx is not None:
+        yield from iter_pptx_pages(local_file, start_page)
+    elif file_type == 'xlsx' and openpyxl is not None:
+        yield from iter_xlsx_pages(local_file, start_page)
+    elif start_page == 0:
+        if file_type in TEXT_FILE_TYPES and not isinstance(local_file, str):
+            yield normalize_text(local_file.read().decode('utf-8'))
+        elif file_type in TEXT_FILE_TYPES:
+            with open(local_file, 'rb') as f:
+                yield normalize_text(f.read().decode('utf-8'))
+        else:
+            yield normalize_text(textract.process(local_file).decode('utf-8'))
+
+def extract_pdf_page_range(local_file, start_page, end_page):
+    # Runs in a worker process, each worker parses the file on its own
+    reader = PdfReader(local_file)
+    return [ normalize_text(reader.pages[page_number].extract_text()) for page_number in range(start_page, end_page) ]
@@ -0,0 +1,228 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Helper utility to keep model invocations within the per-model Bedrock quotas.
+# Each model gets a requests and a tokens bucket shared by all streamlit sessions in the process, callers
+# queue for capacity instead of failing, and throttling or 5xx errors are retried with jittered backoff.
+import os
+import csv
+import time
+import random
+import logging
+import threading
+import collections
+import botocore
+from utils import telemetry
+
+logger = logging.getLogger('gen-ai-invoker')
+
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+MODEL_QUOTAS = './utils/model_quotas.csv'
+# Used for models without an entry in the quotas file
+RATE_LIMIT_DEFAULT_RPM = (float)(os.getenv('RATE_LIMIT_DEFAULT_RPM', '100'))
+RATE_LIMIT_DEFAULT_TPM = (float)(os.getenv('RATE_LIMIT_DEFAULT_TPM', '100000'))
+# Longest a caller waits in the queue before the call fails as throttled
+RATE_LIMIT_MAX_WAIT = (float)(os.getenv('RATE_LIMIT_MAX_WAIT', '120'))
+RETRY_MAX_ATTEMPTS = (int)(os.getenv('RETRY_MAX_ATTEMPTS', '5'))
+RETRY_BASE_DELAY = (float)(os.getenv('RETRY_BASE_DELAY', '1'))
+RETRY_MAX_DELAY = (float)(os.getenv('RETRY_MAX_DELAY', '20'))
+
+RETRYABLE_ERROR_CODES = [ 'ThrottlingException', 'TooManyRequestsException', 'ServiceUnavailableException',
+                          'ModelNotReadyException', 'InternalServerException' ]
+THROTTLING_ERROR_CODES = [ 'ThrottlingException', 'TooManyRequestsException' ]
+
+# Throttling shrinks the allowed rate by this factor, each success gives back a share of the configured rate
+THROTTLE_DECREASE_FACTOR = 0.7
+SUCCESS_INCREASE_FACTOR = 0.05
+MIN_RATE_FACTOR = 0.1
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+class TokenBucket:
+
+    def __init__(self, per_minute):
+        self.configured_rate = per_minute / 60.0
+        self.rate = self.configured_rate
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated)*self.rate)
+        self.updated = now
+
+    def reserve(self, amount, now):
+        # Callers reserve in arrival order and may drive the bucket negative, the deficit is their wait time
+        self.refill(now)
+        amount = min(amount, self.capacity)
+        self.tokens -= amount
+        return 0.0 if self.tokens >= 0 else -self.tokens/self.rate
+
+    def wait_time(self, amount, now):
+        self.refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens)/self.rate
+
+    def adjust(self, amount):
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+    def scale_rate(self, factor):
+        self.rate = min(self.configured_rate, max(self.configured_rate*MIN_RATE_FACTOR, self.rate*factor))
+
+    def restore_rate(self):
+        self.rate = min(self.configured_rate, self.rate + self.configured_rate*SUCCESS_INCREASE_FACTOR)
+
+
+class ModelRateLimiter:
+
+    def __init__(self, model_id, requests_per_minute, tokens_per_minute):
+        self.model_id = model_id
+        self.lock = threading.Lock()
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.stats = collections.Counter()
+        self.queue_depth = 0
+
+    def acquire(self, estimated_tokens):
+        with self.lock:
+            now = time.monotonic()
+            wait_time = max(self.requests.wait_time(1, now), self.tokens.wait_time(estimated_tokens, now))
+            if wait_time > RATE_LIMIT_MAX_WAIT:
+                self.stats['rejected'] += 1
+                raise RateLimitExceeded('ThrottlingException: queue wait of {:.1f}s over limit for model: {}'.format(wait_time, self.model_id))
+
+            wait_time = max(self.requests.reserve(1, now), self.tokens.reserve(estimated_tokens, now))
+            self.stats['requests'] += 1
+            if wait_time > 0:
+                self.queue_depth += 1
+                self.stats['queued'] += 1
+                self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], self.queue_depth)
+
+        if wait_time > 0:
+            logger.info('Rate limiter queued request for {:.2f}s, model: {}, queue depth: {}'.format(wait_time, self.model_id, self.queue_depth))
+            time.sleep(wait_time)
+            with self.lock:
+                self.queue_depth -= 1
+                self.stats['total_wait_ms'] += int(wait_time*1000)
+                self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], int(wait_time*1000))
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        # Settle the token bucket once the real token count is known
+        with self.lock:
+            self.tokens.adjust(actual_tokens - min(estimated_tokens, self.tokens.capacity))
+
+    def record_success(self):
+        with self.lock:
+            self.requests.restore_rate()
+            self.tokens.restore_rate()
+
+    def record_retry(self, throttled):
+        with self.lock:
+            self.stats['retries'] += 1
+            if throttled:
+                self.stats['throttles'] += 1
+                self.requests.scale_rate(THROTTLE_DECREASE_FACTOR)
+                self.tokens.scale_rate(THROTTLE_DECREASE_FACTOR)
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['queue_depth'] = self.queue_depth
+            stats['requests_per_minute'] = round(self.requests.rate*60, 1)
+            stats['tokens_per_minute'] = round(self.tokens.rate*60, 1)
+            stats['avg_wait_ms'] = int(stats.get('total_wait_ms', 0)/stats['queued']) if stats.get('queued') else 0
+            return stats
+
+
+def load_model_quotas():
+    model_quotas = {}
+    with open(MODEL_QUOTAS, 'r') as quotas_file:
+        reader = csv.DictReader(quotas_file, skipinitialspace=True)
+        for row in reader:
+            if row['model_id'].startswith('#'):
+                continue
+            model_quotas[row['model_id']] = (float(row['requests_per_minute']), float(row['tokens_per_minute']))
+    return model_quotas
+
+MODEL_QUOTA_DATA = load_model_quotas()
+
+def find_model_quota(model_id):
+    # Longest matching prefix wins, so claude-v2:1 can differ from claude-v2
+    matches = [ key for key in MODEL_QUOTA_DATA if model_id.startswith(key) ]
+    if not matches:
+        return RATE_LIMIT_DEFAULT_RPM, RATE_LIMIT_DEFAULT_TPM
+    return MODEL_QUOTA_DATA[max(matches, key=len)]
+
+rate_limiters = {}
+rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(model_id):
+    with rate_limiters_lock:
+        rate_limiter = rate_limiters.get(model_id)
+        if rate_limiter is None:
+            requests_per_minute, tokens_per_minute = find_model_quota(model_id)
+            rate_limiter = ModelRateLimiter(model_id, requests_per_minute, tokens_per_minute)
+            rate_limiters[model_id] = rate_limiter
+        return rate_limiter
+
+def get_rate_limiter_stats():
+    with rate_limiters_lock:
+        current_limiters = list(rate_limiters.values())
+    return { rate_limiter.model_id: rate_limiter.get_stats() for rate_limiter in current_limiters }
+
+def get_error_code(error):
+    if isinstance(error, botocore.exceptions.ClientError):
+        return error.response.get('Error', {}).get('Code'), error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+    if isinstance(error, (botocore.exceptions.ConnectionError, botocore.exceptions.ReadTimeoutError)):
+        return 'ServiceUnavailableException', 503
+    return None, 0
+
+def is_retryable(error):
+    error_code, status_code = get_error_code(error)
+    return error_code in RETRYABLE_ERROR_CODES or status_code >= 500
+
+def get_backoff_delay(attempt):
+    # Full jitter keeps queued sessions from retrying in lockstep
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY*(2**attempt)))
+
+def call_with_retry(model_id, invoke_func, estimated_tokens):
+
+    # Returns the result of invoke_func, raises the last error once out of attempts or queue time.
+    # Retries stay on with RATE_LIMIT_ENABLED off, only the queueing for capacity is skipped.
+    rate_limiter = get_rate_limiter(model_id)
+    attempt = 0
+    while True:
+        if RATE_LIMIT_ENABLED:
+            rate_limiter.acquire(estimated_tokens)
+        try:
+            result = invoke_func()
+            rate_limiter.record_success()
+            return result
+        except Exception as e1:
+            if not is_retryable(e1) or attempt + 1 >= RETRY_MAX_ATTEMPTS:
+                raise
+
+            rate_limiter.record_retry(get_error_code(e1)[0] in THROTTLING_ERROR_CODES)
+            telemetry.record_retry()
+            delay = get_backoff_delay(attempt)
+            logger.warning('Retrying model: {} in {:.2f}s after error: {}'.format(model_id, delay, e1))
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,338 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Helper utility to cache model responses keyed by model and the request body sent to Bedrock.
+# Responses are kept in an in-memory LRU and in a SQLite file that several processes can share.
+# Caching is opt-in per call, pages pass use_cache=True to the model functions where a repeated answer is fine.
+import io
+import os
+import time
+import json
+import hashlib
+import inspect
+import sqlite3
+import logging
+import threading
+import collections
+import functools
+import contextlib
+from utils import telemetry
+
+logger = logging.getLogger('gen-ai-invoker')
+
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+RESPONSE_CACHE_DB = os.getenv('RESPONSE_CACHE_DB', '/tmp/gen-ai-response-cache.db')
+# Use DELETE journal mode when the db lives on a network file system, WAL needs shared memory
+RESPONSE_CACHE_JOURNAL_MODE = os.getenv('RESPONSE_CACHE_JOURNAL_MODE', 'WAL')
+RESPONSE_CACHE_TTL = (int)(os.getenv('RESPONSE_CACHE_TTL', '86400'))
+RESPONSE_CACHE_MEMORY_ENTRIES = (int)(os.getenv('RESPONSE_CACHE_MEMORY_ENTRIES', '512'))
+RESPONSE_CACHE_MAX_DB_BYTES = (int)(os.getenv('RESPONSE_CACHE_MAX_DB_BYTES', str(256*1024*1024)))
+
+# Check the total size of the db every few writes rather than on each one
+EVICTION_CHECK_INTERVAL = 20
+
+memory_cache = collections.OrderedDict()
+memory_cache_lock = threading.Lock()
+db_local = threading.local()
+db_init_lock = threading.Lock()
+db_initialized = False
+writes_since_eviction = 0
+# Whether the calls of the current thread opted in to the cache, and whether the last one was replayed from it
+request_local = threading.local()
+
+cache_stats = collections.Counter()
+
+
+def get_cache_stats():
+    return dict(cache_stats)
+
+def normalize_prompt(prompt_text):
+    return ' '.join(str(prompt_text).split())
+
+def make_cache_key(model_id, prompt_text, params):
+    key_source = json.dumps([model_id, normalize_prompt(prompt_text), params], sort_keys=True, default=str)
+    return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+def make_request_key(model_id, body, streaming=False):
+    # Streamed and plain responses of the same body are stored in different formats
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    digest = hashlib.sha256(json.dumps([model_id, streaming]).encode('utf-8'))
+    digest.update(body)
+    return digest.hexdigest()
+
+def get_db():
+    global db_initialized
+
+    conn = getattr(db_local, 'conn', None)
+    if conn is not None:
+        return conn
+
+    conn = sqlite3.connect(RESPONSE_CACHE_DB, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA busy_timeout=30000')
+    with db_init_lock:
+        if not db_initialized:
+            conn.execute(f'PRAGMA journal_mode={RESPONSE_CACHE_JOURNAL_MODE}')
+            conn.execute('CREATE TABLE IF NOT EXISTS responses ('
+                            'key TEXT PRIMARY KEY, model_id TEXT, response TEXT, '
+                            'size INTEGER, created REAL, last_access REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)')
+            db_initialized = True
+
+    db_local.conn = conn
+    return conn
+
+def memory_get(key):
+    with memory_cache_lock:
+        entry = memory_cache.get(key)
+        if entry is None:
+            return None
+
+        response, created = entry
+        if time.time() - created > RESPONSE_CACHE_TTL:
+            del memory_cache[key]
+            return None
+
+        memory_cache.move_to_end(key)
+        return response
+
+def memory_put(key, response, created):
+    with memory_cache_lock:
+        memory_cache[key] = (response, created)
+        memory_cache.move_to_end(key)
+        while len(memory_cache) > RESPONSE_CACHE_MEMORY_ENTRIES:
+            memory_cache.popitem(last=False)
+
+def disk_get(key):
+    now = time.time()
+    conn = get_db()
+    row = conn.execute('SELECT response, created FROM responses WHERE key = ?', (key,)).fetchone()
+    if row is None:
+        return None
+
+    response, created = row
+    if now - created > RESPONSE_CACHE_TTL:
+        conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+        return None
+
+    conn.execute('UPDATE responses SET last_access = ? WHERE key = ?', (now, key))
+    memory_put(key, response, created)
+    return response
+
+def disk_put(key, model_id, response, created):
+    global writes_since_eviction
+
+    conn = get_db()
+    conn.execute('INSERT OR REPLACE INTO responses (key, model_id, response, size, created, last_access) VALUES (?, ?, ?, ?, ?, ?)',
+                    (key, model_id, response, len(response.encode('utf-8')), created, created))
+
+    writes_since_eviction += 1
+    if writes_since_eviction >= EVICTION_CHECK_INTERVAL:
+        writes_since_eviction = 0
+        evict_disk_entries(conn)
+
+def evict_disk_entries(conn):
+    conn.execute('DELETE FROM responses WHERE created < ?', (time.time() - RESPONSE_CACHE_TTL,))
+
+    total_size = conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+    if total_size <= RESPONSE_CACHE_MAX_DB_BYTES:
+        return
+
+    # Drop least recently used entries until back under the limit
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rows = conn.execute('SELECT key, size FROM responses ORDER BY last_access').fetchall()
+        evict_keys = []
+        for key, size in rows:
+            if total_size <= RESPONSE_CACHE_MAX_DB_BYTES:
+                break
+            evict_keys.append((key,))
+            total_size -= size
+        conn.executemany('DELETE FROM responses WHERE key = ?', evict_keys)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+    cache_stats['evictions'] += len(evict_keys)
+    logger.info('Response cache evicted {} entries'.format(len(evict_keys)))
+
+def get(key):
+    response = memory_get(key)
+    if response is not None:
+        cache_stats['memory_hits'] += 1
+        return response
+
+    try:
+        response = disk_get(key)
+    except sqlite3.Error as e1:
+        logger.warning('Response cache lookup failed: {}'.format(e1))
+        response = None
+
+    if response is not None:
+        cache_stats['disk_hits'] += 1
+    else:
+        cache_stats['misses'] += 1
+    return response
+
+def put(key, model_id, response):
+    created = time.time()
+    memory_put(key, response, created)
+    try:
+        disk_put(key, model_id, response, created)
+    except sqlite3.Error as e1:
+        logger.warning('Response cache store failed: {}'.format(e1))
+    cache_stats['stores'] += 1
+
+def is_cacheable_response(response):
+    # Errors are returned as strings or exception objects by the model functions, never cache those
+    return isinstance(response, str) and response != '' and not response.startswith('Error')
+
+def is_error_token(token):
+    # Stream functions yield their errors as a token, possibly after part of the answer
+    return not isinstance(token, str) or token.startswith('Error')
+
+def get_generation_params(func, args, kwargs):
+    # Bind against the model function signature so default sampling params are part of the key
+    kwargs = { name: value for name, value in kwargs.items() if name != 'use_cache' }
+    bound = inspect.signature(func).bind(None, *args, **kwargs)
+    bound.apply_defaults()
+    params = dict(bound.arguments)
+    params.pop(next(iter(params)))
+    return params
+
+def is_caching_requests():
+    return getattr(request_local, 'enabled', False)
+
+@contextlib.contextmanager
+def caching_requests(enabled=True):
+    previous = is_caching_requests()
+    request_local.enabled = enabled
+    try:
+        yield
+    finally:
+        request_local.enabled = previous
+
+def set_replayed(replayed):
+    request_local.replayed = replayed
+
+def take_replayed():
+    # True once after a response was replayed from the cache, the cost of the call was paid when it was stored
+    replayed = getattr(request_local, 'replayed', False)
+    request_local.replayed = False
+    return replayed
+
+def replay_response(response):
+    return {
+        'body': io.BytesIO(response.encode('utf-8')),
+        'ResponseMetadata': { 'HTTPHeaders': { 'x-amzn-bedrock-input-token-count': '0', 'x-amzn-bedrock-output-token-count': '0' } }
+    }
+
+def cached_invoke(model_id, body, invoke_func):
+    """
+    Returns the Bedrock response for the request body, replayed from the cache when an identical
+    request was answered before, else from invoke_func whose response body is stored.
+    """
+    key = make_request_key(model_id, body)
+    response = get(key)
+    if response is not None:
+        telemetry.record_cache_status('hit')
+        logger.info('Response cache hit for model: {}'.format(model_id))
+        set_replayed(True)
+        return replay_response(response)
+
+    set_replayed(False)
+    response = invoke_func()
+    response_bytes = response['body'].read()
+    put(key, model_id, response_bytes.decode('utf-8'))
+    return dict(response, body=io.BytesIO(response_bytes))
+
+def strip_invocation_metrics(chunk_bytes):
+    # A replayed stream used no tokens, its cost and rate limiter usage were settled by the stored one
+    chunk_obj = json.loads(chunk_bytes)
+    chunk_obj.pop('amazon-bedrock-invocationMetrics', None)
+    return json.dumps(chunk_obj)
+
+def replay_events(chunks):
+    for chunk in chunks:
+        yield { 'chunk': { 'bytes': chunk.encode('utf-8') } }
+    set_replayed(True)
+
+def record_events(key, model_id, events):
+
+    # Stored once the stream completes, a stream that fails or that the caller stops reading is not
+    chunks = []
+    for event in events:
+        chunk = event.get('chunk')
+        if chunk is None:
+            chunks = None
+        elif chunks is not None:
+            chunks.append(strip_invocation_metrics(chunk['bytes']))
+        yield event
+
+    if chunks:
+        put(key, model_id, json.dumps(chunks))
+
+def cached_invoke_stream(model_id, body, invoke_func):
+    """
+    Streaming counterpart of cached_invoke, the chunk events of a cached response are replayed in order.
+    """
+    key = make_request_key(model_id, body, streaming=True)
+    response = get(key)
+    if response is not None:
+        telemetry.record_cache_status('hit')
+        logger.info('Response cache hit for streaming model: {}'.format(model_id))
+        return { 'body': replay_events(json.loads(response)) }
+
+    set_replayed(False)
+    response = invoke_func()
+    return dict(response, body=record_events(key, model_id, response['body']))
+
+def cached_model_func(model_id, func):
+
+    # Marks the calls that opted in, the Bedrock invocations made for them go through cached_invoke
+    @functools.wraps(func)
+    def cached_func(prompt_text, *args, use_cache=False, **kwargs):
+        enabled = RESPONSE_CACHE_ENABLED and use_cache
+        if not enabled:
+            cache_stats['bypassed'] += 1
+        with caching_requests(enabled):
+            return func(prompt_text, *args, **kwargs)
+
+    return cached_func
+
+def cached_model_stream(model_id, stream_func):
+
+    # The flag is only set while the stream runs, not while the caller holds it between tokens
+    @functools.wraps(stream_func)
+    def cached_stream(prompt_text, *args, use_cache=False, **kwargs):
+        enabled = RESPONSE_CACHE_ENABLED and use_cache
+        if not enabled:
+            cache_stats['bypassed'] += 1
+        stream = stream_func(prompt_text, *args, **kwargs)
+        try:
+            while True:
+                with caching_requests(enabled):
+                    token = next(stream, None)
+                if token is None:
+                    return
+                yield token
+        finally:
+            stream.close()
+
+    return cached_stream
@@ -0,0 +1,202 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Helper utility to answer questions about documents longer than the context window of a model. A document is
+# split into chunks indexed once with BM25 and, when available, Titan embeddings from the shared embedding store.
+# A question gets the chunks most relevant to it, packed into the token budget of the model in document order.
+import os
+import re
+import math
+import logging
+import threading
+import collections
+import numpy as np
+from utils import gen_ai_selector
+from utils import token_counter
+from utils import summarizer
+from utils import embedding_store
+
+logger = logging.getLogger('gen-ai-invoker')
+
+RETRIEVAL_INDEX_ENABLED = os.getenv('RETRIEVAL_INDEX_ENABLED', 'true').lower() == 'true'
+# Without embeddings the chunks are ranked with BM25 only
+RETRIEVAL_EMBEDDINGS_ENABLED = os.getenv('RETRIEVAL_EMBEDDINGS_ENABLED', 'true').lower() == 'true'
+RETRIEVAL_CHUNK_TOKENS = (int)(os.getenv('RETRIEVAL_CHUNK_TOKENS', '400'))
+# Chunks considered for a question, the ones that fit the budget of the model are used
+RETRIEVAL_TOP_K = (int)(os.getenv('RETRIEVAL_TOP_K', '24'))
+# Indexed documents kept in memory across the sessions
+RETRIEVAL_INDEX_ENTRIES = (int)(os.getenv('RETRIEVAL_INDEX_ENTRIES', '16'))
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Rank constant of the reciprocal rank fusion of the BM25 and embedding rankings
+FUSION_RANK_CONSTANT = 60
+CHUNK_SEPARATOR = '\n...\n'
+
+TERM_PATTERN = re.compile(r'\w+')
+
+index_stats = collections.Counter()
+document_indexes = collections.OrderedDict()
+document_indexes_lock = threading.Lock()
+
+
+def get_index_stats():
+    return dict(index_stats)
+
+def tokenize(text):
+    return TERM_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Okapi BM25 over the chunks of a document, postings are NumPy arrays of chunk positions and term counts.
+    """
+
+    def __init__(self, chunks):
+        chunk_terms = [ collections.Counter(tokenize(chunk)) for chunk in chunks ]
+        self.lengths = np.array([ sum(terms.values()) for terms in chunk_terms ], dtype=np.float32)
+        average_length = float(self.lengths.mean()) if len(chunks) else 0.0
+        self.length_norms = BM25_K1*(1 - BM25_B + BM25_B*self.lengths/max(average_length, 1.0))
+
+        postings = collections.defaultdict(lambda: ([], []))
+        for position, terms in enumerate(chunk_terms):
+            for term, count in terms.items():
+                positions, counts = postings[term]
+                positions.append(position)
+                counts.append(count)
+        self.postings = { term: (np.array(positions, dtype=np.int64), np.array(counts, dtype=np.float32)) for term, (positions, counts) in postings.items() }
+        self.chunk_count = len(chunks)
+
+    def scores(self, query):
+        scores = np.zeros(self.chunk_count, dtype=np.float32)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            positions, counts = posting
+            idf = math.log(1 + (self.chunk_count - len(positions) + 0.5)/(len(positions) + 0.5))
+            scores[positions] += idf*counts*(BM25_K1 + 1)/(counts + self.length_norms[positions])
+        return scores
+
+    def rank(self, query, k):
+        scores = self.scores(query)
+        matching = np.flatnonzero(scores > 0)
+        return list(matching[np.argsort(-scores[matching], kind='stable')][:k])
+
+
+class DocumentIndex:
+
+    def __init__(self, text):
+        self.chunks = summarizer.split_into_chunks(text, gen_ai_selector.TITAN_EMBEDDING_MODEL_ID, RETRIEVAL_CHUNK_TOKENS)
+        self.bm25 = BM25Index(self.chunks)
+        self.keys = None
+        if RETRIEVAL_EMBEDDINGS_ENABLED and self.chunks:
+            self.embed_chunks()
+        logger.info('Indexed document of {} chars in {} chunks, embeddings: {}'.format(len(text), len(self.chunks), self.keys is not None))
+
+    def embed_chunks(self):
+        try:
+            vectors = gen_ai_selector.embed_texts(self.chunks)
+        except Exception as e1:
+            logger.exception(e1)
+            return
+        # Chunks that failed to embed are still found by BM25
+        embedded = np.flatnonzero(np.abs(vectors).sum(axis=1) > 0) if vectors.size else []
+        if len(embedded):
+            self.keys = [ embedding_store.content_key(chunk) for chunk in self.chunks ]
+            self.key_positions = { key: position for position, key in enumerate(self.keys) }
+        index_stats['embedded_chunks'] += len(embedded)
+
+    def embedding_rank(self, query, k):
+        try:
+            matches = gen_ai_selector.search_embeddings(query, k, self.keys)
+        except Exception as e1:
+            logger.exception(e1)
+            return []
+        return [ self.key_positions[key] for key, similarity in matches ]
+
+    def rank(self, query, k=RETRIEVAL_TOP_K):
+        """
+        Chunk positions most relevant to the query, best first. Rankings of BM25 and of the embeddings are
+        merged with reciprocal rank fusion, so exact figures and names count as much as paraphrases.
+        """
+        rankings = [ self.bm25.rank(query, k) ]
+        if self.keys is not None:
+            rankings.append(self.embedding_rank(query, k))
+
+        fused_scores = collections.defaultdict(float)
+        for ranking in rankings:
+            for rank, position in enumerate(ranking):
+                fused_scores[int(position)] += 1.0/(FUSION_RANK_CONSTANT + rank + 1)
+        return sorted(fused_scores, key=lambda position: (-fused_scores[position], position))[:k]
+
+
+def get_document_index(text):
+    """
+    Index of the document text, built on first use and shared by the sessions asking about the same text.
+    """
+    key = embedding_store.content_key(text)
+    with document_indexes_lock:
+        index = document_indexes.get(key)
+        if index is not None:
+            document_indexes.move_to_end(key)
+            index_stats['hits'] += 1
+            return index
+
+    # Built outside the lock, two sessions indexing the same new document at once both build it
+    index_stats['builds'] += 1
+    index = DocumentIndex(text)
+    with document_indexes_lock:
+        document_indexes[key] = index
+        document_indexes.move_to_end(key)
+        while len(document_indexes) > RETRIEVAL_INDEX_ENTRIES:
+            document_indexes.popitem(last=False)
+    return index
+
+def get_relevant_context(text, query, model, other_text=''):
+    """
+    The part of the document text to send with a question to the model entry: the whole text when it fits
+    the prompt budget next to other_text (the instruction and question), else the chunks most relevant to
+    the question that fit, in document order.
+    """
+    model_id = model['model_id']
+    budget = token_counter.get_prompt_budget(model) - token_counter.count_tokens(other_text, model_id)
+    if not RETRIEVAL_INDEX_ENABLED or token_counter.count_tokens(text, model_id) <= budget:
+        return text
+
+    index = get_document_index(text)
+    ranked_positions = index.rank(query)
+
+    chunk_tokens = token_counter.count_tokens_batch([ index.chunks[position] for position in ranked_positions ], model_id)
+    separator_tokens = token_counter.count_tokens(CHUNK_SEPARATOR, model_id)
+    selected = []
+    used_tokens = 0
+    for position, tokens in zip(ranked_positions, chunk_tokens):
+        if used_tokens + int(tokens) + separator_tokens > budget:
+            continue
+        selected.append(position)
+        used_tokens += int(tokens) + separator_tokens
+
+    if not selected:
+        # Nothing matched the question, the beginning of the document is the best guess
+        index_stats['no_match'] += 1
+        return text
+
+    index_stats['retrievals'] += 1
+    logger.info('Retrieved {} of {} chunks, {} tokens, for model: {}'.format(len(selected), len(index.chunks), used_tokens, model_id))
+    return CHUNK_SEPARATOR.join(index.chunks[position] for position in sorted(selected))
@@ -0,0 +1,173 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Helper utility to list the sample files of the demos. Only the prefix of a demo is listed, and the listing is
+# shared by all sessions: it is served from memory and refreshed in a background thread once older than the TTL.
+# With an SQS queue receiving the S3 event notifications of the bucket, new and deleted samples show up right away.
+import os
+import json
+import time
+import logging
+import mimetypes
+import threading
+import collections
+import urllib.parse
+from utils import aws_session_helper
+
+logger = logging.getLogger('gen-ai-invoker')
+
+SAMPLE_CATALOG_TTL = (int)(os.getenv('SAMPLE_CATALOG_TTL', '300'))
+# Queue subscribed to the ObjectCreated and ObjectRemoved notifications of the bucket, directly or through SNS
+SAMPLE_CATALOG_EVENTS_QUEUE_URL = os.getenv('SAMPLE_CATALOG_EVENTS_QUEUE_URL')
+
+EVENTS_WAIT_SECONDS = 20
+
+SampleEntry = collections.namedtuple('SampleEntry', [ 'key', 'name', 'size', 'etag', 'last_modified', 'media_type' ])
+
+s3 = aws_session_helper.get_client('s3', assume_role=False)
+
+# (bucket, prefix) to { 'entries': { key: SampleEntry }, 'listed': time, 'refreshing': bool, 'ready': Event set after the first listing }
+catalogs = {}
+catalogs_lock = threading.Lock()
+events_thread = None
+
+catalog_stats = collections.Counter()
+
+
+def get_catalog_stats():
+    return dict(catalog_stats)
+
+def make_entry(key, prefix, size, etag, last_modified):
+    # Samples are the files right under the prefix, folder markers and nested keys are not listed
+    name = key[len(prefix):]
+    if not key.startswith(prefix) or name == '' or '/' in name:
+        return None
+    media_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    return SampleEntry(key, name, size, etag, last_modified, media_type)
+
+def list_prefix(bucket, prefix):
+    entries = {}
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for content in page.get('Contents', []):
+            entry = make_entry(content['Key'], prefix, content['Size'], content['ETag'], str(content['LastModified']))
+            if entry is not None:
+                entries[entry.key] = entry
+    catalog_stats['listings'] += 1
+    return entries
+
+def refresh_catalog(bucket, prefix):
+    start_time = time.time()
+    try:
+        entries = list_prefix(bucket, prefix)
+    except Exception as e1:
+        logger.warning('Sample catalog listing of s3://{}/{} failed, keeping previous entries: {}'.format(bucket, prefix, e1))
+        entries = None
+
+    with catalogs_lock:
+        catalog = catalogs[(bucket, prefix)]
+        if entries is not None:
+            catalog['entries'] = entries
+            catalog['listed'] = time.time()
+        catalog['refreshing'] = False
+    catalog['ready'].set()
+    if entries is not None:
+        logger.info('Listed {} samples of s3://{}/{} in {:.3f}s'.format(len(entries), bucket, prefix, time.time() - start_time))
+
+def list_samples(bucket, prefix):
+    """
+    Sample files right under the prefix of the bucket, as SampleEntry tuples sorted by key. The first
+    call for a prefix lists it, later calls get the shared listing and refresh it in the background
+    once it is older than SAMPLE_CATALOG_TTL.
+    """
+    start_event_listener()
+    with catalogs_lock:
+        catalog = catalogs.get((bucket, prefix))
+        if catalog is None:
+            catalog = { 'entries': {}, 'listed': 0, 'refreshing': True, 'ready': threading.Event() }
+            catalogs[(bucket, prefix)] = catalog
+            first_listing = True
+        else:
+            first_listing = False
+            if not catalog['refreshing'] and time.time() - catalog['listed'] > SAMPLE_CATALOG_TTL:
+                catalog['refreshing'] = True
+                threading.Thread(target=refresh_catalog, args=(bucket, prefix), name='sample-catalog-refresh', daemon=True).start()
+
+    if first_listing:
+        refresh_catalog(bucket, prefix)
+    else:
+        # Sessions arriving during the first listing wait for it
+        catalog['ready'].wait()
+        catalog_stats['hits'] += 1
+
+    with catalogs_lock:
+        entries = catalogs[(bucket, prefix)]['entries']
+        return [ entries[key] for key in sorted(entries) ]
+
+
+def get_event_records(message_body):
+    body = json.loads(message_body)
+    # Notifications published through SNS are wrapped in its envelope
+    if 'Message' in body and 'Records' not in body:
+        body = json.loads(body['Message'])
+    return body.get('Records', [])
+
+def apply_event_record(record):
+    event_name = record.get('eventName', '')
+    bucket = record['s3']['bucket']['name']
+    s3_object = record['s3']['object']
+    key = urllib.parse.unquote_plus(s3_object['key'])
+
+    with catalogs_lock:
+        for (catalog_bucket, prefix), catalog in catalogs.items():
+            if catalog_bucket != bucket or not key.startswith(prefix):
+                continue
+            if event_name.startswith('ObjectCreated'):
+                entry = make_entry(key, prefix, s3_object.get('size', 0), '"{}"'.format(s3_object.get('eTag', '')), record.get('eventTime', ''))
+                if entry is not None:
+                    catalog['entries'][key] = entry
+            elif event_name.startswith('ObjectRemoved'):
+                catalog['entries'].pop(key, None)
+    catalog_stats['events'] += 1
+
+def listen_for_events(queue_url):
+    sqs = aws_session_helper.get_client('sqs', assume_role=False)
+    while True:
+        try:
+            response = sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10, WaitTimeSeconds=EVENTS_WAIT_SECONDS)
+            for message in response.get('Messages', []):
+                try:
+                    for record in get_event_records(message['Body']):
+                        apply_event_record(record)
+                except (ValueError, KeyError) as e1:
+                    logger.warning('Ignoring sample catalog event: {}'.format(e1))
+                sqs.delete_message(QueueUrl=queue_url, ReceiptHandle=message['ReceiptHandle'])
+        except Exception as e1:
+            logger.warning('Sample catalog event polling failed: {}'.format(e1))
+            time.sleep(EVENTS_WAIT_SECONDS)
+
+def start_event_listener():
+    global events_thread
+
+    if SAMPLE_CATALOG_EVENTS_QUEUE_URL is None or events_thread is not None:
+        return
+    with catalogs_lock:
+        if events_thread is None:
+            events_thread = threading.Thread(target=listen_for_events, args=(SAMPLE_CATALOG_EVENTS_QUEUE_URL,), name='sample-catalog-events', daemon=True)
+            events_thread.start()
+            logger.info('Listening for sample catalog events on: {}'.format(SAMPLE_CATALOG_EVENTS_QUEUE_URL))
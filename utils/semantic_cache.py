@@ -0,0 +1,212 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Helper utility to answer near-duplicate user prompts from earlier completions.
+# Prompts are embedded and compared by cosine similarity against a bounded NumPy matrix per model.
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+import collections
+import functools
+import numpy as np
+from utils import response_cache
+from utils import telemetry
+
+logger = logging.getLogger('gen-ai-invoker')
+
+# Off by default: short templated prompts that differ only in a small subject embed above the threshold
+# and would get the answer for another subject
+SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true'
+SEMANTIC_CACHE_THRESHOLD = (float)(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.95'))
+SEMANTIC_CACHE_MAX_ENTRIES = (int)(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', '1000'))
+# Long prompts carry document context that dominates the embedding, only short questions are matched
+SEMANTIC_CACHE_MAX_PROMPT_CHARS = (int)(os.getenv('SEMANTIC_CACHE_MAX_PROMPT_CHARS', '500'))
+# 'titan' for Bedrock Titan embeddings, 'local' for the deterministic hashing embedding
+SEMANTIC_CACHE_EMBEDDING = os.getenv('SEMANTIC_CACHE_EMBEDDING', 'titan')
+
+LOCAL_EMBEDDING_DIMENSION = 512
+INITIAL_CAPACITY = 64
+
+cache_stats = collections.Counter()
+
+
+def get_cache_stats():
+    return dict(cache_stats)
+
+def local_embedding(text, dimension=LOCAL_EMBEDDING_DIMENSION):
+
+    # Deterministic stand-in for Titan embeddings: signed feature hashing of words and character trigrams
+    vector = np.zeros(dimension, dtype=np.float32)
+    words = re.findall(r'\w+', str(text).lower())
+    features = words + [word[i:i+3] for word in words for i in range(max(len(word) - 2, 1))]
+    for feature in features:
+        digest = hashlib.md5(feature.encode('utf-8')).digest()
+        index = int.from_bytes(digest[:4], 'little') % dimension
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+
+    return vector
+
+
+class SemanticCache:
+
+    def __init__(self, capacity=SEMANTIC_CACHE_MAX_ENTRIES, threshold=SEMANTIC_CACHE_THRESHOLD):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.vectors = None
+        self.last_used = np.zeros(0, dtype=np.int64)
+        self.responses = []
+        self.clock = 0
+
+    def lookup(self, vector):
+        with self.lock:
+            if not self.responses:
+                return None
+
+            # Rows are unit length, so the dot product is the cosine similarity
+            similarities = self.vectors[:len(self.responses)] @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+
+            self.clock += 1
+            self.last_used[best] = self.clock
+            return self.responses[best]
+
+    def add(self, vector, response):
+        with self.lock:
+            self.clock += 1
+            size = len(self.responses)
+            if self.vectors is None:
+                self.vectors = np.zeros((min(INITIAL_CAPACITY, self.capacity), vector.shape[0]), dtype=np.float32)
+                self.last_used = np.zeros(self.vectors.shape[0], dtype=np.int64)
+
+            if size < self.vectors.shape[0]:
+                row = size
+                self.responses.append(response)
+            elif size < self.capacity:
+                new_rows = min(self.vectors.shape[0]*2, self.capacity)
+                self.vectors = np.resize(self.vectors, (new_rows, self.vectors.shape[1]))
+                self.last_used = np.resize(self.last_used, new_rows)
+                row = size
+                self.responses.append(response)
+            else:
+                # Full, replace the least recently used entry
+                row = int(np.argmin(self.last_used))
+                self.responses[row] = response
+                cache_stats['evictions'] += 1
+
+            self.vectors[row] = vector
+            self.last_used[row] = self.clock
+
+
+semantic_caches = {}
+semantic_caches_lock = threading.Lock()
+
+def get_semantic_cache(scope):
+    with semantic_caches_lock:
+        cache = semantic_caches.get(scope)
+        if cache is None:
+            cache = SemanticCache()
+            semantic_caches[scope] = cache
+        return cache
+
+def embed_prompt(embed_func, prompt_text):
+    embedding = local_embedding(prompt_text) if embed_func is None else embed_func(prompt_text)
+    if isinstance(embedding, str) or isinstance(embedding, Exception):
+        logger.warning('Semantic cache could not embed prompt: {}'.format(embedding))
+        return None
+
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        return None
+    return vector / norm
+
+def is_semantic_candidate(prompt_text, user_generated_prompt):
+    return SEMANTIC_CACHE_ENABLED and user_generated_prompt and len(prompt_text) <= SEMANTIC_CACHE_MAX_PROMPT_CHARS
+
+def get_scope(model_id, params):
+    return model_id + ':' + json.dumps(params, sort_keys=True, default=str)
+
+def lookup_prompt(model_id, params, prompt_text, embed_func):
+    cache = get_semantic_cache(get_scope(model_id, params))
+    vector = embed_prompt(embed_func, prompt_text)
+    if vector is None:
+        return cache, None, None
+
+    response = cache.lookup(vector)
+    if response is not None:
+        cache_stats['hits'] += 1
+        telemetry.record_cache_status('semantic_hit')
+        logger.info('Semantic cache hit for model: {}'.format(model_id))
+    else:
+        cache_stats['misses'] += 1
+    return cache, vector, response
+
+# The wrapped functions are the exact-match cached functions from response_cache, use_cache is passed through to them.
+# Like the exact-match cache, only calls passing use_cache=True are looked up.
+
+def semantic_cached_model_func(model_id, func, embed_func, is_user_generated):
+
+    @functools.wraps(func)
+    def semantic_cached_func(prompt_text, *args, use_cache=False, **kwargs):
+        if not (use_cache and is_semantic_candidate(prompt_text, is_user_generated(prompt_text))):
+            return func(prompt_text, *args, use_cache=use_cache, **kwargs)
+
+        params = response_cache.get_generation_params(func, args, kwargs)
+        cache, vector, response = lookup_prompt(model_id, params, prompt_text, embed_func)
+        if response is not None:
+            return response
+
+        response = func(prompt_text, *args, use_cache=use_cache, **kwargs)
+        if vector is not None and response_cache.is_cacheable_response(response):
+            cache.add(vector, response)
+        return response
+
+    return semantic_cached_func
+
+def semantic_cached_model_stream(model_id, stream_func, embed_func, is_user_generated):
+
+    @functools.wraps(stream_func)
+    def semantic_cached_stream(prompt_text, *args, use_cache=False, **kwargs):
+        if not (use_cache and is_semantic_candidate(prompt_text, is_user_generated(prompt_text))):
+            yield from stream_func(prompt_text, *args, use_cache=use_cache, **kwargs)
+            return
+
+        params = response_cache.get_generation_params(stream_func, args, kwargs)
+        cache, vector, response = lookup_prompt(model_id, params, prompt_text, embed_func)
+        if response is not None:
+            yield response
+            return
+
+        tokens = []
+        failed = False
+        for token in stream_func(prompt_text, *args, use_cache=use_cache, **kwargs):
+            failed = failed or response_cache.is_error_token(token)
+            tokens.append(token)
+            yield token
+
+        response = ''.join(tokens)
+        if vector is not None and not failed and response != '':
+            cache.add(vector, response)
+
+    return semantic_cached_stream
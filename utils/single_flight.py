@@ -0,0 +1,177 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Helper utility to coalesce identical concurrent model invocations across streamlit sessions.
+# Calls with the same model, prompt and generation parameters that overlap in time share one in-flight
+# invocation, and every caller gets its result (or its tokens, for streaming calls).
+import os
+import logging
+import threading
+import collections
+import functools
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from utils import response_cache
+from utils import telemetry
+
+logger = logging.getLogger('gen-ai-invoker')
+
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true'
+
+flight_stats = collections.Counter()
+
+
+class Flight:
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.tokens = []
+        self.response = None
+        self.error = None
+        self.finished = False
+
+    def publish(self, token):
+        with self.condition:
+            self.tokens.append(token)
+            self.condition.notify_all()
+
+    def finish(self, response=None, error=None):
+        with self.condition:
+            self.response = response
+            self.error = error
+            self.finished = True
+            self.condition.notify_all()
+
+    def result(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.finished)
+        if self.error is not None:
+            raise self.error
+        return self.response if self.response is not None else ''.join(self.tokens)
+
+    def follow(self):
+        # Replays the tokens published so far, then waits for new ones until the flight finishes
+        index = 0
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: index < len(self.tokens) or self.finished)
+                new_tokens = self.tokens[index:]
+                finished = self.finished
+            index += len(new_tokens)
+            yield from new_tokens
+
+            if finished:
+                if self.error is not None:
+                    raise self.error
+                if index == 0 and self.response is not None:
+                    yield str(self.response)
+                return
+
+
+in_flight = {}
+in_flight_lock = threading.Lock()
+
+def get_flight_stats():
+    stats = dict(flight_stats)
+    stats['in_flight'] = len(in_flight)
+    return stats
+
+def join_flight(key):
+    # Returns the flight for the key and whether the caller has to run the invocation
+    with in_flight_lock:
+        flight = in_flight.get(key)
+        if flight is not None:
+            flight_stats['coalesced'] += 1
+            return flight, False
+
+        flight = Flight()
+        in_flight[key] = flight
+        flight_stats['invocations'] += 1
+        return flight, True
+
+def land_flight(key):
+    with in_flight_lock:
+        in_flight.pop(key, None)
+
+def coalesced_model_func(model_id, func):
+
+    @functools.wraps(func)
+    def coalesced_func(prompt_text, *args, **kwargs):
+        if not SINGLE_FLIGHT_ENABLED:
+            return func(prompt_text, *args, **kwargs)
+
+        key = response_cache.make_cache_key(model_id, prompt_text, response_cache.get_generation_params(func, args, kwargs))
+        flight, leader = join_flight(key)
+        if not leader:
+            telemetry.record_cache_status('coalesced')
+            logger.info('Coalesced call with in-flight invocation of model: {}'.format(model_id))
+            return flight.result()
+
+        # BaseException as well, a stopped streamlit script must not leave the other callers waiting
+        try:
+            response = func(prompt_text, *args, **kwargs)
+        except BaseException as e1:
+            land_flight(key)
+            flight.finish(error=e1)
+            raise
+
+        land_flight(key)
+        flight.finish(response=response)
+        return response
+
+    return coalesced_func
+
+def run_stream_flight(key, flight, stream_func, prompt_text, args, kwargs, parent_span, cost_entries, caching):
+    try:
+        with telemetry.use_span(parent_span), telemetry.use_cost_entries(cost_entries), response_cache.caching_requests(caching):
+            for token in stream_func(prompt_text, *args, **kwargs):
+                flight.publish(token)
+    except Exception as e1:
+        logger.exception(e1)
+        land_flight(key)
+        flight.finish(error=e1)
+        return
+
+    land_flight(key)
+    flight.finish()
+
+def coalesced_model_stream(model_id, stream_func):
+
+    # The stream runs on its own thread so a session that stops reading does not cut it short for the others
+    @functools.wraps(stream_func)
+    def coalesced_stream(prompt_text, *args, **kwargs):
+        if not SINGLE_FLIGHT_ENABLED:
+            yield from stream_func(prompt_text, *args, **kwargs)
+            return
+
+        key = response_cache.make_cache_key(model_id, prompt_text, response_cache.get_generation_params(stream_func, args, kwargs))
+        flight, leader = join_flight(key)
+        if leader:
+            # Carries the streamlit context, cost collector and cache opt-in of the first caller, who is charged for the invocation
+            stream_thread = threading.Thread(target=run_stream_flight, args=(key, flight, stream_func, prompt_text, args, kwargs,
+                                                                             telemetry.get_current_span(), telemetry.get_cost_entries(),
+                                                                             response_cache.is_caching_requests()),
+                                             name='single-flight-stream', daemon=True)
+            add_script_run_ctx(stream_thread, get_script_run_ctx())
+            stream_thread.start()
+        else:
+            telemetry.record_cache_status('coalesced')
+            logger.info('Coalesced streaming call with in-flight invocation of model: {}'.format(model_id))
+
+        yield from flight.follow()
+
+    return coalesced_stream
@@ -0,0 +1,218 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Helper utility for the request and response logs of the model invocations. Records are sampled per page,
+# model and level before anything is formatted, and prompt and response bodies are passed as lazy fields that
+# are redacted and truncated or hashed only when a handler actually emits the record.
+import os
+import re
+import json
+import random
+import hashlib
+import logging
+import reprlib
+import collections
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+logger = logging.getLogger('gen-ai-invoker')
+
+# How bodies are written: truncate (default), hash, full or off (length only)
+LOG_PAYLOAD_MODE = os.getenv('LOG_PAYLOAD_MODE', 'truncate').lower()
+LOG_PAYLOAD_MAX_CHARS = (int)(os.getenv('LOG_PAYLOAD_MAX_CHARS', '256'))
+LOG_SAMPLE_RATE = (float)(os.getenv('LOG_SAMPLE_RATE', '1.0'))
+# Overrides of the sample rate, model first, then page, then level, for example:
+# model:ai21.j2-ultra-v1=0,page:GenAI_content_analyzer=0.1,level:DEBUG=0.01
+LOG_SAMPLE_RATES = os.getenv('LOG_SAMPLE_RATES', '')
+# Regular expressions replaced in the written bodies, separated by ;;
+LOG_REDACT_PATTERNS = os.getenv('LOG_REDACT_PATTERNS', '')
+LOG_FORMAT_JSON = os.getenv('LOG_FORMAT_JSON', 'false').lower() == 'true'
+
+REDACTED = '[REDACTED]'
+
+logging_stats = collections.Counter()
+
+# Bounded repr for dict and list payloads, so a truncated body never serializes the full structure
+payload_repr = reprlib.Repr()
+payload_repr.maxstring = LOG_PAYLOAD_MAX_CHARS
+payload_repr.maxother = LOG_PAYLOAD_MAX_CHARS
+payload_repr.maxlevel = 4
+payload_repr.maxdict = 8
+payload_repr.maxlist = 8
+
+
+def parse_sample_rates(sample_rates):
+    rates = {}
+    for entry in sample_rates.split(','):
+        if '=' not in entry:
+            continue
+        scope, rate = entry.rsplit('=', 1)
+        try:
+            rates[scope.strip()] = float(rate)
+        except ValueError:
+            logger.warning('Ignoring log sample rate: {}'.format(entry))
+    return rates
+
+def compile_redact_patterns(patterns):
+    return [ re.compile(pattern) for pattern in patterns.split(';;') if pattern ]
+
+sample_rates = parse_sample_rates(LOG_SAMPLE_RATES)
+redact_patterns = compile_redact_patterns(LOG_REDACT_PATTERNS)
+redactor = None
+
+
+def get_logging_stats():
+    return dict(logging_stats)
+
+def set_sample_rate(scope, rate):
+    """
+    Sets the sample rate of a scope at runtime, scope is 'model:<model id>', 'page:<page name>' or
+    'level:<level name>'. A rate of None removes the override.
+    """
+    if rate is None:
+        sample_rates.pop(scope, None)
+    else:
+        sample_rates[scope] = rate
+
+def set_redactor(func):
+    """
+    Registers a function taking and returning the text of a body, applied before the body is written
+    after the LOG_REDACT_PATTERNS replacements. None removes it.
+    """
+    global redactor
+    redactor = func
+
+def redact(text):
+    for pattern in redact_patterns:
+        text = pattern.sub(REDACTED, text)
+    if redactor is not None:
+        text = redactor(text)
+    return text
+
+def get_page_name():
+    # Best effort, the pages manager differs across streamlit versions and is absent outside a script run
+    ctx = get_script_run_ctx(suppress_warning=True)
+    if ctx is None:
+        return ''
+    try:
+        page = ctx.pages_manager.get_pages().get(ctx.pages_manager.current_page_script_hash, {})
+        return page.get('page_name', '')
+    except Exception:
+        return ''
+
+def get_sample_rate(level, model_id, page_name):
+    if not sample_rates:
+        return LOG_SAMPLE_RATE
+    for scope in ( 'model:' + str(model_id), 'page:' + page_name, 'level:' + logging.getLevelName(level) ):
+        if scope in sample_rates:
+            return sample_rates[scope]
+    return LOG_SAMPLE_RATE
+
+def is_sampled(level, model_id, page_name):
+    rate = get_sample_rate(level, model_id, page_name)
+    return rate >= 1.0 or random.random() < rate
+
+
+def format_payload(value):
+    if isinstance(value, (bytes, bytearray)):
+        # Response bodies are decoded only as far as they are written
+        length = len(value)
+        value = value[:LOG_PAYLOAD_MAX_CHARS*4].decode('utf-8', errors='replace') if LOG_PAYLOAD_MODE == 'truncate' else value.decode('utf-8', errors='replace')
+    elif isinstance(value, str):
+        length = len(value)
+    else:
+        length = None
+
+    if LOG_PAYLOAD_MODE == 'off':
+        return '<{} chars>'.format(length if length is not None else len(str(value)))
+
+    if LOG_PAYLOAD_MODE == 'hash':
+        text = value if isinstance(value, str) else json.dumps(value, sort_keys=True, default=str)
+        return 'sha256:{} ({} chars)'.format(hashlib.sha256(text.encode('utf-8')).hexdigest()[:16], len(text))
+
+    if LOG_PAYLOAD_MODE == 'full':
+        return redact(value if isinstance(value, str) else json.dumps(value, default=str))
+
+    # Only the head of the body is redacted, with a margin so a match is not cut at the end of the written text
+    text = value if isinstance(value, str) else payload_repr.repr(value)
+    if len(text) <= LOG_PAYLOAD_MAX_CHARS:
+        return redact(text)
+    head = redact(text[:LOG_PAYLOAD_MAX_CHARS*2])[:LOG_PAYLOAD_MAX_CHARS]
+    return '{}... (+{} chars)'.format(head, (length or len(text)) - LOG_PAYLOAD_MAX_CHARS)
+
+
+class Payload:
+    """
+    A prompt or response body formatted only when the log record is written.
+    """
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return format_payload(self.value)
+
+
+class StructuredMessage:
+    """
+    Message of a structured record, rendered as 'event key=value ...' or as one json object.
+    """
+
+    __slots__ = ('event', 'fields')
+
+    def __init__(self, event, fields):
+        self.event = event
+        self.fields = fields
+
+    def __str__(self):
+        if LOG_FORMAT_JSON:
+            record = { 'event': self.event }
+            record.update({ name: str(value) if isinstance(value, Payload) else value for name, value in self.fields.items() })
+            return json.dumps(record, default=str)
+        return self.event + ''.join(' {}={}'.format(name, value) for name, value in self.fields.items())
+
+
+def log_event(level, event, model_id=None, payloads={}, stacklevel=2, **fields):
+    """
+    Logs a structured record about a model invocation. payloads are the request or response bodies,
+    written according to LOG_PAYLOAD_MODE, fields are small values written as they are. Nothing is
+    formatted when the level is disabled or the record is not sampled. stacklevel is passed to the
+    logger, wrappers add one per frame so the record points at their caller.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    page_name = get_page_name()
+    if not is_sampled(level, model_id, page_name):
+        logging_stats['sampled_out'] += 1
+        return
+    logging_stats['records'] += 1
+
+    record_fields = { 'model': model_id } if model_id is not None else {}
+    if page_name:
+        record_fields['page'] = page_name
+    record_fields.update(fields)
+    record_fields.update({ name: Payload(value) for name, value in payloads.items() })
+    logger.log(level, '%s', StructuredMessage(event, record_fields), stacklevel=stacklevel,
+               extra={ 'event': event, 'fields': record_fields })
+
+def log_request(model_id, body, event='Invoking model'):
+    log_event(logging.INFO, event, model_id, payloads={ 'body': body }, stacklevel=3)
+
+def log_response(model_id, response, event='Model response'):
+    log_event(logging.DEBUG, event, model_id, payloads={ 'response': response }, stacklevel=3)
@@ -0,0 +1,173 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Helper utility to summarize documents longer than the context window of a model with map-reduce.
+# The document is split into token budgeted chunks that are summarized concurrently, the chunk summaries
+# are then merged level by level until they fit one final prompt in the requested language.
+import os
+import re
+import hashlib
+import logging
+import threading
+import collections
+import concurrent.futures
+from utils import gen_ai_selector
+from utils import token_counter
+from utils import response_cache
+from utils import hedged_requests
+
+logger = logging.getLogger('gen-ai-invoker')
+
+# Concurrent chunk summaries across all sessions in the process
+SUMMARIZER_MAX_WORKERS = (int)(os.getenv('SUMMARIZER_MAX_WORKERS', '4'))
+# Upper bound of a chunk, smaller chunks summarize faster and in parallel
+SUMMARIZER_CHUNK_TOKENS = (int)(os.getenv('SUMMARIZER_CHUNK_TOKENS', '3000'))
+SUMMARIZER_CACHE_ENTRIES = (int)(os.getenv('SUMMARIZER_CACHE_ENTRIES', '2048'))
+# Guards against a model whose summaries do not shrink the text
+SUMMARIZER_MAX_LEVELS = 5
+
+# Map and intermediate reduce prompts are language neutral, so their summaries are reused across output languages
+MAP_INSTRUCTION = 'Summarize this section of a longer document in at most 150 words, keeping the key facts, figures and names: '
+REDUCE_INSTRUCTION = 'Combine these summaries of consecutive sections of a document into one summary of at most 200 words, keeping the key facts, figures and names: '
+SECTION_SEPARATOR = '\n\n'
+
+LINE_PATTERN = re.compile(r'\n+')
+
+summary_cache = collections.OrderedDict()
+summary_cache_lock = threading.Lock()
+
+summarizer_stats = collections.Counter()
+
+# Worker threads carry the streamlit context of the caller so the chunk invocations are added to its cost
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=SUMMARIZER_MAX_WORKERS, thread_name_prefix='summarizer')
+
+
+def get_summarizer_stats():
+    return dict(summarizer_stats)
+
+def make_summary_key(model_id, instruction, text):
+    return hashlib.sha256('\0'.join([ model_id, instruction, text ]).encode('utf-8')).hexdigest()
+
+def cache_get(key):
+    with summary_cache_lock:
+        summary = summary_cache.get(key)
+        if summary is not None:
+            summary_cache.move_to_end(key)
+        return summary
+
+def cache_put(key, summary):
+    with summary_cache_lock:
+        summary_cache[key] = summary
+        summary_cache.move_to_end(key)
+        while len(summary_cache) > SUMMARIZER_CACHE_ENTRIES:
+            summary_cache.popitem(last=False)
+
+def split_into_chunks(text, model_id, chunk_tokens):
+
+    # Lines are packed whole into chunks, a line longer than a chunk is cut at token boundaries
+    paragraphs = [ paragraph.strip() for paragraph in LINE_PATTERN.split(text) if paragraph.strip() ]
+    paragraph_tokens = token_counter.count_tokens_batch(paragraphs, model_id)
+
+    chunks = []
+    current_paragraphs = []
+    current_tokens = 0
+    for paragraph, tokens in zip(paragraphs, paragraph_tokens):
+        if current_paragraphs and current_tokens + tokens > chunk_tokens:
+            chunks.append('\n'.join(current_paragraphs))
+            current_paragraphs = []
+            current_tokens = 0
+
+        while tokens > chunk_tokens:
+            # A single word piece longer than a chunk (base64, tables without spaces) is cut by characters
+            piece = token_counter.truncate_to_tokens(paragraph, chunk_tokens, model_id) or paragraph[:chunk_tokens]
+            chunks.append(piece)
+            paragraph = paragraph[len(piece):].strip()
+            tokens = token_counter.count_tokens(paragraph, model_id)
+
+        if paragraph:
+            current_paragraphs.append(paragraph)
+            current_tokens += int(tokens)
+
+    if current_paragraphs:
+        chunks.append('\n'.join(current_paragraphs))
+    return chunks
+
+def summarize_section(model, instruction, text):
+    key = make_summary_key(model['model_id'], instruction, text)
+    summary = cache_get(key)
+    if summary is not None:
+        summarizer_stats['cache_hits'] += 1
+        return summary
+
+    summarizer_stats['sections'] += 1
+    summary = model['func'](instruction + text, use_cache=True)
+    if response_cache.is_cacheable_response(summary):
+        cache_put(key, summary)
+    return summary
+
+def submit_with_context(func, *args):
+    # Carries the streamlit context, trace span and cost collector of the caller, see hedged_requests.with_context
+    return executor.submit(hedged_requests.with_context(func, *args))
+
+def summarize_sections(model, instruction, sections):
+    # Results keep the order of the sections, failed sections are dropped from the next level
+    futures = [ submit_with_context(summarize_section, model, instruction, section) for section in sections ]
+    summaries = []
+    for future in futures:
+        summary = future.result()
+        if response_cache.is_cacheable_response(summary):
+            summaries.append(summary.strip())
+        else:
+            logger.warning('Dropped section summary for model: {}, response: {}'.format(model['model_id'], summary))
+    return summaries
+
+def get_section_budget(model, instruction):
+    budget = token_counter.get_prompt_budget(model) - token_counter.count_tokens(instruction, model['model_id'])
+    return max(1, min(budget, SUMMARIZER_CHUNK_TOKENS))
+
+def reduce_to_budget(model, text, budget):
+
+    # Merges summaries level by level until the text fits the budget of the final prompt
+    level = 0
+    while token_counter.count_tokens(text, model['model_id']) > budget and level < SUMMARIZER_MAX_LEVELS:
+        instruction = MAP_INSTRUCTION if level == 0 else REDUCE_INSTRUCTION
+        sections = split_into_chunks(text, model['model_id'], get_section_budget(model, instruction))
+        logger.info('Summarizing {} sections at level {} for model: {}'.format(len(sections), level, model['model_id']))
+        summaries = summarize_sections(model, instruction, sections)
+        if not summaries:
+            break
+        text = SECTION_SEPARATOR.join(summaries)
+        level += 1
+
+    summarizer_stats['levels'] += level
+    return text
+
+def summarize(text, model, instruction, container=None):
+    """
+    Summarizes a document of any length with the model entry, instruction is the final prompt prefix,
+    for example the requested length and output language. Documents that fit the context window go to
+    the model in one call. When a streamlit container is given the final summary is streamed into it.
+    Returns the summary text.
+    """
+    final_budget = token_counter.get_prompt_budget(model) - token_counter.count_tokens(instruction, model['model_id'])
+    reduced_text = reduce_to_budget(model, text, final_budget)
+    prompt_text = ''.join(token_counter.fit_to_budget([ instruction, reduced_text ], model, truncatable=[ 1 ]))
+
+    if container is not None:
+        return gen_ai_selector.write_stream(model, prompt_text, container, use_cache=True)
+    return model['func'](prompt_text, use_cache=True)
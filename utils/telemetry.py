@@ -0,0 +1,390 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Helper utility to trace model invocations and AWS calls as spans and export them as metrics.
+# Model spans wrap the model functions of gen_ai_selector, AWS spans come from botocore events on every
+# client handed out by aws_session_helper and nest under the model span of the same thread. Finished
+# spans feed Prometheus metrics served on TELEMETRY_METRICS_PORT, OpenTelemetry spans when the
+# opentelemetry package is installed, and the recent spans of each streamlit session.
+import os
+import time
+import uuid
+import bisect
+import logging
+import threading
+import collections
+import functools
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+logger = logging.getLogger('gen-ai-invoker')
+
+TELEMETRY_ENABLED = os.getenv('TELEMETRY_ENABLED', 'true').lower() == 'true'
+# Prometheus text metrics are served on this port when set, e.g. 9464
+TELEMETRY_METRICS_PORT = (int)(os.getenv('TELEMETRY_METRICS_PORT', '0'))
+TELEMETRY_OTEL_ENABLED = os.getenv('TELEMETRY_OTEL_ENABLED', 'false').lower() == 'true' and otel_trace is not None
+TELEMETRY_SIDEBAR_ENABLED = os.getenv('TELEMETRY_SIDEBAR_ENABLED', 'false').lower() == 'true'
+TELEMETRY_SESSION_SPANS = (int)(os.getenv('TELEMETRY_SESSION_SPANS', '20'))
+
+MODEL_SPAN = 'model'
+AWS_SPAN = 'aws'
+SESSION_SPANS_KEY = 'telemetry_spans'
+
+# Histogram bucket upper bounds in seconds
+DURATION_BUCKETS = [ 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300 ]
+
+
+class Span:
+
+    def __init__(self, kind, name, parent=None, **attributes):
+        self.span_id = uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.name = name
+        self.parent = parent
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration = None
+        self.ttfb = None
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.attempts = 0
+        self.retries = 0
+        self.aws_calls = 0
+        self.cache = None
+        self.status = 'ok'
+        self.error = None
+        self.otel_span = None
+
+    def mark_first_byte(self):
+        if self.ttfb is None:
+            self.ttfb = time.time() - self.start
+
+    def to_dict(self):
+        span = { 'span_id': self.span_id, 'parent_id': self.parent.span_id if self.parent else None, 'kind': self.kind,
+                 'name': self.name, 'start': self.start, 'duration': self.duration, 'ttfb': self.ttfb,
+                 'request_bytes': self.request_bytes, 'response_bytes': self.response_bytes, 'input_tokens': self.input_tokens,
+                 'output_tokens': self.output_tokens, 'retries': self.retries, 'aws_calls': self.aws_calls, 'cache': self.cache,
+                 'status': self.status, 'error': self.error }
+        span.update(self.attributes)
+        return span
+
+
+span_local = threading.local()
+
+def get_span_stack():
+    stack = getattr(span_local, 'stack', None)
+    if stack is None:
+        stack = []
+        span_local.stack = stack
+    return stack
+
+def get_current_span():
+    stack = get_span_stack()
+    return stack[-1] if stack else None
+
+@contextlib.contextmanager
+def use_span(span):
+    # Makes a span started on another thread the parent of the spans of this thread, without ending it
+    if span is None:
+        yield
+        return
+    stack = get_span_stack()
+    stack.append(span)
+    try:
+        yield
+    finally:
+        stack.remove(span)
+
+# Entries list of the gen_ai_selector.collect_costs() active on this thread
+cost_local = threading.local()
+
+def get_cost_entries():
+    return getattr(cost_local, 'entries', None)
+
+@contextlib.contextmanager
+def use_cost_entries(entries):
+    # Saves the costs of the calls of this thread in a collector, also one started on another thread like use_span
+    previous_entries = get_cost_entries()
+    cost_local.entries = entries
+    try:
+        yield
+    finally:
+        cost_local.entries = previous_entries
+
+def start_span(kind, name, **attributes):
+    parent = get_current_span()
+    span = Span(kind, name, parent, **attributes)
+    if TELEMETRY_OTEL_ENABLED:
+        context = otel_trace.set_span_in_context(parent.otel_span) if parent is not None and parent.otel_span is not None else None
+        span.otel_span = otel_trace.get_tracer('gen-ai-invoker').start_span(name, context=context, start_time=int(span.start*1e9))
+    get_span_stack().append(span)
+    return span
+
+def end_span(span, error=None):
+    span.duration = time.time() - span.start
+    if error is not None:
+        span.status = 'error'
+        span.error = str(error)[:200]
+    stack = get_span_stack()
+    if span in stack:
+        stack.remove(span)
+
+    parent = span.parent
+    if parent is not None and span.kind == AWS_SPAN:
+        # The model span sees the bytes, first byte and retries of the AWS calls it made
+        parent.aws_calls += 1
+        parent.request_bytes += span.request_bytes
+        parent.response_bytes += span.response_bytes
+        parent.retries += span.retries
+        if parent.ttfb is None and span.ttfb is not None:
+            parent.ttfb = span.start + span.ttfb - parent.start
+
+    if span.kind == MODEL_SPAN and span.cache is None:
+        span.cache = 'miss' if span.aws_calls else 'none'
+
+    record_metrics(span)
+    if span.otel_span is not None:
+        span.otel_span.set_attributes({ key: value for key, value in span.to_dict().items() if isinstance(value, (str, int, float, bool)) })
+        span.otel_span.end(end_time=int((span.start + span.duration)*1e9))
+    if parent is None:
+        save_session_span(span)
+
+def record_retry():
+    span = get_current_span()
+    if span is not None:
+        span.retries += 1
+
+def record_tokens(input_tokens, output_tokens):
+    span = get_current_span()
+    if span is not None:
+        span.input_tokens += input_tokens
+        span.output_tokens += output_tokens
+
+def record_cache_status(cache_status):
+    # Called by the caching layers, the outermost model span keeps the first status set
+    span = get_current_span()
+    if span is not None and span.cache is None:
+        span.cache = cache_status
+
+def save_session_span(span):
+    # Only spans finished by a streamlit script thread (or a worker carrying its context) belong to a session
+    if get_script_run_ctx() is None:
+        return
+    try:
+        session_spans = st.session_state.get(SESSION_SPANS_KEY)
+        if session_spans is None:
+            session_spans = collections.deque(maxlen=TELEMETRY_SESSION_SPANS)
+            st.session_state[SESSION_SPANS_KEY] = session_spans
+        session_spans.append(span.to_dict())
+    except Exception as e1:
+        logger.debug('Unable to save span in session: {}'.format(e1))
+
+def get_session_spans():
+    if get_script_run_ctx() is None:
+        return []
+    return list(st.session_state.get(SESSION_SPANS_KEY, []))
+
+
+class Histogram:
+
+    def __init__(self):
+        self.counts = [0]*(len(DURATION_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(DURATION_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+metrics_lock = threading.Lock()
+counters = collections.Counter()
+histograms = {}
+
+def record_metrics(span):
+    labels = (('kind', span.kind), ('name', span.name), ('status', span.status))
+    with metrics_lock:
+        counters[('genai_calls_total', labels)] += 1
+        counters[('genai_request_bytes_total', labels)] += span.request_bytes
+        counters[('genai_response_bytes_total', labels)] += span.response_bytes
+        counters[('genai_retries_total', labels)] += span.retries
+        counters[('genai_tokens_total', labels + (('direction', 'input'),))] += span.input_tokens
+        counters[('genai_tokens_total', labels + (('direction', 'output'),))] += span.output_tokens
+        if span.cache is not None:
+            counters[('genai_cache_total', labels + (('cache', span.cache),))] += 1
+        histograms.setdefault(('genai_call_duration_seconds', labels), Histogram()).observe(span.duration)
+        if span.ttfb is not None:
+            histograms.setdefault(('genai_call_first_byte_seconds', labels), Histogram()).observe(span.ttfb)
+
+def format_labels(labels, extra=()):
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('"', '\\"')) for key, value in labels + extra) + '}'
+
+def render_metrics():
+    # Prometheus text exposition format, scraped by Prometheus or the OpenTelemetry collector
+    lines = []
+    with metrics_lock:
+        for metric in sorted({ metric for metric, labels in counters }):
+            lines.append('# TYPE {} counter'.format(metric))
+            lines.extend('{}{} {}'.format(metric, format_labels(labels), value) for (name, labels), value in counters.items() if name == metric)
+        for metric in sorted({ metric for metric, labels in histograms }):
+            lines.append('# TYPE {} histogram'.format(metric))
+            for (name, labels), histogram in histograms.items():
+                if name != metric:
+                    continue
+                cumulative = 0
+                for bound, count in zip(DURATION_BUCKETS + [ '+Inf' ], histogram.counts):
+                    cumulative += count
+                    lines.append('{}_bucket{} {}'.format(metric, format_labels(labels, (('le', bound),)), cumulative))
+                lines.append('{}_sum{} {}'.format(metric, format_labels(labels), histogram.sum))
+                lines.append('{}_count{} {}'.format(metric, format_labels(labels), histogram.count))
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        payload = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+metrics_server = None
+metrics_server_lock = threading.Lock()
+
+def start_metrics_server(port=TELEMETRY_METRICS_PORT):
+    global metrics_server
+
+    # Once per process, streamlit reruns the pages but imports the helpers only once
+    with metrics_server_lock:
+        if metrics_server is not None or port <= 0:
+            return
+        try:
+            metrics_server = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+        except OSError as e1:
+            logger.warning('Unable to serve metrics on port {}: {}'.format(port, e1))
+            return
+        metrics_server.daemon_threads = True
+        threading.Thread(target=metrics_server.serve_forever, name='telemetry-metrics', daemon=True).start()
+        logger.info('Serving Prometheus metrics on port: {}'.format(port))
+
+
+def on_before_call(model, context, **kwargs):
+    context['telemetry_span'] = start_span(AWS_SPAN, '{}.{}'.format(model.service_model.service_id.hyphenize(), model.name))
+
+def on_before_send(request, **kwargs):
+    # Sent once per attempt, botocore retries show up as extra attempts
+    span = get_current_span()
+    if span is None or span.kind != AWS_SPAN:
+        return
+    span.attempts += 1
+    span.retries = span.attempts - 1
+    body = request.body
+    span.request_bytes = len(body) if isinstance(body, (bytes, str)) else span.request_bytes
+
+def on_after_call(http_response, context, **kwargs):
+    # Streaming bodies (InvokeModel, GetObject) are not read yet, so this is the time to the response headers
+    span = context.pop('telemetry_span', None)
+    if span is None:
+        return
+    span.mark_first_byte()
+    span.response_bytes = int(http_response.headers.get('content-length', 0))
+    span.attributes['http_status'] = http_response.status_code
+    end_span(span, error='HTTP {}'.format(http_response.status_code) if http_response.status_code >= 300 else None)
+
+def on_after_call_error(exception, context, **kwargs):
+    span = context.pop('telemetry_span', None)
+    if span is not None:
+        end_span(span, error=exception)
+
+def instrument_client(client):
+    # Only botocore clients have an event system, stand-ins such as the fakes of the benchmarks are left as they are
+    events = getattr(getattr(client, 'meta', None), 'events', None)
+    if not TELEMETRY_ENABLED or events is None:
+        return client
+    events.register('before-call', on_before_call)
+    events.register('before-send', on_before_send)
+    events.register('after-call', on_after_call)
+    events.register('after-call-error', on_after_call_error)
+    return client
+
+def traced_model_func(model_id, func):
+
+    @functools.wraps(func)
+    def traced_func(prompt_text, *args, **kwargs):
+        if not TELEMETRY_ENABLED:
+            return func(prompt_text, *args, **kwargs)
+
+        span = start_span(MODEL_SPAN, model_id, model_id=model_id, streaming=False)
+        try:
+            response = func(prompt_text, *args, **kwargs)
+        except BaseException as e1:
+            end_span(span, error=e1)
+            raise
+
+        # The model functions return errors as strings or exception objects
+        is_error = isinstance(response, Exception) or (isinstance(response, str) and response.startswith('Error'))
+        end_span(span, error=response if is_error else None)
+        return response
+
+    return traced_func
+
+def traced_model_stream(model_id, stream_func):
+
+    # The span stays current while the caller consumes tokens, time to first byte is the first token
+    @functools.wraps(stream_func)
+    def traced_stream(prompt_text, *args, **kwargs):
+        if not TELEMETRY_ENABLED:
+            yield from stream_func(prompt_text, *args, **kwargs)
+            return
+
+        span = start_span(MODEL_SPAN, model_id, model_id=model_id, streaming=True)
+        error = None
+        first_token = None
+        try:
+            for token in stream_func(prompt_text, *args, **kwargs):
+                if first_token is None:
+                    first_token = token
+                    span.attributes['first_token'] = time.time() - span.start
+                yield token
+        except BaseException as e1:
+            error = e1
+            raise
+        finally:
+            if error is None and isinstance(first_token, str) and first_token.startswith('Error'):
+                error = first_token
+            end_span(span, error=error)
+
+    return traced_stream
+
+start_metrics_server()
@@ -0,0 +1,235 @@
+"""
+MIT No Attribution
+
+Copyright 2023 Amazon Web Services
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Helper utility to count tokens per model provider and fit prompts into the context window of a model.
+# Claude prompts are counted with the Anthropic tokenizer when it can be loaded, other providers use an
+# estimator calibrated per provider on word pieces.
+import os
+import re
+import inspect
+import logging
+import threading
+import functools
+import numpy as np
+import anthropic
+
+logger = logging.getLogger('gen-ai-invoker')
+
+TOKEN_COUNTER_USE_TOKENIZERS = os.getenv('TOKEN_COUNTER_USE_TOKENIZERS', 'true').lower() == 'true'
+# Share of the budget held back when counts are estimated rather than exact
+TOKEN_BUDGET_ESTIMATE_MARGIN = (float)(os.getenv('TOKEN_BUDGET_ESTIMATE_MARGIN', '0.1'))
+DEFAULT_CONTEXT_WINDOW = 4096
+DEFAULT_RESERVED_OUTPUT_TOKENS = 1024
+
+# Matched against model ids as substrings, the longest match wins
+MODEL_CONTEXT_WINDOWS = {
+    'claude-3': 200000,
+    'claude-v3': 200000,
+    'claude-v2:1': 200000,
+    'claude-v2': 100000,
+    'claude-instant': 100000,
+    'claude-v1': 9000,
+    'claude-v1-100k': 100000,
+    'titan-text-lite': 4096,
+    'titan-text-express': 8192,
+    'titan-embed': 8192,
+    'llama2': 4096,
+    'llama-2': 4096,
+    'mistral-7b': 32000,
+    'mixtral-8x7b': 32000,
+    'mistral-8x7b': 32000,
+    'j2': 8191,
+    'cohere': 4096,
+    'command': 4096,
+    'falcon': 2048,
+    'flan-t5': 512
+}
+
+PROVIDER_KEYWORDS = [
+    ('claude', 'anthropic'),
+    ('titan', 'amazon'),
+    ('llama', 'meta'),
+    ('mistral', 'mistral'),
+    ('mixtral', 'mistral'),
+    ('j2', 'ai21'),
+    ('ai21', 'ai21'),
+    ('cohere', 'cohere'),
+    ('command', 'cohere')
+]
+
+# Characters per token within a word, calibrated against the provider tokenizers on English prose.
+# Punctuation and symbols count as one token each.
+PROVIDER_CHARS_PER_TOKEN = {
+    'anthropic': 4.5,
+    'amazon': 4.2,
+    'meta': 3.6,
+    'mistral': 3.6,
+    'ai21': 6.0,
+    'cohere': 4.5,
+    'default': 4.0
+}
+
+WORD_PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Models tokenized by the Claude tokenizer shipped with the anthropic SDK. Claude 3 models use another
+# tokenizer, their counts are an approximation and their budgets keep the estimate margin
+EXACT_CLAUDE_KEYWORDS = [ 'claude-v1', 'claude-v2', 'claude-instant' ]
+
+claude_tokenizer = None
+claude_tokenizer_failed = False
+claude_tokenizer_lock = threading.Lock()
+
+
+def get_provider(model_id):
+    model_id = model_id.lower()
+    for keyword, provider in PROVIDER_KEYWORDS:
+        if keyword in model_id:
+            return provider
+    return 'default'
+
+def get_context_window(model_id):
+    matches = [ key for key in MODEL_CONTEXT_WINDOWS if key in model_id.lower() ]
+    if not matches:
+        return DEFAULT_CONTEXT_WINDOW
+    return MODEL_CONTEXT_WINDOWS[max(matches, key=len)]
+
+def get_claude_tokenizer():
+    global claude_tokenizer, claude_tokenizer_failed
+
+    # The tokenizer file is downloaded once per container, fall back to the estimator if that fails
+    if claude_tokenizer is not None or claude_tokenizer_failed or not TOKEN_COUNTER_USE_TOKENIZERS:
+        return claude_tokenizer
+
+    with claude_tokenizer_lock:
+        if claude_tokenizer is None and not claude_tokenizer_failed:
+            try:
+                claude_tokenizer = anthropic.get_tokenizer()
+            except Exception as e1:
+                logger.warning('Unable to load the Claude tokenizer, using estimated token counts: {}'.format(e1))
+                claude_tokenizer_failed = True
+    return claude_tokenizer
+
+def get_tokenizer(model_id):
+    return get_claude_tokenizer() if get_provider(model_id) == 'anthropic' else None
+
+def is_exact(model_id):
+    return get_tokenizer(model_id) is not None and any(keyword in model_id.lower() for keyword in EXACT_CLAUDE_KEYWORDS)
+
+@functools.lru_cache(maxsize=32)
+def get_token_boundaries(text, tokenizer_name):
+
+    # Returns the end offset of each token (or word piece) and the running token count at that offset
+    if tokenizer_name == 'claude':
+        offsets = get_claude_tokenizer().encode(text).offsets
+        ends = np.fromiter((end for start, end in offsets), dtype=np.int64, count=len(offsets))
+        return ends, np.arange(1, len(ends) + 1, dtype=np.int64)
+
+    pieces = list(WORD_PIECE_PATTERN.finditer(text))
+    ends = np.fromiter((piece.end() for piece in pieces), dtype=np.int64, count=len(pieces))
+    lengths = np.fromiter((piece.end() - piece.start() for piece in pieces), dtype=np.int64, count=len(pieces))
+    piece_tokens = np.ceil(lengths/PROVIDER_CHARS_PER_TOKEN[tokenizer_name]).astype(np.int64)
+    return ends, np.cumsum(piece_tokens)
+
+def get_tokenizer_name(model_id):
+    return 'claude' if get_tokenizer(model_id) is not None else get_provider(model_id)
+
+def count_tokens(text, model_id):
+    text = text.decode('utf-8', errors='ignore') if isinstance(text, bytes) else str(text)
+    if not text:
+        return 0
+    return int(count_tokens_batch([ text ], model_id)[0])
+
+def count_tokens_batch(texts, model_id):
+    tokenizer = get_tokenizer(model_id)
+    if tokenizer is not None:
+        return np.array([ len(encoding.ids) for encoding in tokenizer.encode_batch(list(texts)) ], dtype=np.int64)
+
+    # One regex pass per text, the piece lengths are converted to tokens in a single numpy operation
+    chars_per_token = PROVIDER_CHARS_PER_TOKEN[get_provider(model_id)]
+    piece_counts = []
+    piece_lengths = []
+    for text in texts:
+        lengths = [ len(piece) for piece in WORD_PIECE_PATTERN.findall(text) ]
+        piece_counts.append(len(lengths))
+        piece_lengths.extend(lengths)
+
+    piece_tokens = np.ceil(np.asarray(piece_lengths, dtype=np.float64)/chars_per_token).astype(np.int64)
+    cumulative_tokens = np.concatenate([ [0], np.cumsum(piece_tokens) ])
+    piece_ends = np.cumsum(piece_counts, dtype=np.int64)
+    return cumulative_tokens[piece_ends] - cumulative_tokens[piece_ends - np.asarray(piece_counts, dtype=np.int64)]
+
+def truncate_to_tokens(text, max_tokens, model_id):
+    if max_tokens <= 0:
+        return ''
+
+    ends, cumulative_tokens = get_token_boundaries(text, get_tokenizer_name(model_id))
+    if len(ends) == 0 or cumulative_tokens[-1] <= max_tokens:
+        return text
+
+    fitting = int(np.searchsorted(cumulative_tokens, max_tokens, side='right'))
+    return text[:ends[fitting - 1]] if fitting > 0 else ''
+
+def get_model_id(model):
+    return model['model_id'] if isinstance(model, dict) else model
+
+def get_reserved_output_tokens(model):
+
+    # Use the default max tokens of the model function, capped to half of the context window
+    context_window = get_context_window(get_model_id(model))
+    reserved_output_tokens = DEFAULT_RESERVED_OUTPUT_TOKENS
+    if isinstance(model, dict) and model.get('func') is not None:
+        parameters = inspect.signature(model['func']).parameters
+        for name in [ 'max_tokens', 'max_new_tokens', 'max_length' ]:
+            if name in parameters and isinstance(parameters[name].default, int):
+                reserved_output_tokens = parameters[name].default
+                break
+    return min(reserved_output_tokens, context_window//2)
+
+def get_prompt_budget(model, reserved_output_tokens=None):
+    model_id = get_model_id(model)
+    if reserved_output_tokens is None:
+        reserved_output_tokens = get_reserved_output_tokens(model)
+
+    budget = get_context_window(model_id) - reserved_output_tokens
+    if not is_exact(model_id):
+        budget = int(budget*(1 - TOKEN_BUDGET_ESTIMATE_MARGIN))
+    return budget
+
+def fit_to_budget(prompt_parts, model, reserved_output_tokens=None, truncatable=None):
+    """
+    Packs the prompt parts into the context window of the model, less the tokens reserved for the output.
+    model is a model entry from gen_ai_selector or a model id. Parts listed in truncatable (by default the
+    longest part) are cut at a token boundary to fit, in order, the other parts are always kept whole.
+    Returns the list of fitted parts, in the given order.
+    """
+    model_id = get_model_id(model)
+    prompt_parts = [ str(part) for part in prompt_parts ]
+    if truncatable is None:
+        truncatable = [ max(range(len(prompt_parts)), key=lambda index: len(prompt_parts[index])) ] if prompt_parts else []
+
+    part_tokens = count_tokens_batch(prompt_parts, model_id)
+    remaining_tokens = get_prompt_budget(model, reserved_output_tokens) - sum(int(part_tokens[index]) for index in range(len(prompt_parts)) if index not in truncatable)
+
+    fitted_parts = list(prompt_parts)
+    for index in truncatable:
+        if part_tokens[index] > remaining_tokens:
+            fitted_parts[index] = truncate_to_tokens(prompt_parts[index], remaining_tokens, model_id)
+            logger.info('Fitted prompt part to {} of {} tokens for model: {}'.format(max(remaining_tokens, 0), part_tokens[index], model_id))
+        remaining_tokens -= min(int(part_tokens[index]), max(remaining_tokens, 0))
+
+    return fitted_parts